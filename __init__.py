@@ -1,4 +1,4 @@
-from pydotmailer import *
+from .pydotmailer import *
 
 __author__ = 'Mike Austin'
 __copyright__ = 'Copyright 2012, Mike Austin'
@@ -0,0 +1,63 @@
+""" Benchmark PyDotMailer construction time, cold (WSDL downloaded and parsed) vs warm (cached definition).
+Usage:
+    python benchmarks/bench_construction.py [--api-url URL] [--repeat N]
+Run from the repository root. No dotMailer account is needed: constructing the client only fetches the WSDL.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..'))  # the package's parent
+
+from pydotmailer import dotmailerwsdlcache
+from pydotmailer.pydotmailer import PyDotMailer
+
+
+def time_construction(repeat, **kwargs):
+    """ @return list of seconds taken by each of repeat constructions """
+    timings = []
+    for _ in range(repeat):
+        started = time.time()
+        PyDotMailer(api_username='benchmark', api_password='benchmark', **kwargs)
+        timings.append(time.time() - started)
+    return timings
+
+
+def report(label, timings):
+    print('%-40s min %8.2f ms  mean %8.2f ms  (n=%d)' % (label, min(timings) * 1000.0,
+                                                         sum(timings) * 1000.0 / len(timings), len(timings)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--api-url', default=None, help='WSDL URL, e.g. of a local stand-in server')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    cache_location = tempfile.mkdtemp(prefix='pydotmailer-bench-')
+    kwargs = {'api_url': args.api_url, 'wsdl_cache_location': cache_location}
+    try:
+        report('cold, no cache', time_construction(args.repeat, api_url=args.api_url, use_wsdl_cache=False))
+        report('cold process, warm disk cache', _time_disk_only(args.repeat, kwargs))
+        time_construction(1, **kwargs)  # make sure the in-process definition is loaded
+        report('warm, shared in-process definition', time_construction(args.repeat, **kwargs))
+    finally:
+        shutil.rmtree(cache_location, ignore_errors=True)
+
+
+def _time_disk_only(repeat, kwargs):
+    """ Simulate a fresh worker process: forget the in-process definition before each construction,
+    so only the on-disk cache can help. """
+    time_construction(1, **kwargs)  # populate the disk cache
+    timings = []
+    for _ in range(repeat):
+        dotmailerwsdlcache._shared_clients.clear()
+        timings.extend(time_construction(1, **kwargs))
+    return timings
+
+
+if __name__ == '__main__':
+    main()
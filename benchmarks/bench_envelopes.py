@@ -0,0 +1,75 @@
+""" Benchmark the CPU cost per call of building SOAP requests with suds vs the precompiled templates (fast_path).
+Usage:
+    python benchmarks/bench_envelopes.py [--api-url URL] [--calls N] [--round-trip]
+Run from the repository root. Building requests needs only the WSDL, no dotMailer account. With --round-trip the
+calls are also made, so point --api-url at a local stand-in server rather than dotMailer.
+CPU time is measured with time.process_time, so time spent waiting on the server isn't counted.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..'))  # the package's parent
+
+from pydotmailer.dotmailerenvelopes import render_envelope
+from pydotmailer.pydotmailer import PyDotMailer
+
+try:
+    cpu_time = time.process_time
+except AttributeError:
+    cpu_time = time.clock  # Python 2
+
+CALLS = [
+    ('SendCampaignToContact', {'username': 'benchmark', 'password': 'benchmark', 'campaignId': 1234567,
+                               'contactid': 367568124, 'sendDate': '2012-03-28T19:51:00'}),
+    ('GetContactByEmail', {'username': 'benchmark', 'password': 'benchmark', 'email': 'test@example.com'}),
+    ('GetContactById', {'username': 'benchmark', 'password': 'benchmark', 'id': 367568124}),
+]
+
+
+def time_cpu(func, calls):
+    """ @return CPU seconds per call of func() """
+    started = cpu_time()
+    for _ in range(calls):
+        func()
+    return (cpu_time() - started) / calls
+
+
+def report(label, suds_seconds, fast_seconds):
+    print('%-40s suds %8.1f us  fast_path %8.1f us  (%.1fx)' % (label, suds_seconds * 1e6, fast_seconds * 1e6,
+                                                                suds_seconds / max(fast_seconds, 1e-9)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--api-url', default=None, help='WSDL URL, e.g. of a local stand-in server')
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--round-trip', action='store_true', help='also make the calls, through PyDotMailer')
+    args = parser.parse_args()
+
+    dot_mailer = PyDotMailer(api_username='benchmark', api_password='benchmark', api_url=args.api_url)
+    client = dot_mailer.client
+    client.set_options(nosend=True)  # suds builds the request, including DotMailerSudsPlugin, but doesn't send it
+    for operation, kwargs in CALLS:
+        service_method = getattr(client.service, operation)
+        report('build %s' % operation,
+               time_cpu(lambda: service_method(**kwargs), args.calls),
+               time_cpu(lambda: render_envelope(operation, kwargs), args.calls))
+    client.set_options(nosend=False)
+
+    if args.round_trip:
+        fast_dot_mailer = PyDotMailer(api_username='benchmark', api_password='benchmark', api_url=args.api_url,
+                                      fast_path=True)
+        for label, call in [('round trip send_campaign_to_contact',
+                             lambda dm: dm.send_campaign_to_contact(1234567, 367568124)),
+                            ('round trip get_contact_by_email',
+                             lambda dm: dm.get_contact_by_email('test@example.com')),
+                            ('round trip get_contact_by_id',
+                             lambda dm: dm.get_contact_by_id(367568124))]:
+            report(label, time_cpu(lambda: call(dot_mailer), args.calls // 10 or 1),
+                   time_cpu(lambda: call(fast_dot_mailer), args.calls // 10 or 1))
+
+
+if __name__ == '__main__':
+    main()
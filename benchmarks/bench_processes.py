@@ -0,0 +1,62 @@
+""" Benchmark send_campaign_to_contacts_in_processes (dotmailerprocesses) against the local stand-in server with
+1, 2, ... N worker processes, to see how sends scale with cores, alongside send_campaign_to_contacts in one process.
+Usage:
+    python benchmarks/bench_processes.py [--contacts N] [--max-processes N] [--max-workers N] [--latency SECONDS]
+Run from the repository root. The stand-in server runs in a process of its own, so with many workers it can become
+the bottleneck itself; watch its CPU, or pass --api-url to use one that's already running elsewhere.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..'))  # the package's parent
+
+from pydotmailer.pydotmailer import PyDotMailer
+from pydotmailer.dotmailerprocesses import send_campaign_to_contacts_in_processes
+from bench_suite import CAMPAIGN_ID, seed_contacts, start_server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--api-url', default=None, help='WSDL URL of a stand-in server that is already running')
+    parser.add_argument('--port', type=int, default=18182, help='port for the stand-in server started here')
+    parser.add_argument('--latency', type=float, default=0.0, help="stand-in server's seconds per call")
+    parser.add_argument('--contacts', type=int, default=2000, help='contacts sent to in each run')
+    parser.add_argument('--max-processes', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--max-workers', type=int, default=10, help='concurrent calls per process')
+    parser.add_argument('--fast-path', action='store_true')
+    args = parser.parse_args()
+
+    process = None
+    api_url = args.api_url
+    if not api_url:
+        process, api_url = start_server(args.port, args.latency)
+    try:
+        dot_mailer = PyDotMailer(api_username='benchmark', api_password='benchmark', api_url=api_url,
+                                 fast_path=args.fast_path)
+        emails, seeded_contact_ids = seed_contacts(dot_mailer)
+        contact_ids = [seeded_contact_ids[number % len(seeded_contact_ids)] for number in range(args.contacts)]
+        print('%-12s %9s %9s %7s' % ('processes', 'sends/s', 'seconds', 'failed'))
+        started = time.time()
+        failed = sum(1 for contact_id, dict_result in dot_mailer.send_campaign_to_contacts(
+            CAMPAIGN_ID, contact_ids, max_workers=args.max_workers) if not dict_result.get('ok'))
+        seconds = time.time() - started
+        print('%-12s %9.1f %9.2f %7d' % ('in-process', args.contacts / seconds, seconds, failed))
+        processes = 1
+        while processes <= args.max_processes:
+            for _ in send_campaign_to_contacts_in_processes(dot_mailer, CAMPAIGN_ID, contact_ids, processes=processes,
+                                                            max_workers=args.max_workers):
+                pass
+            stats = dot_mailer.last_send_stats
+            print('%-12d %9.1f %9.2f %7d' % (processes, stats['per_second'], stats['seconds'], stats['failed']))
+            processes *= 2
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
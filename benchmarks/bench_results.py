@@ -0,0 +1,64 @@
+""" Benchmark the memory held by a large batch of get_contact_by_email results, as dicts and as compact results,
+with and without the raw suds payload.
+Usage:
+    python benchmarks/bench_results.py [--api-url URL] [--contacts N]
+Run from the repository root, with Python 3 (for tracemalloc). No dotMailer account is needed: the results are made
+by unmarshalling a synthetic GetContactByEmail reply with suds, as a real call would, so only the WSDL is fetched.
+"""
+import argparse
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..'))  # the package's parent
+
+from pydotmailer.dotmailerenvelopes import process_reply
+from pydotmailer.pydotmailer import PyDotMailer
+
+FIELDS = ['FIRSTNAME', 'LASTNAME', 'FULLNAME', 'POSTCODE', 'GENDER', 'CITY']
+REPLY = (u'<?xml version="1.0" encoding="utf-8"?>'
+         u'<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/" '
+         u'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:xsd="http://www.w3.org/2001/XMLSchema">'
+         u'<soap:Body><GetContactByEmailResponse xmlns="http://apiconnector.com"><GetContactByEmailResult>'
+         u'<ID>%d</ID><Email>contact%d@example.com</Email><AudienceType>Unknown</AudienceType><DataFields>'
+         u'<Keys>' + u''.join(u'<string>%s</string>' % field for field in FIELDS) + u'</Keys><Values>' +
+         u''.join(u'<anyType xsi:type="xsd:string">%s %%d</anyType>' % field.lower() for field in FIELDS) +
+         u'</Values></DataFields><OptInType>Unknown</OptInType><EmailType>Html</EmailType>'
+         u'</GetContactByEmailResult></GetContactByEmailResponse></soap:Body></soap:Envelope>')
+
+
+def make_results(dot_mailer, method, contacts):
+    """ @return list of results, made as get_contact_by_email makes them """
+    results = []
+    for contact_number in range(contacts):
+        body = (REPLY % ((contact_number, contact_number) + (contact_number,) * len(FIELDS))).encode('utf-8')
+        return_code = process_reply(method, 200, 'OK', body)
+        dict_result = {'ok': True, 'result': return_code,
+                       'd_fields': dot_mailer._clean_returned_data_fields(data_fields=return_code.DataFields),
+                       'contact_id': return_code.ID, 'email': return_code.Email}
+        results.append(dot_mailer._finish_result(dict_result))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--api-url', default=None, help='WSDL URL, e.g. of a local stand-in server')
+    parser.add_argument('--contacts', type=int, default=20000)
+    args = parser.parse_args()
+
+    for compact_results, keep_raw_results in [(False, True), (False, False), (True, True), (True, False)]:
+        dot_mailer = PyDotMailer(api_username='benchmark', api_password='benchmark', api_url=args.api_url,
+                                 compact_results=compact_results, keep_raw_results=keep_raw_results)
+        method = dot_mailer.client.wsdl.services[0].ports[0].methods['GetContactByEmail']
+        make_results(dot_mailer, method, 10)  # warm up suds
+        tracemalloc.start()
+        results = make_results(dot_mailer, method, args.contacts)
+        held, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print('compact_results=%-5s keep_raw_results=%-5s %7.0f bytes per result held (%.1f MB, peak %.1f MB)'
+              % (compact_results, keep_raw_results, float(held) / len(results), held / 1e6, peak / 1e6))
+        del results
+
+
+if __name__ == '__main__':
+    main()
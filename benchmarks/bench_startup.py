@@ -0,0 +1,76 @@
+""" Benchmark import and first-call cost of pydotmailer, eager vs lazy construction.
+Usage:
+    python benchmarks/bench_startup.py [--api-url URL] [--max-import-ms MS]
+Run from the repository root. Each measurement runs in a fresh interpreter so module caches don't hide the cost.
+Exits non-zero if importing pydotmailer takes longer than --max-import-ms, so it can guard against regressions
+such as suds being imported at module level again.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+# Each snippet prints the elapsed seconds of the step being measured.
+SNIPPET_IMPORT = """
+import time
+started = time.time()
+import pydotmailer
+print(time.time() - started)
+"""
+
+SNIPPET_CONSTRUCT = """
+import time
+from pydotmailer.pydotmailer import PyDotMailer
+started = time.time()
+dot_mailer = PyDotMailer(api_username='benchmark', api_password='benchmark', lazy=%(lazy)s, api_url=%(api_url)r)
+print(time.time() - started)
+"""
+
+SNIPPET_FIRST_CLIENT = """
+import time
+from pydotmailer.pydotmailer import PyDotMailer
+dot_mailer = PyDotMailer(api_username='benchmark', api_password='benchmark', lazy=True, api_url=%(api_url)r)
+started = time.time()
+dot_mailer.client  # what the first service call pays on top of its own round-trip
+print(time.time() - started)
+"""
+
+
+def run_snippet(snippet, repeat):
+    """ @return list of seconds printed by snippet, one fresh interpreter per run """
+    timings = []
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', snippet], cwd=os.path.dirname(ROOT))
+        timings.append(float(output.decode('ascii').strip().splitlines()[-1]))
+    return timings
+
+
+def report(label, timings):
+    print('%-40s min %8.2f ms  mean %8.2f ms  (n=%d)' % (label, min(timings) * 1000.0,
+                                                         sum(timings) * 1000.0 / len(timings), len(timings)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--api-url', default=None, help='WSDL URL, e.g. of a local stand-in server')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-import-ms', type=float, default=None,
+                        help='fail if the fastest import of pydotmailer is slower than this')
+    args = parser.parse_args()
+    params = {'api_url': args.api_url}
+
+    import_timings = run_snippet(SNIPPET_IMPORT, args.repeat)
+    report('import pydotmailer', import_timings)
+    report('construct, lazy=True', run_snippet(SNIPPET_CONSTRUCT % dict(params, lazy=True), args.repeat))
+    report('construct, lazy=False', run_snippet(SNIPPET_CONSTRUCT % dict(params, lazy=False), args.repeat))
+    report('first client use after lazy construct', run_snippet(SNIPPET_FIRST_CLIENT % params, args.repeat))
+
+    if args.max_import_ms is not None and min(import_timings) * 1000.0 > args.max_import_ms:
+        print('FAIL: import took %.2f ms, limit %.2f ms' % (min(import_timings) * 1000.0, args.max_import_ms))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+""" Benchmark each PyDotMailer method against the local stand-in server (tests/fake_dotmailer_server.py): calls per
+second, p50 / p99 latency and memory, serially and from several threads at once.
+Usage:
+    python benchmarks/bench_suite.py [--calls N] [--concurrency N] [--latency SECONDS] [--fast-path]
+                                     [--methods get_contact_by_email,...] [--json results.json] [--profile]
+Run from the repository root. The stand-in server runs in its own process, so its work doesn't compete with the
+client's for the GIL. Pass --api-url to use one that's already running instead. No dotMailer account is needed.
+Memory is the peak traced by tracemalloc (Python 3) over a separate, shorter serial run.
+--profile adds a DotMailerProfiler report of where the time went in each operation (see dotmailerprofiler).
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, '..'))  # the package's parent
+
+from pydotmailer.pydotmailer import PyDotMailer
+from pydotmailer.dotmailerprofiler import DotMailerProfiler
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None  # Python 2
+try:
+    timer = time.perf_counter
+except AttributeError:
+    timer = time.time  # Python 2
+
+CAMPAIGN_ID = 1234
+ADDRESS_BOOK_ID = 5678
+SEED_CONTACTS = 200
+
+
+def start_server(port, latency):
+    """ @return (server process, api_url) """
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'tests', 'fake_dotmailer_server.py'),
+                                '--port', str(port), '--latency', str(latency), '--import-seconds', '0'])
+    api_url = 'http://127.0.0.1:%d/API.asmx?WSDL' % port
+    deadline = time.time() + 10
+    while True:
+        try:
+            PyDotMailer(api_username='benchmark', api_password='benchmark', api_url=api_url, use_wsdl_cache=False)
+            return process, api_url
+        except Exception:
+            if time.time() > deadline:
+                process.kill()
+                raise
+            time.sleep(0.1)
+
+
+def seed_contacts(dot_mailer):
+    """ Add SEED_CONTACTS contacts. @return (emails, contact ids) """
+    emails = ['contact%d@example.com' % number for number in range(SEED_CONTACTS)]
+    csv_data = 'email,firstname,lastname,postcode\n' + ''.join('%s,First%d,Last%d,SW1A %dAA\n' % (email, number,
+                                                                                                  number, number % 10)
+                                                                for number, email in enumerate(emails))
+    dict_result = dot_mailer.add_contacts_to_address_book(ADDRESS_BOOK_ID, csv_data, wait_to_complete_seconds=30)
+    if not dict_result.get('ok'):
+        raise Exception('Seeding contacts failed: %s' % dict_result)
+    contact_ids = [dot_mailer.get_contact_by_email(email).get('contact_id') for email in emails]
+    return emails, contact_ids
+
+
+def method_calls(emails, contact_ids, progress_id):
+    """ @return dict of method name -> function(dot_mailer, call number) """
+    return {
+        'get_contact_by_email': lambda dm, n: dm.get_contact_by_email(emails[n % len(emails)]),
+        'get_contact_by_id': lambda dm, n: dm.get_contact_by_id(contact_ids[n % len(contact_ids)]),
+        'add_contact_to_address_book': lambda dm, n: dm.add_contact_to_address_book(
+            ADDRESS_BOOK_ID, emails[n % len(emails)], {'firstname': 'First%d' % n, 'postcode': 'N1 %dAA' % (n % 10)}),
+        'send_campaign_to_contact': lambda dm, n: dm.send_campaign_to_contact(CAMPAIGN_ID,
+                                                                              contact_ids[n % len(contact_ids)]),
+        'get_contact_import_progress': lambda dm, n: dm.get_contact_import_progress(progress_id),
+        'add_contacts_to_address_book': lambda dm, n: dm.add_contacts_to_address_book(
+            ADDRESS_BOOK_ID, 'email,firstname\n%s,Bulk%d\n' % (emails[n % len(emails)], n)),
+    }
+
+
+def run(call, dot_mailer, calls, concurrency):
+    """ Make calls calls from concurrency threads. @return (latencies, seconds, failures) """
+    latencies = []
+    failures = [0]
+    lock = threading.Lock()
+    next_call = [0]
+
+    def worker():
+        while True:
+            with lock:
+                number = next_call[0]
+                next_call[0] += 1
+            if number >= calls:
+                return
+            started = timer()
+            dict_result = call(dot_mailer, number)
+            latency = timer() - started
+            with lock:
+                latencies.append(latency)
+                if not dict_result.get('ok'):
+                    failures[0] += 1
+
+    started = timer()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, timer() - started, failures[0]
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[int(round(fraction * (len(sorted_values) - 1)))]
+
+
+def peak_memory(call, dot_mailer, calls):
+    """ @return peak bytes traced while making calls calls, or None without tracemalloc """
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    try:
+        for number in range(calls):
+            call(dot_mailer, number)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--api-url', default=None, help='WSDL URL of a stand-in server that is already running')
+    parser.add_argument('--port', type=int, default=18181, help='port for the stand-in server started here')
+    parser.add_argument('--latency', type=float, default=0.0, help="stand-in server's seconds per call")
+    parser.add_argument('--calls', type=int, default=200, help='calls per method, serial and concurrent')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--memory-calls', type=int, default=20)
+    parser.add_argument('--fast-path', action='store_true')
+    parser.add_argument('--methods', default=None, help='comma separated, default all')
+    parser.add_argument('--json', default=None, help='also write the results to this file')
+    parser.add_argument('--profile', action='store_true', help='report the time taken by each phase of the calls')
+    args = parser.parse_args()
+
+    process = None
+    api_url = args.api_url
+    if not api_url:
+        process, api_url = start_server(args.port, args.latency)
+    try:
+        profiler = DotMailerProfiler() if args.profile else None
+        dot_mailer = PyDotMailer(api_username='benchmark', api_password='benchmark', api_url=api_url,
+                                 fast_path=args.fast_path, profiler=profiler)
+        emails, contact_ids = seed_contacts(dot_mailer)
+        if profiler is not None:
+            profiler.reset()  # just the benchmarked calls
+        progress_id = dot_mailer.add_contacts_to_address_book(ADDRESS_BOOK_ID, 'email\n%s\n' % emails[0]) \
+            .get('progress_id')
+        calls = method_calls(emails, contact_ids, progress_id)
+        methods = args.methods.split(',') if args.methods else sorted(calls.keys())
+        results = []
+        print('%-30s %-10s %9s %9s %9s %7s %10s' % ('method', 'mode', 'calls/s', 'p50 ms', 'p99 ms', 'failed',
+                                                    'peak KB'))
+        for method in methods:
+            call = calls[method]
+            call(dot_mailer, 0)  # warm up, e.g. per-thread clients
+            memory = peak_memory(call, dot_mailer, args.memory_calls)
+            for mode, concurrency in (('serial', 1), ('concurrent', args.concurrency)):
+                latencies, seconds, failures = run(call, dot_mailer, args.calls, concurrency)
+                latencies.sort()
+                result = {'method': method, 'mode': mode, 'concurrency': concurrency, 'calls': len(latencies),
+                          'calls_per_second': len(latencies) / seconds, 'p50_ms': percentile(latencies, 0.5) * 1e3,
+                          'p99_ms': percentile(latencies, 0.99) * 1e3, 'failed': failures,
+                          'peak_memory_kb': memory / 1024.0 if memory is not None else None}
+                results.append(result)
+                print('%-30s %-10s %9.1f %9.2f %9.2f %7d %10s' % (
+                    method, mode, result['calls_per_second'], result['p50_ms'], result['p99_ms'], failures,
+                    '%.0f' % result['peak_memory_kb'] if memory is not None else '-'))
+        if profiler is not None:
+            print('')
+            print(profiler.report())
+        if args.json:
+            with open(args.json, 'w') as json_file:
+                json.dump({'latency': args.latency, 'fast_path': args.fast_path, 'results': results}, json_file,
+                          indent=2)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
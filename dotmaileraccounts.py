@@ -0,0 +1,213 @@
+# dotmaileraccounts - Many dotMailer accounts sharing one set of resources, written in Python.
+# Copyright (c) 2012 Triggered Messaging Ltd, released under the MIT license
+# Home page:
+# https://github.com/TriggeredMessaging/pydotmailer/
+# See README and LICENSE files.
+#
+# dotMailer API docs are at http://www.dotmailer.co.uk/api/
+import threading
+from collections import deque
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class AccountPool(object):
+    """
+    A PyDotMailer for each of many dotMailer accounts, and a shared pool of worker threads making their calls.
+    Every account shares one parsed service definition (see dotmailerwsdlcache) and one connection pool, while
+    keeping its own rate limiter (dotMailer's quota is per account) and its own error counts.
+    Queued calls are taken from the accounts in turn, and each account has at most max_in_flight_per_account
+    calls running at once, so a large campaign for one account can't hold up another account's triggered sends.
+    Calls for the same account run in the order they were submitted, up to that limit.
+    """
+    def __init__(self, workers=20, max_in_flight_per_account=5, connection_pool=None, rate_limiter_kwargs=None,
+                 **kwargs):
+        """
+        @param workers number of worker threads, i.e. calls in flight across every account
+        @param max_in_flight_per_account most calls one account may have running at once
+        @param connection_pool dotmailertransport.DotMailerConnectionPool shared by every account. Defaults to the
+            process-wide default pool.
+        @param rate_limiter_kwargs AccountRateLimiter arguments, e.g. {'rate': 5}, for each account's rate limiter
+            (see dotmailerratelimit.get_account_rate_limiter). None (the default) for no rate limits.
+        @param kwargs other PyDotMailer constructor arguments for every account, e.g. retry_policy or fast_path
+        """
+        if connection_pool is None:
+            from .dotmailertransport import get_default_connection_pool
+            connection_pool = get_default_connection_pool()
+        self.workers = workers
+        self.max_in_flight_per_account = max_in_flight_per_account
+        self.connection_pool = connection_pool
+        self.rate_limiter_kwargs = rate_limiter_kwargs
+        self.dot_mailer_kwargs = kwargs
+        self._accounts = {}  # api_username -> _Account
+        self._turns = deque()  # api_usernames with queued calls, next to be served first
+        self._condition = threading.Condition()
+        self._closed = False
+        self._threads = []
+        for number in range(workers):
+            thread = threading.Thread(target=self._work, name='AccountPool-%d' % number)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add_account(self, api_username, api_password, **kwargs):
+        """
+        Add (or replace) an account. Doesn't connect: the shared service definition is used on the first call.
+        @param kwargs PyDotMailer constructor arguments for this account only, overriding the pool's
+        @return the account's PyDotMailer
+        """
+        dot_mailer_kwargs = dict(self.dot_mailer_kwargs, **kwargs)
+        dot_mailer_kwargs.setdefault('connection_pool', self.connection_pool)
+        if self.rate_limiter_kwargs is not None and 'rate_limiter' not in dot_mailer_kwargs:
+            from .dotmailerratelimit import get_account_rate_limiter
+            dot_mailer_kwargs['rate_limiter'] = get_account_rate_limiter(api_username, **self.rate_limiter_kwargs)
+        from .pydotmailer import PyDotMailer
+        dot_mailer = PyDotMailer(api_username=api_username, api_password=api_password, lazy=True,
+                                 **dot_mailer_kwargs)
+        with self._condition:
+            account = self._accounts.get(api_username)
+            if account is None:
+                self._accounts[api_username] = _Account(dot_mailer)
+            else:
+                account.dot_mailer = dot_mailer  # calls already queued use the new credentials
+        return dot_mailer
+
+    def remove_account(self, api_username):
+        """ Remove an account. Its queued calls are cancelled; calls already running finish. """
+        with self._condition:
+            account = self._accounts.pop(api_username, None)
+            if account is None:
+                return
+            if api_username in self._turns:
+                self._turns.remove(api_username)
+            queued = list(account.queue)
+            account.queue.clear()
+        for future, method_name, args, kwargs in queued:
+            future.cancel()
+
+    def get(self, api_username):
+        """ @return the account's PyDotMailer, e.g. to call it directly. KeyError if there's no such account. """
+        return self._accounts[api_username].dot_mailer
+
+    def submit(self, api_username, method_name, *args, **kwargs):
+        """
+        Queue a call to a PyDotMailer method which returns a dict_result, e.g.
+            future = account_pool.submit('apiuser-1@apiconnector.com', 'send_campaign_to_contact', campaign_id,
+                                         contact_id)
+            dict_result = future.result()
+        @return concurrent.futures.Future of the dict_result. Cancelling it before it starts removes it from the queue.
+        """
+        from concurrent.futures import Future  # 'futures' package on Python 2
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('AccountPool is closed')
+            account = self._accounts[api_username]
+            account.queue.append((future, method_name, args, kwargs))
+            if api_username not in self._turns:
+                self._turns.append(api_username)
+            self._condition.notify()
+        return future
+
+    def close(self, wait=True):
+        """ Stop the worker threads once the queued calls are done. @param wait block until they are """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def stats(self):
+        """
+        @return dict of api_username -> e.g. {'queued': 120, 'in_flight': 5, 'completed': 880, 'failed': 12,
+            'errors': {'ERROR_CONTACT_UNSUBSCRIBED': 12}, 'last_error_code': 'ERROR_CONTACT_UNSUBSCRIBED',
+            'consecutive_failures': 0, 'rate_limiter': {...}}
+        """
+        with self._condition:
+            accounts = list(self._accounts.items())
+            stats = dict((api_username, account.stats()) for api_username, account in accounts)
+        for api_username, account in accounts:
+            rate_limiter = account.dot_mailer.rate_limiter
+            if rate_limiter is not None:
+                stats[api_username]['rate_limiter'] = rate_limiter.stats()
+        return stats
+
+    def _next_call(self):
+        """ Wait for a call to make, taking accounts in turn. @return (account, call), or None once closed """
+        with self._condition:
+            while True:
+                for _ in range(len(self._turns)):
+                    api_username = self._turns[0]
+                    self._turns.rotate(-1)  # whether or not it's served now, it's someone else's turn next
+                    account = self._accounts[api_username]
+                    if account.in_flight >= self.max_in_flight_per_account:
+                        continue
+                    call = account.queue.popleft()
+                    if not account.queue:
+                        self._turns.remove(api_username)
+                    if not call[0].set_running_or_notify_cancel():
+                        break  # cancelled, look again
+                    account.in_flight += 1
+                    return account, call
+                else:
+                    if self._closed and not self._turns:
+                        return None
+                    self._condition.wait()
+
+    def _work(self):
+        while True:
+            next_call = self._next_call()
+            if next_call is None:
+                return
+            account, (future, method_name, args, kwargs) = next_call
+            dict_result = None
+            try:
+                dict_result = getattr(account.dot_mailer, method_name)(*args, **kwargs)
+            except Exception as e:
+                logger.exception("Exception in AccountPool call to %s for %s" % (method_name,
+                                                                                 account.dot_mailer.api_username))
+                future.set_exception(e)
+            with self._condition:
+                account.in_flight -= 1
+                account.record(dict_result)
+                self._condition.notify()
+            if dict_result is not None:
+                future.set_result(dict_result)
+
+
+class _Account(object):
+    """ One account's PyDotMailer, queued calls and error counts. Guarded by the AccountPool's lock. """
+    def __init__(self, dot_mailer):
+        self.dot_mailer = dot_mailer
+        self.queue = deque()  # of (future, method_name, args, kwargs)
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.errors = {}  # error_code -> count
+        self.last_error_code = None
+        self.consecutive_failures = 0
+
+    def record(self, dict_result):
+        """ Count the outcome of a call. @param dict_result None if the call raised """
+        self.completed += 1
+        if dict_result is not None and dict_result.get('ok'):
+            self.consecutive_failures = 0
+            return
+        error_code = dict_result.get('error_code') if dict_result is not None else 'EXCEPTION'
+        self.failed += 1
+        self.consecutive_failures += 1
+        self.errors[error_code] = self.errors.get(error_code, 0) + 1
+        self.last_error_code = error_code
+
+    def stats(self):
+        return {'queued': len(self.queue), 'in_flight': self.in_flight, 'completed': self.completed,
+                'failed': self.failed, 'errors': dict(self.errors), 'last_error_code': self.last_error_code,
+                'consecutive_failures': self.consecutive_failures}
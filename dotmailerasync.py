@@ -0,0 +1,144 @@
+# dotmailerasync - asyncio interface to the dotMailer API, written in Python.
+# Copyright (c) 2012 Triggered Messaging Ltd, released under the MIT license
+# Home page:
+# https://github.com/TriggeredMessaging/pydotmailer/
+# See README and LICENSE files.
+#
+# dotMailer API docs are at http://www.dotmailer.co.uk/api/
+# Requires Python 3.5+ (asyncio and async/await). The rest of pydotmailer doesn't import this module.
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import logging
+logger = logging.getLogger(__name__)
+
+from .pydotmailer import PyDotMailer
+
+
+class AsyncPyDotMailer(object):
+    """
+    Awaitable versions of every PyDotMailer operation, returning the same result dicts.
+    suds is a blocking library, so each SOAP call runs on a bounded pool of worker threads (each with its own suds
+    client, sharing the parsed WSDL and the keep-alive connection pool). Any number of calls can be awaited at
+    once: at most max_concurrency are in flight, the rest wait on a semaphore without holding a thread.
+    Waiting for contact imports to finish is done by the PyDotMailer's import_tracker, so it never ties up a
+    worker thread.
+    """
+    def __init__(self, api_username='', api_password='', max_concurrency=20, timeout=None, dot_mailer=None,
+                 **kwargs):
+        """
+        @param api_username Your dotMailer user name
+        @param api_password Your dotMailer password
+        @param max_concurrency maximum number of SOAP calls in flight at once
+        @param timeout default seconds to wait for each call before giving up with TIMEOUT_ERROR. None to wait
+            as long as the transport allows.
+        @param dot_mailer an existing PyDotMailer to wrap, instead of creating one from the credentials
+        @param kwargs other PyDotMailer constructor arguments, e.g. connection_pool
+        """
+        if dot_mailer is None:
+            kwargs.setdefault('lazy', True)  # don't block the event loop connecting in the constructor
+            dot_mailer = PyDotMailer(api_username=api_username, api_password=api_password, **kwargs)
+        self.dot_mailer = dot_mailer
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self._semaphore = None  # created on first use, inside the running event loop
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """ Stop the worker threads once calls in progress have finished. """
+        self._executor.shutdown(wait=False)
+
+    async def _run(self, func, *args, timeout=None, **kwargs):
+        """
+        Run a blocking PyDotMailer method on a worker thread.
+        A worker thread can't be interrupted, so a call which times out carries on in the background, and may still
+        reach dotMailer (e.g. a send reported as TIMEOUT_ERROR may still be made). It keeps its place among the
+        max_concurrency calls in flight until it really finishes, so timeouts can't pile up work on the threads.
+        The timeout covers waiting for one of those places as well as the call itself.
+        @param timeout seconds to wait, overriding self.timeout
+        @return the method's dict_result, or a TIMEOUT_ERROR result if it took too long
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        timeout = self.timeout if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout)
+        except asyncio.TimeoutError:
+            return {'ok': False, 'errors': ['No free slot to make the call within %s seconds. It was not made.'
+                                            % timeout],
+                    'error_code': PyDotMailer.RESULT_FIELDS_ERROR_CODE.TIMEOUT_ERROR}
+        try:
+            future = loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+        except Exception:
+            self._semaphore.release()
+            raise
+        future.add_done_callback(lambda future: self._semaphore.release())
+        # what's left after waiting for a slot
+        remaining = max(timeout - (loop.time() - started), 0) if timeout is not None else None
+        try:
+            # shielded, so a timeout (or the caller being cancelled) doesn't mark the call done while it's running
+            return await asyncio.wait_for(asyncio.shield(future), remaining)
+        except asyncio.TimeoutError:
+            return {'ok': False, 'errors': ['No reply within %s seconds. The call may still complete.' % timeout],
+                    'error_code': PyDotMailer.RESULT_FIELDS_ERROR_CODE.TIMEOUT_ERROR}
+
+    async def send_campaign_to_contact(self, campaign_id, contact_id, send_date=None, timeout=None):
+        """ See PyDotMailer.send_campaign_to_contact """
+        return await self._run(self.dot_mailer.send_campaign_to_contact, campaign_id, contact_id,
+                               send_date=send_date, timeout=timeout)
+
+    async def add_contact_to_address_book(self, address_book_id, email_address, d_fields, email_type="Html",
+                                          audience_type="Unknown", opt_in_type="Unknown", timeout=None):
+        """ See PyDotMailer.add_contact_to_address_book """
+        return await self._run(self.dot_mailer.add_contact_to_address_book, address_book_id, email_address,
+                               d_fields, email_type=email_type, audience_type=audience_type,
+                               opt_in_type=opt_in_type, timeout=timeout)
+
+    async def get_contact_by_email(self, email, raw_result=False, timeout=None):
+        """ See PyDotMailer.get_contact_by_email """
+        return await self._run(self.dot_mailer.get_contact_by_email, email, raw_result=raw_result,
+                               timeout=timeout)
+
+    async def get_contact_by_id(self, contact_id, raw_result=False, timeout=None):
+        """ See PyDotMailer.get_contact_by_id """
+        return await self._run(self.dot_mailer.get_contact_by_id, contact_id, raw_result=raw_result,
+                               timeout=timeout)
+
+    async def list_contact_data_labels(self, timeout=None):
+        """ See PyDotMailer.list_contact_data_labels """
+        return await self._run(self.dot_mailer.list_contact_data_labels, timeout=timeout)
+
+    async def get_contact_import_progress(self, progress_id, timeout=None):
+        """ See PyDotMailer.get_contact_import_progress """
+        return await self._run(self.dot_mailer.get_contact_import_progress, progress_id, timeout=timeout)
+
+    async def add_contacts_to_address_book(self, address_book_id, s_contacts=None, wait_to_complete_seconds=False,
+                                           contacts_path=None, max_upload_bytes=None, timeout=None):
+        """
+        See PyDotMailer.add_contacts_to_address_book. The uploads run on a worker thread; waiting for the imports to
+        complete is left to the PyDotMailer's import_tracker, and awaited here without holding a worker thread.
+        @param timeout seconds to wait for each individual SOAP call
+        """
+        dict_result = await self._run(self.dot_mailer.add_contacts_to_address_book, address_book_id, s_contacts,
+                                      wait_to_complete_seconds=False, contacts_path=contacts_path,
+                                      max_upload_bytes=max_upload_bytes, timeout=timeout)
+        if not dict_result.get('ok') or not wait_to_complete_seconds:
+            return dict_result
+        import_tracker = self.dot_mailer.import_tracker
+        upload_results = dict_result.get('uploads') or [dict_result]
+        return_codes = await asyncio.gather(*[
+            asyncio.wrap_future(import_tracker.track(upload_result.get('progress_id'),
+                                                     timeout_seconds=wait_to_complete_seconds))
+            for upload_result in upload_results])
+        upload_results = [dict(return_code, progress_id=upload_result.get('progress_id'))
+                          for upload_result, return_code in zip(upload_results, return_codes)]
+        return self.dot_mailer.combine_upload_results(upload_results, wait_to_complete_seconds)
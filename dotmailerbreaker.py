@@ -0,0 +1,168 @@
+# dotmailerbreaker - Circuit breaker for the dotMailer API, written in Python.
+# Copyright (c) 2012 Triggered Messaging Ltd, released under the MIT license
+# Home page:
+# https://github.com/TriggeredMessaging/pydotmailer/
+# See README and LICENSE files.
+#
+# dotMailer API docs are at http://www.dotmailer.co.uk/api/
+import threading
+import time
+from collections import deque
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """ Raised instead of making a call while the circuit is open. PyDotMailer reports it as ERROR_CIRCUIT_OPEN. """
+    pass
+
+
+class CircuitBreaker(object):
+    """
+    Fails calls straight away while an endpoint is down, rather than letting each one wait for its timeout.
+    Closed (normal): the outcome of the last window_size calls is kept. Once at least min_calls have been made, if
+    the proportion which failed, or took longer than slow_call_seconds, reaches its threshold, the circuit opens.
+    Open: every call raises CircuitOpenError, for open_seconds.
+    Half-open: up to probe_calls calls are let through. If they all succeed the circuit closes; if any fails it opens
+    again.
+    Only a failure to get an answer (timeout, connection error, HTTP error without a SOAP fault) counts as a failure.
+    A SOAP fault is an answer, so e.g. ERROR_CONTACT_NOT_FOUND counts as a success. Anything else, e.g. a TypeError
+    or running out of pooled connections, says nothing about the endpoint, so PyDotMailer discards it.
+    Thread-safe. Share one per endpoint (see get_circuit_breaker).
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_rate_threshold=0.5, slow_call_seconds=10.0, slow_call_rate_threshold=0.8,
+                 window_size=20, min_calls=10, open_seconds=30.0, probe_calls=1, on_state_change=None, name=None):
+        """
+        @param failure_rate_threshold open when this proportion of recent calls failed
+        @param slow_call_seconds calls taking longer than this count as slow
+        @param slow_call_rate_threshold open when this proportion of recent calls were slow
+        @param window_size number of recent calls considered
+        @param min_calls don't open until this many calls are in the window
+        @param open_seconds how long to stay open before letting probe calls through
+        @param probe_calls calls allowed through while half-open, all of which must succeed to close
+        @param on_state_change optional function(circuit_breaker, old_state, new_state). See add_listener.
+        @param name for logging, e.g. the endpoint
+        """
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.probe_calls = probe_calls
+        self.name = name
+        self.state = CircuitBreaker.CLOSED
+        self.rejected_count = 0
+        self._window = deque(maxlen=window_size)  # of (failed, slow)
+        self._opened_at = None
+        self._probes_started = 0
+        self._probes_succeeded = 0
+        self._listeners = [on_state_change] if on_state_change else []
+        self._lock = threading.Lock()
+
+    def add_listener(self, callback):
+        """ Call callback(circuit_breaker, old_state, new_state) whenever the state changes. """
+        self._listeners.append(callback)
+
+    def before_call(self):
+        """ @raise CircuitOpenError if the call mustn't be made now. Otherwise record() or discard() must follow. """
+        with self._lock:
+            old_state = self.state
+            if self.state == CircuitBreaker.OPEN and time.time() - self._opened_at >= self.open_seconds:
+                self.state = CircuitBreaker.HALF_OPEN
+                self._probes_started = 0
+                self._probes_succeeded = 0
+            new_state = self.state
+            allowed = self.state == CircuitBreaker.CLOSED or \
+                (self.state == CircuitBreaker.HALF_OPEN and self._probes_started < self.probe_calls)
+            if self.state == CircuitBreaker.HALF_OPEN and allowed:
+                self._probes_started += 1
+            if not allowed:
+                self.rejected_count += 1
+                retry_seconds = max(self.open_seconds - (time.time() - self._opened_at), 0) \
+                    if self.state == CircuitBreaker.OPEN else 0
+        self._notify(old_state, new_state)
+        if not allowed:
+            raise CircuitOpenError('Circuit open%s after repeated failures, not calling dotMailer. '
+                                   'Retry in %.0f seconds' % (' for %s' % self.name if self.name else '',
+                                                              retry_seconds))
+
+    def record(self, failed, seconds):
+        """
+        Record the outcome of a call allowed by before_call.
+        @param failed True if the call failed to get an answer
+        @param seconds how long it took
+        """
+        slow = seconds > self.slow_call_seconds
+        with self._lock:
+            old_state = self.state
+            if self.state == CircuitBreaker.HALF_OPEN:
+                if failed or slow:
+                    self._open()
+                else:
+                    self._probes_succeeded += 1
+                    if self._probes_succeeded >= self.probe_calls:
+                        self.state = CircuitBreaker.CLOSED
+                        self._window.clear()
+            elif self.state == CircuitBreaker.CLOSED:
+                self._window.append((failed, slow))
+                if len(self._window) >= self.min_calls:
+                    failure_rate = sum(1 for call in self._window if call[0]) / float(len(self._window))
+                    slow_rate = sum(1 for call in self._window if call[1]) / float(len(self._window))
+                    if failure_rate >= self.failure_rate_threshold or slow_rate >= self.slow_call_rate_threshold:
+                        self._open()
+            new_state = self.state
+        self._notify(old_state, new_state)
+
+    def discard(self):
+        """ Say nothing about a call allowed by before_call, instead of record(): e.g. it failed before reaching
+        dotMailer, for a local reason. It doesn't count towards the window, and a half-open probe is handed back. """
+        with self._lock:
+            if self.state == CircuitBreaker.HALF_OPEN and self._probes_started > self._probes_succeeded:
+                self._probes_started -= 1
+
+    def stats(self):
+        """ @return dict e.g. {'state': 'closed', 'recent_calls': 20, 'recent_failures': 2, 'rejected': 0} """
+        with self._lock:
+            return {'state': self.state, 'recent_calls': len(self._window),
+                    'recent_failures': sum(1 for call in self._window if call[0]),
+                    'recent_slow_calls': sum(1 for call in self._window if call[1]),
+                    'rejected': self.rejected_count}
+
+    def _open(self):
+        self.state = CircuitBreaker.OPEN
+        self._opened_at = time.time()
+        self._window.clear()
+
+    def _notify(self, old_state, new_state):
+        if old_state == new_state:
+            return
+        log = logger.warning if new_state == CircuitBreaker.OPEN else logger.info
+        log("dotMailer circuit%s %s -> %s" % (' for %s' % self.name if self.name else '', old_state, new_state))
+        for listener in self._listeners:
+            try:
+                listener(self, old_state, new_state)
+            except Exception:
+                logger.exception("Exception in circuit breaker state change listener")
+
+
+_circuit_breakers = {}  # endpoint -> CircuitBreaker
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(endpoint, **kwargs):
+    """
+    The CircuitBreaker shared by everything in this process calling endpoint (e.g. PyDotMailer.api_url), created
+    with kwargs (see CircuitBreaker) on first use. Later kwargs are ignored.
+    """
+    with _circuit_breakers_lock:
+        circuit_breaker = _circuit_breakers.get(endpoint)
+        if circuit_breaker is None:
+            kwargs.setdefault('name', endpoint)
+            circuit_breaker = CircuitBreaker(**kwargs)
+            _circuit_breakers[endpoint] = circuit_breaker
+        return circuit_breaker
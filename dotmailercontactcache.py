@@ -0,0 +1,301 @@
+# dotmailercontactcache - Cache dotMailer contact lookups, written in Python.
+# Copyright (c) 2012 Triggered Messaging Ltd, released under the MIT license
+# Home page:
+# https://github.com/TriggeredMessaging/pydotmailer/
+# See README and LICENSE files.
+#
+# dotMailer API docs are at http://www.dotmailer.co.uk/api/
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+
+try:
+    import simplejson as json
+except ImportError:
+    import json  # fall back to traditional json module.
+
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    text_type = unicode  # Python 2
+except NameError:
+    text_type = str
+
+
+class ContactCache(object):
+    """
+    Bounded cache of get_contact_by_email / get_contact_by_id results, indexed by both email address and contact id,
+    so a lookup by either finds a contact fetched by the other.
+    Entries expire after ttl_seconds. ERROR_CONTACT_NOT_FOUND results are cached too (negative caching), for the
+    usually shorter negative_ttl_seconds. When full, the least recently used entries are evicted.
+    Cached results are copies of the original dict_result without the raw suds 'result' object, and have
+    'cached': True.
+    Storage is delegated to a backend: MemoryContactCacheBackend (the default) for one process, or
+    SqliteContactCacheBackend to share one local cache between processes.
+    """
+    def __init__(self, max_size=10000, ttl_seconds=300, negative_ttl_seconds=60, backend=None):
+        """
+        @param max_size maximum number of entries. Each contact takes two or three: one per index.
+        @param ttl_seconds how long a found contact is trusted
+        @param negative_ttl_seconds how long a 'not found' is trusted. 0 to not cache them.
+        @param backend storage. Defaults to MemoryContactCacheBackend(max_size)
+        """
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.backend = backend if backend is not None else MemoryContactCacheBackend(max_size)
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_by_email(self, email):
+        """ @return the cached dict_result for email, or None if it isn't cached """
+        return self._get(self._email_key(email))
+
+    def get_by_id(self, contact_id):
+        """ @return the cached dict_result for contact_id, or None if it isn't cached """
+        return self._get(self._id_key(contact_id))
+
+    def put(self, dict_result, email=None, contact_id=None):
+        """
+        Remember the result of a lookup.
+        @param dict_result from get_contact_by_email / get_contact_by_id. Successful lookups are indexed by the
+            returned email and contact id; ERROR_CONTACT_NOT_FOUND is cached under the email or contact_id looked
+            up; other failures aren't cached.
+        @param email the email address looked up, if any
+        @param contact_id the contact id looked up, if any
+        """
+        from .pydotmailer import PyDotMailer
+        now = time.time()
+        if dict_result.get('ok'):
+            value = self._storable(dict_result)
+            # the address looked up and the one returned can differ, e.g. in case
+            keys = set([self._email_key(email), self._email_key(value.get('email')),
+                        self._id_key(value.get('contact_id') or contact_id)])
+            expires_at = now + self.ttl_seconds
+        elif dict_result.get('error_code') == PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_CONTACT_NOT_FOUND \
+                and self.negative_ttl_seconds:
+            value = self._storable(dict_result)
+            keys = [self._email_key(email) if email else self._id_key(contact_id)]
+            expires_at = now + self.negative_ttl_seconds
+        else:
+            return
+        for key in keys:
+            if key:
+                evicted = self.backend.set(key, expires_at, value)
+                if evicted:
+                    with self._stats_lock:
+                        self.evictions += evicted
+
+    def invalidate(self, email=None, contact_id=None):
+        """ Forget a contact, under both indexes. """
+        keys = set()
+        for key in (self._email_key(email) if email else None, self._id_key(contact_id) if contact_id else None):
+            if key:
+                keys.add(key)
+                entry = self.backend.get(key)
+                if entry and entry[1].get('ok'):
+                    # also drop the entry under the other index
+                    keys.add(self._email_key(entry[1].get('email')))
+                    keys.add(self._id_key(entry[1].get('contact_id')))
+        for key in keys:
+            if key:
+                self.backend.delete(key)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        """ @return dict of counters, e.g. {'hits': 10, 'negative_hits': 1, 'misses': 3, 'evictions': 0, 'size': 20} """
+        with self._stats_lock:
+            return {'hits': self.hits, 'negative_hits': self.negative_hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'size': len(self.backend)}
+
+    def _get(self, key):
+        entry = self.backend.get(key)
+        if entry is not None and entry[0] < time.time():
+            self.backend.delete(key)
+            entry = None
+        with self._stats_lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[1].get('ok'):
+                self.hits += 1
+            else:
+                self.negative_hits += 1
+        # copy, so callers can't change what's cached
+        dict_result = dict(entry[1])
+        if dict_result.get('d_fields') is not None:
+            dict_result['d_fields'] = dict(dict_result['d_fields'])
+        return dict_result
+
+    def _storable(self, dict_result):
+        """ copy of dict_result with plain values, dropping the suds object so it can be stored """
+        value = {'cached': True}
+        for name in ('ok', 'contact_id', 'email', 'error_code', 'errors'):
+            if name in dict_result:
+                value[name] = self._plain(dict_result.get(name))
+        if dict_result.get('d_fields') is not None:
+            value['d_fields'] = dict((self._plain(field_name), self._plain(field_value))
+                                     for field_name, field_value in dict_result.get('d_fields').items())
+        return value
+
+    def _plain(self, value):
+        """ suds returns strings as subclasses of unicode; store them as plain strings """
+        if isinstance(value, text_type):
+            return text_type(value)
+        if isinstance(value, list):
+            return [self._plain(item) for item in value]
+        if isinstance(value, int) and not isinstance(value, bool):
+            return int(value)
+        return value
+
+    def _email_key(self, email):
+        return 'email:%s' % email.strip().lower() if email else None
+
+    def _id_key(self, contact_id):
+        return 'id:%s' % contact_id if contact_id else None
+
+
+class MemoryContactCacheBackend(object):
+    """ In-process LRU storage for ContactCache. Thread-safe. """
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._entries = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """ @return (expires_at, value) or None """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry  # now the most recently used
+            return entry
+
+    def set(self, key, expires_at, value):
+        """ @return number of entries evicted to make room """
+        evicted = 0
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (expires_at, value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                evicted += 1
+        return evicted
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SqliteContactCacheBackend(object):
+    """
+    Storage for ContactCache in a local SQLite file, so several processes on one machine can share a cache.
+    Least recently used entries are evicted beyond max_size.
+    Values are stored as JSON, never pickled, so whoever can write the file can't run code in the processes reading
+    it. Data field values JSON can't hold (dates, times and Decimals) are tagged; anything else isn't cached.
+    """
+    def __init__(self, path, max_size=100000):
+        """
+        @param path SQLite database file. Created if it doesn't exist.
+        @param max_size maximum number of entries
+        """
+        self.path = path
+        self.max_size = max_size
+        self._local = threading.local()  # sqlite connections can't be shared between threads
+        self._sets_since_trim = 0
+        self._connection().execute('CREATE TABLE IF NOT EXISTS contact_cache '
+                                   '(key TEXT PRIMARY KEY, expires_at REAL, used_at REAL, value BLOB)')
+        self._connection().execute('CREATE INDEX IF NOT EXISTS contact_cache_used_at ON contact_cache (used_at)')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)  # autocommit
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        """ @return (expires_at, value) or None """
+        connection = self._connection()
+        row = connection.execute('SELECT expires_at, value FROM contact_cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        try:
+            value = json.loads(row[1].decode('utf-8') if isinstance(row[1], bytes) else row[1],
+                               object_hook=_from_json)
+        except ValueError:
+            # not JSON, e.g. written by an older version: treat as a miss
+            self.delete(key)
+            return None
+        connection.execute('UPDATE contact_cache SET used_at = ? WHERE key = ?', (time.time(), key))
+        return row[0], value
+
+    def set(self, key, expires_at, value):
+        """ @return number of entries evicted to make room """
+        try:
+            value = json.dumps(value, default=_to_json)
+        except (TypeError, ValueError):
+            logger.debug("Not caching %s: its value can't be stored as JSON" % key)
+            return 0
+        connection = self._connection()
+        connection.execute('INSERT OR REPLACE INTO contact_cache (key, expires_at, used_at, value) VALUES (?, ?, ?, ?)',
+                           (key, expires_at, time.time(), value))
+        # Counting rows on every write would be slow, so only trim now and again.
+        self._sets_since_trim += 1
+        if self._sets_since_trim < 100:
+            return 0
+        self._sets_since_trim = 0
+        excess = len(self) - self.max_size
+        if excess <= 0:
+            return 0
+        connection.execute('DELETE FROM contact_cache WHERE key IN '
+                           '(SELECT key FROM contact_cache ORDER BY used_at LIMIT ?)', (excess,))
+        return excess
+
+    def delete(self, key):
+        self._connection().execute('DELETE FROM contact_cache WHERE key = ?', (key,))
+
+    def clear(self):
+        self._connection().execute('DELETE FROM contact_cache')
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM contact_cache').fetchone()[0]
+
+
+def _to_json(value):
+    """ json.dumps default: tag the data field types JSON has no type for """
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            raise TypeError('%r has a time zone' % value)
+        return {'__datetime__': value.strftime('%Y-%m-%dT%H:%M:%S.%f')}
+    if isinstance(value, date):
+        return {'__date__': value.isoformat()}
+    if isinstance(value, Decimal):
+        return {'__decimal__': str(value)}
+    raise TypeError('%r is not JSON serializable' % value)
+
+
+def _from_json(value):
+    """ json.loads object_hook, reversing _to_json """
+    if len(value) == 1:
+        if '__datetime__' in value:
+            return datetime.strptime(value['__datetime__'], '%Y-%m-%dT%H:%M:%S.%f')
+        if '__date__' in value:
+            return datetime.strptime(value['__date__'], '%Y-%m-%d').date()
+        if '__decimal__' in value:
+            return Decimal(value['__decimal__'])
+    return value
@@ -0,0 +1,149 @@
+# dotmailerdatafields - Cache and check the contact data fields of a dotMailer account, written in Python.
+# Copyright (c) 2012 Triggered Messaging Ltd, released under the MIT license
+# Home page:
+# https://github.com/TriggeredMessaging/pydotmailer/
+# See README and LICENSE files.
+#
+# dotMailer API docs are at http://www.dotmailer.co.uk/api/
+import datetime
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    string_types = basestring  # Python 2
+    number_types = (int, long, float, Decimal)
+except NameError:
+    string_types = str
+    number_types = (int, float, Decimal)
+
+
+class DataFieldSchema(object):
+    """
+    The contact data fields (labels) defined in a dotMailer account, fetched with ListContactDataLabels the first
+    time they're needed and kept for ttl_seconds.
+    normalise() matches field names case-insensitively to the account's ('firstname' -> 'FIRSTNAME') and checks each
+    value against its field's type, so a misspelt field or a bad value fails straight away instead of costing a call
+    to dotMailer.
+    Thread-safe. Share one per account (see get_data_field_schema).
+    """
+    STRING = 'String'
+    NUMERIC = 'Numeric'
+    DATE = 'Date'
+    BOOLEAN = 'Boolean'
+    BOOLEAN_STRINGS = ('true', 'false', 'yes', 'no', '1', '0')
+
+    def __init__(self, ttl_seconds=3600, strict=True, retry_seconds=60):
+        """
+        @param ttl_seconds how long to keep the fields before fetching them again
+        @param strict True if a field the account doesn't have is an error. If False it's passed on as given.
+        @param retry_seconds if the fields couldn't be fetched, don't try again for this long. Meanwhile fields are
+            passed on unchecked, for dotMailer to judge.
+        """
+        self.ttl_seconds = ttl_seconds
+        self.strict = strict
+        self.retry_seconds = retry_seconds
+        self._labels = None  # upper case name -> (name, type)
+        self._expires_at = 0
+        self._lock = threading.Lock()
+
+    def get_labels(self, list_contact_data_labels):
+        """
+        @param list_contact_data_labels function() to fetch the fields if needed, e.g.
+            PyDotMailer.list_contact_data_labels
+        @return dict of upper case field name -> (field name, type), or None if they couldn't be fetched
+        """
+        with self._lock:
+            if time.time() < self._expires_at:
+                return self._labels
+            # Fetch while holding the lock, so threads starting together make one call, not one each
+            dict_result = list_contact_data_labels()
+            if dict_result.get('ok'):
+                self._labels = dict((label['name'].upper(), (label['name'], label['type']))
+                                    for label in dict_result.get('data_labels'))
+                self._expires_at = time.time() + self.ttl_seconds
+            else:
+                logger.warning("Couldn't fetch contact data fields, not checking them for %s seconds: %s"
+                               % (self.retry_seconds, dict_result.get('errors')))
+                self._labels = None
+                self._expires_at = time.time() + self.retry_seconds
+            return self._labels
+
+    def invalidate(self):
+        """ Fetch the fields again next time, e.g. after adding one to the account """
+        with self._lock:
+            self._expires_at = 0
+
+    def normalise(self, data_fields, list_contact_data_labels):
+        """
+        @param data_fields list of (field name, value)
+        @param list_contact_data_labels see get_labels
+        @return (list of (field name as the account has it, value), list of error strings)
+            Dates are sent as ISO 8601 strings and booleans as 'true' / 'false'.
+        """
+        labels = self.get_labels(list_contact_data_labels)
+        if labels is None:
+            return data_fields, []
+        normalised = []
+        errors = []
+        for field_name, value in data_fields:
+            label = labels.get(field_name.upper())
+            if label is None:
+                if self.strict:
+                    errors.append("Unknown data field %s" % field_name)
+                else:
+                    normalised.append((field_name, value))
+                continue
+            name, data_type = label
+            if data_type == DataFieldSchema.NUMERIC:
+                if not self._is_number(value):
+                    errors.append("Data field %s is Numeric, not %r" % (name, value))
+                    continue
+            elif data_type == DataFieldSchema.DATE:
+                if isinstance(value, (datetime.date, datetime.datetime)):
+                    value = value.isoformat()
+                elif not isinstance(value, string_types):
+                    errors.append("Data field %s is a Date, not %r" % (name, value))
+                    continue
+            elif data_type == DataFieldSchema.BOOLEAN:
+                if isinstance(value, bool):
+                    value = 'true' if value else 'false'
+                elif not (isinstance(value, string_types) and
+                          value.strip().lower() in DataFieldSchema.BOOLEAN_STRINGS):
+                    errors.append("Data field %s is Boolean, not %r" % (name, value))
+                    continue
+            normalised.append((name, value))
+        return normalised, errors
+
+    def _is_number(self, value):
+        if isinstance(value, bool):
+            return False
+        if isinstance(value, number_types):
+            return True
+        if isinstance(value, string_types):
+            try:
+                Decimal(value.strip())
+                return True
+            except InvalidOperation:
+                return False
+        return False
+
+
+_data_field_schemas = {}  # api_username -> DataFieldSchema
+_data_field_schemas_lock = threading.Lock()
+
+
+def get_data_field_schema(api_username, **kwargs):
+    """
+    The DataFieldSchema shared by everything in this process using the dotMailer account api_username, created with
+    kwargs (see DataFieldSchema) on first use. Later kwargs are ignored.
+    """
+    with _data_field_schemas_lock:
+        data_field_schema = _data_field_schemas.get(api_username)
+        if data_field_schema is None:
+            data_field_schema = DataFieldSchema(**kwargs)
+            _data_field_schemas[api_username] = data_field_schema
+        return data_field_schema
@@ -0,0 +1,120 @@
+# dotmailerenvelopes - Precompiled SOAP requests for the busiest dotMailer API calls, written in Python.
+# Copyright (c) 2012 Triggered Messaging Ltd, released under the MIT license
+# Home page:
+# https://github.com/TriggeredMessaging/pydotmailer/
+# See README and LICENSE files.
+#
+# dotMailer API docs are at http://www.dotmailer.co.uk/api/
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    text_type = unicode  # Python 2
+    integer_types = (int, long)
+except NameError:
+    text_type = str
+    integer_types = (int,)
+
+API_NAMESPACE = 'http://apiconnector.com'
+
+# The same envelope suds renders for these calls, including the namespaces DotMailerSudsPlugin.marshalled adds
+# (apic and xsd). None of these calls has an anyType value, so there are no xsi:type attributes to add.
+# (suds may number the ns0/ns1 prefixes the other way round; they're only names, so it means the same.)
+_ENVELOPE_START = (u'<?xml version="1.0" encoding="UTF-8"?>'
+                   u'<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" '
+                   u'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+                   u'xmlns:ns0="http://schemas.xmlsoap.org/soap/envelope/" '
+                   u'xmlns:ns1="%s" xmlns:apic="%s" '
+                   u'xmlns:xsd="http://www.w3.org/2001/XMLSchema">'
+                   u'<SOAP-ENV:Header/><ns0:Body>' % (API_NAMESPACE, API_NAMESPACE))
+_ENVELOPE_END = u'</ns0:Body></SOAP-ENV:Envelope>'
+
+# operation -> its parameters, in the order the WSDL defines them
+OPERATION_PARAMETERS = {
+    'SendCampaignToContact': ('username', 'password', 'campaignId', 'contactid', 'sendDate'),
+    'GetContactByEmail': ('username', 'password', 'email'),
+    'GetContactById': ('username', 'password', 'id'),
+}
+
+
+def _compile(operation, parameters):
+    """ @return (start of the envelope, [(parameter name, start tag, end tag)], end of the envelope) """
+    return (u'%s<ns1:%s>' % (_ENVELOPE_START, operation),
+            [(name, u'<ns1:%s>' % name, u'</ns1:%s>' % name) for name in parameters],
+            u'</ns1:%s>%s' % (operation, _ENVELOPE_END))
+
+_TEMPLATES = dict((operation, _compile(operation, parameters))
+                  for operation, parameters in OPERATION_PARAMETERS.items())
+
+
+def escape(text):
+    """ escape text for an XML element, as suds does """
+    if u'&' in text:
+        text = text.replace(u'&', u'&amp;')
+    if u'<' in text:
+        text = text.replace(u'<', u'&lt;')
+    if u'>' in text:
+        text = text.replace(u'>', u'&gt;')
+    if u'"' in text:
+        text = text.replace(u'"', u'&quot;')
+    if u"'" in text:
+        text = text.replace(u"'", u'&apos;')
+    return text
+
+
+def render_envelope(operation, kwargs):
+    """
+    @param operation e.g. 'GetContactById'
+    @param kwargs the operation's arguments, as passed to the suds service method
+    @return the SOAP envelope as UTF-8 bytes, or None if operation has no template or an argument is missing or of
+        a type the template doesn't handle (so the caller should let suds do it)
+    """
+    template = _TEMPLATES.get(operation)
+    if template is None:
+        return None
+    start, elements, end = template
+    parts = [start]
+    for name, start_tag, end_tag in elements:
+        value = kwargs.get(name)
+        if isinstance(value, text_type):
+            value = escape(value)
+        elif isinstance(value, bytes):
+            value = escape(value.decode('utf-8'))
+        elif isinstance(value, integer_types) and not isinstance(value, bool):
+            value = u'%d' % value
+        else:
+            return None
+        parts.append(start_tag)
+        parts.append(value)
+        parts.append(end_tag)
+    parts.append(end)
+    return u''.join(parts).encode('utf-8')
+
+
+def process_reply(method, status, reason, body):
+    """
+    Turn the HTTP response to a precompiled request into what the suds service method would have returned or raised.
+    @param method the suds Method for the operation, whose binding unmarshals the reply
+    @param status HTTP status
+    @param reason HTTP reason
+    @param body response bytes
+    @return the unmarshalled result, e.g. an APIContact
+    @raise suds.WebFault for a SOAP fault, just as suds does
+    """
+    from suds import WebFault
+    from suds.bindings.binding import envns
+    from suds.sax.parser import Parser
+    from suds.umx.basic import Basic as UmxBasic
+    if status in (202, 204) or (status == 200 and not body):
+        return None
+    if status not in (200, 500):
+        raise Exception((status, reason))
+    reply_root = Parser().parse(string=body)
+    envelope = reply_root.getChild('Envelope', envns)
+    soap_body = envelope.getChild('Body', envns) if envelope is not None else None
+    fault = soap_body.getChild('Fault', envns) if soap_body is not None else None
+    if fault is not None:
+        raise WebFault(UmxBasic().process(fault), reply_root)
+    if status != 200:
+        raise Exception((status, reason))
+    return method.binding.output.get_reply(method, reply_root)
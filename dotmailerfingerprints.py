@@ -0,0 +1,123 @@
+# dotmailerfingerprints - Skip contact writes which wouldn't change anything, written in Python.
+# Copyright (c) 2012 Triggered Messaging Ltd, released under the MIT license
+# Home page:
+# https://github.com/TriggeredMessaging/pydotmailer/
+# See README and LICENSE files.
+#
+# dotMailer API docs are at http://www.dotmailer.co.uk/api/
+import hashlib
+import threading
+import time
+from datetime import date
+
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    text_type = unicode  # Python 2
+except NameError:
+    text_type = str
+
+
+class ContactFingerprints(object):
+    """
+    What each contact in each address book was last known to hold: a short hash of each data field's value, and the
+    email, audience and opt-in types it was written with. PyDotMailer.add_contact_to_address_book checks the
+    outgoing d_fields against it and only calls dotMailer if a value differs, so resyncing unchanged contacts costs
+    no API quota.
+    Fingerprints are kept after each successful write, or from a lookup with remember_lookup. A write only changes
+    the fields it sends, so it's skipped when every field sent matches, whatever else the contact holds. Values are
+    compared as text, so e.g. 5 and 5.0 differ: a mismatch costs an unnecessary write, never a missed one.
+    Fingerprints are only as good as the assumption that nothing else writes to the contacts, so they expire after
+    ttl_seconds.
+    Storage is delegated to a backend, as for ContactCache: MemoryContactCacheBackend (the default) or
+    SqliteContactCacheBackend to keep them between runs.
+    """
+    def __init__(self, max_size=100000, ttl_seconds=7 * 24 * 60 * 60, backend=None):
+        """
+        @param max_size maximum number of contacts (per address book) remembered
+        @param ttl_seconds how long a fingerprint is trusted
+        @param backend storage. Defaults to dotmailercontactcache.MemoryContactCacheBackend(max_size)
+        """
+        if backend is None:
+            from .dotmailercontactcache import MemoryContactCacheBackend
+            backend = MemoryContactCacheBackend(max_size)
+        self.ttl_seconds = ttl_seconds
+        self.backend = backend
+        self._stats_lock = threading.Lock()
+        self.skipped = 0
+        self.written = 0
+
+    def unchanged(self, address_book_id, email, data_fields, options):
+        """
+        @param data_fields list of (field name, value) about to be sent
+        @param options (email_type, audience_type, opt_in_type) about to be sent
+        @return the contact id if writing data_fields and options would change nothing, else None
+        """
+        entry = self.backend.get(self._key(address_book_id, email))
+        if entry is None or entry[0] < time.time():
+            return None
+        contact_id, known_options, known_fields = entry[1]
+        if known_options is not None and tuple(known_options) != tuple(options):
+            return None
+        for field_name, value in data_fields:
+            if known_fields.get(field_name.upper()) != _digest(value):
+                return None
+        return contact_id
+
+    def remember(self, address_book_id, email, contact_id, data_fields, options=None):
+        """
+        Record a successful write (or a lookup) of a contact.
+        @param data_fields list of (field name, value) the contact now holds. Fields not listed keep what was known.
+        @param options (email_type, audience_type, opt_in_type), or None if not known
+        """
+        key = self._key(address_book_id, email)
+        entry = self.backend.get(key)
+        known_fields = dict(entry[1][2]) if entry is not None and entry[0] >= time.time() else {}
+        if options is None and entry is not None:
+            options = entry[1][1]
+        for field_name, value in data_fields:
+            known_fields[field_name.upper()] = _digest(value)
+        self.backend.set(key, time.time() + self.ttl_seconds,
+                         (contact_id, tuple(options) if options is not None else None, known_fields))
+
+    def remember_lookup(self, address_book_id, dict_result):
+        """
+        Seed the fingerprint of a contact from get_contact_by_email / get_contact_by_id, e.g. at the start of a resync.
+        Lookups don't say which address books a contact is in: only call this for contacts known to be in
+        address_book_id, or the write adding them to it will be skipped.
+        """
+        if dict_result.get('ok') and dict_result.get('d_fields') is not None:
+            self.remember(address_book_id, dict_result.get('email'), dict_result.get('contact_id'),
+                          [(field_name, value) for field_name, value in dict_result.get('d_fields').items()
+                           if value is not None and value != ''])
+
+    def forget(self, address_book_id, email):
+        self.backend.delete(self._key(address_book_id, email))
+
+    def count(self, skipped):
+        """ Count a write as skipped (True) or made (False) """
+        with self._stats_lock:
+            if skipped:
+                self.skipped += 1
+            else:
+                self.written += 1
+
+    def stats(self):
+        """ @return dict e.g. {'skipped': 9120, 'written': 880, 'size': 10000} """
+        with self._stats_lock:
+            return {'skipped': self.skipped, 'written': self.written, 'size': len(self.backend)}
+
+    def _key(self, address_book_id, email):
+        return 'book:%s:%s' % (address_book_id, (email or '').strip().lower())
+
+
+def _digest(value):
+    """ @return a short hash of value as dotMailer would hold it """
+    if isinstance(value, bool):
+        value = 'true' if value else 'false'
+    elif isinstance(value, date):
+        value = value.isoformat()
+    elif not isinstance(value, text_type):
+        value = text_type(value) if not isinstance(value, bytes) else value.decode('utf-8')
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()[:16]
@@ -0,0 +1,225 @@
+# dotmailerimports - Track the progress of many dotMailer contact imports at once, written in Python.
+# Copyright (c) 2012 Triggered Messaging Ltd, released under the MIT license
+# Home page:
+# https://github.com/TriggeredMessaging/pydotmailer/
+# See README and LICENSE files.
+#
+# dotMailer API docs are at http://www.dotmailer.co.uk/api/
+import functools
+import heapq
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor  # 'futures' package on Python 2
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class ImportProgressTracker(object):
+    """
+    Schedules GetContactImportProgress checks for any number of imports from one background thread, instead of one
+    blocking sleep loop per upload. The checks themselves run on a few worker threads, so one slow reply doesn't
+    hold up the others.
+    track() returns a Future which resolves to the same dict_result as PyDotMailer.get_contact_import_progress:
+    'Finished' or 'RejectedByWatchdog' once dotMailer is done, or the last 'NotFinished' result if the import
+    didn't finish within its timeout.
+    Poll intervals adapt: the first check is made around when the import is expected to finish, based on its
+    size and how long past imports took, then checks back off towards max_interval.
+    """
+    def __init__(self, dot_mailer, min_interval=0.2, max_interval=5.0, poll_timeout=30.0, poll_workers=4):
+        """
+        @param dot_mailer PyDotMailer used to check progress
+        @param min_interval shortest time between two checks of one import, in seconds
+        @param max_interval longest time between two checks of one import, in seconds
+        @param poll_timeout seconds to wait for the answer to one check. After that it's treated as unanswered and
+            the next check is scheduled (or the import resolved, if its timeout has passed). So a tracked import
+            may resolve up to poll_timeout after its own timeout.
+        @param poll_workers number of checks which can be waiting for dotMailer at once
+        """
+        self.dot_mailer = dot_mailer
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.poll_timeout = poll_timeout
+        # Learnt from completed imports: expected seconds = overhead + bytes * seconds per byte
+        self.seconds_overhead = 1.0
+        self.seconds_per_byte = 1.0 / (200 * 1024)
+        self._imports = {}  # progress_id -> _TrackedImport
+        self._schedule = []  # heap of (time of next check, progress_id). Entries no longer a _TrackedImport's
+        # check_at are stale, and skipped.
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=poll_workers)
+        self._thread = None
+        self._closed = False
+
+    def track(self, progress_id, upload_bytes=None, timeout_seconds=None, callback=None):
+        """
+        Start tracking an import.
+        @param progress_id from AddContactsToAddressBookWithProgress
+        @param upload_bytes size of the uploaded CSV, if known. Improves the first poll time.
+        @param timeout_seconds stop checking after this long and resolve with the NotFinished result.
+            None to keep checking until it finishes.
+        @param callback optional function(progress_id, dict_result), called on the tracker's thread when done
+        @return concurrent.futures.Future resolving to a dict_result
+        """
+        now = time.time()
+        tracked = _TrackedImport(progress_id, upload_bytes, now,
+                                 now + timeout_seconds if timeout_seconds else None, callback)
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('ImportProgressTracker is closed')
+            existing = self._imports.get(progress_id)
+            if existing:
+                return existing.future  # already tracking it, e.g. a second caller waiting on the same import
+            self._imports[progress_id] = tracked
+            check_at = now + self._first_interval(upload_bytes)
+            if tracked.deadline is not None:
+                check_at = min(check_at, tracked.deadline)
+            self._schedule_check(tracked, check_at)
+            self._ensure_thread()
+        return tracked.future
+
+    def pending_count(self):
+        """ number of imports still being checked """
+        with self._condition:
+            return len(self._imports)
+
+    def close(self):
+        """ Stop checking. Imports still being tracked are cancelled. """
+        with self._condition:
+            self._closed = True
+            imports = list(self._imports.values())
+            self._imports = {}
+            self._schedule = []
+            self._condition.notify()
+        self._executor.shutdown(wait=False)
+        for tracked in imports:
+            tracked.future.cancel()
+
+    def _first_interval(self, upload_bytes):
+        expected = self.seconds_overhead + (upload_bytes or 0) * self.seconds_per_byte
+        return min(max(expected, self.min_interval), self.max_interval)
+
+    def _next_interval(self, tracked, now):
+        """ back off from the last interval, but not past the expected finish time by much """
+        elapsed = now - tracked.started
+        expected = self.seconds_overhead + (tracked.upload_bytes or 0) * self.seconds_per_byte
+        if elapsed < expected:
+            interval = expected - elapsed
+        else:
+            interval = tracked.interval * 2
+        tracked.interval = min(max(interval, self.min_interval), self.max_interval)
+        return tracked.interval
+
+    def _learn(self, tracked, now):
+        """ update the estimates from an import which has just finished, as moving averages """
+        elapsed = now - tracked.started
+        if (tracked.upload_bytes or 0) >= 64 * 1024:
+            # big enough for the size to dominate the fixed overhead
+            observed = max(elapsed - self.seconds_overhead, 0.0) / tracked.upload_bytes
+            self.seconds_per_byte = 0.8 * self.seconds_per_byte + 0.2 * observed
+        else:
+            self.seconds_overhead = 0.8 * self.seconds_overhead + 0.2 * elapsed
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='pydotmailer-import-tracker')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _schedule_check(self, tracked, check_at):
+        """ call with self._condition held """
+        tracked.check_at = check_at
+        heapq.heappush(self._schedule, (check_at, tracked.progress_id))
+        self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed and (not self._schedule or self._schedule[0][0] > time.time()):
+                    if not self._imports:
+                        self._thread = None  # nothing to do: let the thread end, track() starts a new one
+                        return
+                    self._condition.wait(self._schedule[0][0] - time.time() if self._schedule else None)
+                if self._closed:
+                    return
+                check_at, progress_id = heapq.heappop(self._schedule)
+                tracked = self._imports.get(progress_id)
+                if tracked is None or tracked.check_at != check_at:
+                    continue
+                poll = tracked.poll
+                if poll is None:
+                    # start a check, and come back if it isn't answered in time
+                    tracked.poll = self._executor.submit(self.dot_mailer.get_contact_import_progress, progress_id)
+                    tracked.poll.add_done_callback(functools.partial(self._poll_done, tracked))
+                    self._schedule_check(tracked, time.time() + self.poll_timeout)
+                    continue
+                tracked.poll = None  # given up on: its answer, if it ever comes, is ignored
+            logger.warning("No answer checking import progress %s within %s seconds"
+                           % (progress_id, self.poll_timeout))
+            self._checked(tracked, None)
+
+    def _poll_done(self, tracked, poll):
+        """ called on a worker thread once a check has its answer """
+        try:
+            dict_result = poll.result()
+        except Exception:
+            logger.exception("Exception checking import progress %s" % tracked.progress_id)
+            dict_result = None
+        with self._condition:
+            if tracked.poll is not poll:
+                return  # timed out, or the tracker was closed
+            tracked.poll = None
+        self._checked(tracked, dict_result)
+
+    def _checked(self, tracked, dict_result):
+        """ resolve tracked, or schedule its next check, after a check answered dict_result (None if it didn't) """
+        now = time.time()
+        finished = dict_result is not None and dict_result.get('result') != 'NotFinished'
+        timed_out = tracked.deadline is not None and now >= tracked.deadline
+        if finished or timed_out:
+            if dict_result and dict_result.get('result') == 'Finished':
+                self._learn(tracked, now)
+            self._resolve(tracked, dict_result or tracked.last_result)
+        else:
+            tracked.last_result = dict_result or tracked.last_result
+            check_at = now + self._next_interval(tracked, now)
+            if tracked.deadline is not None:
+                check_at = min(check_at, tracked.deadline)
+            with self._condition:
+                if self._imports.get(tracked.progress_id) is tracked:
+                    self._schedule_check(tracked, check_at)
+
+    def _resolve(self, tracked, dict_result):
+        with self._condition:
+            if self._imports.get(tracked.progress_id) is not tracked:
+                return  # already resolved, or the tracker was closed
+            del self._imports[tracked.progress_id]
+        if dict_result is None:
+            # never got an answer from dotMailer
+            from .pydotmailer import PyDotMailer
+            dict_result = {'ok': False, 'result': None,
+                           'error_code': PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_UNFINISHED,
+                           'errors': ['No progress reported for import %s' % tracked.progress_id]}
+        tracked.future.set_result(dict_result)
+        if tracked.callback:
+            try:
+                tracked.callback(tracked.progress_id, dict_result)
+            except Exception:
+                logger.exception("Exception in import progress callback for %s" % tracked.progress_id)
+
+
+class _TrackedImport(object):
+    __slots__ = ('progress_id', 'upload_bytes', 'started', 'deadline', 'callback', 'future', 'interval',
+                 'last_result', 'check_at', 'poll')
+
+    def __init__(self, progress_id, upload_bytes, started, deadline, callback):
+        self.progress_id = progress_id
+        self.upload_bytes = upload_bytes
+        self.started = started
+        self.deadline = deadline
+        self.callback = callback
+        self.future = Future()
+        self.interval = 0.0
+        self.last_result = None
+        self.check_at = None
+        self.poll = None  # Future of the check waiting for dotMailer's answer, if any
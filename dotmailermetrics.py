@@ -0,0 +1,161 @@
+# dotmailermetrics - Latency, size and error metrics for dotMailer API calls, written in Python.
+# Copyright (c) 2012 Triggered Messaging Ltd, released under the MIT license
+# Home page:
+# https://github.com/TriggeredMessaging/pydotmailer/
+# See README and LICENSE files.
+#
+# dotMailer API docs are at http://www.dotmailer.co.uk/api/
+import bisect
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class DotMailerMetrics(object):
+    """
+    Counts every SOAP call a PyDotMailer makes, per operation: a latency histogram, request and response bytes,
+    calls in flight and how often each error code (RESULT_FIELDS_ERROR_CODE) came back. Each attempt of a retried call
+    counts as a call.
+    Read them with snapshot() or prometheus_text(). Pre and post call hooks see each call as it happens.
+    Thread-safe. One can be shared by several PyDotMailer instances.
+    """
+    # seconds, as the Prometheus client's defaults but going up to the read timeout
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, namespace='pydotmailer'):
+        """
+        @param buckets upper bounds, in seconds, of the latency histogram buckets
+        @param namespace prefix of the Prometheus metric names
+        """
+        self.buckets = tuple(sorted(buckets))
+        self.namespace = namespace
+        self._operations = {}  # operation -> _OperationMetrics
+        self._pre_call_hooks = []
+        self._post_call_hooks = []
+        self._lock = threading.Lock()
+
+    def add_pre_call_hook(self, hook):
+        """ Call hook(operation, kwargs) before each call """
+        self._pre_call_hooks.append(hook)
+
+    def add_post_call_hook(self, hook):
+        """ Call hook(operation, seconds, error_code) after each call. error_code is None if it succeeded. """
+        self._post_call_hooks.append(hook)
+
+    def call_started(self, operation, kwargs):
+        with self._lock:
+            self._get(operation).in_flight += 1
+        for hook in self._pre_call_hooks:
+            try:
+                hook(operation, kwargs)
+            except Exception:
+                logger.exception("Exception in pre call hook for %s" % operation)
+
+    def call_finished(self, operation, seconds, error_code=None, request_bytes=None, response_bytes=None):
+        """
+        Record a call which call_started was told about.
+        @param error_code as from PyDotMailer.unpack_exception, or None if it succeeded
+        """
+        bucket = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            metrics = self._get(operation)
+            metrics.in_flight -= 1
+            metrics.calls += 1
+            metrics.seconds += seconds
+            metrics.bucket_counts[bucket] += 1
+            metrics.request_bytes += request_bytes or 0
+            metrics.response_bytes += response_bytes or 0
+            if error_code is not None:
+                metrics.errors[error_code] = metrics.errors.get(error_code, 0) + 1
+        for hook in self._post_call_hooks:
+            try:
+                hook(operation, seconds, error_code)
+            except Exception:
+                logger.exception("Exception in post call hook for %s" % operation)
+
+    def call_rejected(self, operation, error_code):
+        """ Record a call which wasn't made, e.g. because the circuit breaker is open """
+        with self._lock:
+            metrics = self._get(operation)
+            metrics.errors[error_code] = metrics.errors.get(error_code, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self._operations = {}
+
+    def snapshot(self):
+        """
+        @return dict e.g. {'GetContactById': {'calls': 12, 'in_flight': 0, 'seconds_sum': 0.9,
+            'seconds_buckets': [(0.005, 0), (0.01, 2), ..., ('+Inf', 12)], 'request_bytes': 6144,
+            'response_bytes': 9216, 'errors': {'ERROR_CONTACT_NOT_FOUND': 1}}}
+            Buckets are cumulative, as Prometheus has them.
+        """
+        with self._lock:
+            return dict((operation, metrics.snapshot(self.buckets))
+                        for operation, metrics in self._operations.items())
+
+    def prometheus_text(self):
+        """ @return the metrics in the Prometheus text exposition format """
+        snapshot = self.snapshot()
+        prefix = self.namespace
+        lines = ['# HELP %s_call_duration_seconds Time taken by dotMailer API calls.' % prefix,
+                 '# TYPE %s_call_duration_seconds histogram' % prefix]
+        for operation, metrics in sorted(snapshot.items()):
+            for upper_bound, count in metrics['seconds_buckets']:
+                lines.append('%s_call_duration_seconds_bucket{operation="%s",le="%s"} %d'
+                             % (prefix, operation, upper_bound, count))
+            lines.append('%s_call_duration_seconds_sum{operation="%s"} %r' % (prefix, operation,
+                                                                               metrics['seconds_sum']))
+            lines.append('%s_call_duration_seconds_count{operation="%s"} %d' % (prefix, operation,
+                                                                                 metrics['calls']))
+        lines.extend(['# HELP %s_call_errors_total dotMailer API calls which failed, by error code.' % prefix,
+                      '# TYPE %s_call_errors_total counter' % prefix])
+        for operation, metrics in sorted(snapshot.items()):
+            for error_code, count in sorted(metrics['errors'].items()):
+                lines.append('%s_call_errors_total{operation="%s",error_code="%s"} %d'
+                             % (prefix, operation, _escape_label(error_code), count))
+        for name, help_text in (('request_bytes', 'Bytes sent to the dotMailer API.'),
+                                ('response_bytes', 'Bytes received from the dotMailer API.')):
+            lines.extend(['# HELP %s_%s_total %s' % (prefix, name, help_text),
+                          '# TYPE %s_%s_total counter' % (prefix, name)])
+            for operation, metrics in sorted(snapshot.items()):
+                lines.append('%s_%s_total{operation="%s"} %d' % (prefix, name, operation, metrics[name]))
+        lines.extend(['# HELP %s_calls_in_flight dotMailer API calls waiting for an answer.' % prefix,
+                      '# TYPE %s_calls_in_flight gauge' % prefix])
+        for operation, metrics in sorted(snapshot.items()):
+            lines.append('%s_calls_in_flight{operation="%s"} %d' % (prefix, operation, metrics['in_flight']))
+        return '\n'.join(lines) + '\n'
+
+    def _get(self, operation):
+        metrics = self._operations.get(operation)
+        if metrics is None:
+            metrics = self._operations[operation] = _OperationMetrics(len(self.buckets))
+        return metrics
+
+
+class _OperationMetrics(object):
+    __slots__ = ('calls', 'in_flight', 'seconds', 'bucket_counts', 'request_bytes', 'response_bytes', 'errors')
+
+    def __init__(self, bucket_count):
+        self.calls = 0
+        self.in_flight = 0
+        self.seconds = 0.0
+        self.bucket_counts = [0] * (bucket_count + 1)  # the last is for calls slower than every bucket
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.errors = {}
+
+    def snapshot(self, buckets):
+        cumulative = []
+        total = 0
+        for upper_bound, count in zip(buckets + ('+Inf',), self.bucket_counts):
+            total += count
+            cumulative.append((upper_bound, total))
+        return {'calls': self.calls, 'in_flight': self.in_flight, 'seconds_sum': self.seconds,
+                'seconds_buckets': cumulative, 'request_bytes': self.request_bytes,
+                'response_bytes': self.response_bytes, 'errors': dict(self.errors)}
+
+
+def _escape_label(value):
+    return ('%s' % value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,111 @@
+# dotmailerprocesses - Spread campaign sends over several processes, written in Python.
+# Copyright (c) 2012 Triggered Messaging Ltd, released under the MIT license
+# Home page:
+# https://github.com/TriggeredMessaging/pydotmailer/
+# See README and LICENSE files.
+#
+# dotMailer API docs are at http://www.dotmailer.co.uk/api/
+import multiprocessing
+import pickle
+import time
+from collections import deque
+from datetime import datetime
+
+import logging
+logger = logging.getLogger(__name__)
+
+_worker_dot_mailer = None  # this worker process's PyDotMailer, see _init_worker
+
+
+def send_campaign_to_contacts_in_processes(dot_mailer, campaign_id, contact_ids, send_date=None, processes=None,
+                                           chunk_size=200, max_workers=10, worker_setup=None, mp_context=None):
+    """
+    Send a campaign to many contacts from a pool of worker processes, each running
+    dot_mailer.send_campaign_to_contacts with max_workers threads on a chunk of contacts at a time. For when one
+    process runs out of CPU (parsing replies, etc.) before dotMailer runs out of capacity.
+    Each worker gets a pickled copy of dot_mailer (credentials and configuration, see PyDotMailer.__getstate__) and
+    connects lazily from the on-disk copy of the WSDL. Per-process helpers such as a rate limiter aren't copied:
+    attach them in worker_setup, remembering each process then makes its own share of the calls.
+    Same results and dot_mailer.last_send_stats as send_campaign_to_contacts (plus 'processes'), except that results
+    never hold suds objects. If a send fails with a campaign-wide error no more chunks are started; chunks already
+    running finish, and contacts never attempted are yielded with 'attempted': False.
+    @param dot_mailer PyDotMailer
+    @param campaign_id
+    @param contact_ids iterable of contact ids, consumed a chunk at a time
+    @param send_date date/time in server time when the campaign should be sent. Same for every contact.
+    @param processes number of worker processes. Defaults to the number of CPUs.
+    @param chunk_size contacts handed to a worker at a time
+    @param max_workers concurrent SOAP calls in each worker
+    @param worker_setup optional function(dot_mailer) run in each worker after unpickling its copy, e.g. to set
+        dot_mailer.rate_limiter. Must be picklable, i.e. defined at module level.
+    @param mp_context multiprocessing context, e.g. multiprocessing.get_context('spawn'). Defaults to the
+        platform's default.
+    @return generator of (contact_id, dict_result)
+    """
+    from .pydotmailer import PyDotMailer
+    if not send_date:
+        send_date = datetime.utcnow()  # one timestamp for the whole send
+    processes = processes or multiprocessing.cpu_count()
+    stats = {'sent': 0, 'failed': 0, 'not_attempted': 0, 'seconds': 0.0, 'per_second': 0.0, 'stopped_by': None,
+             'processes': processes}
+    dot_mailer.last_send_stats = stats
+    started = time.time()
+    contact_ids = iter(contact_ids)
+    pool = (mp_context or multiprocessing).Pool(processes, initializer=_init_worker,
+                                                initargs=(pickle.dumps(dot_mailer), worker_setup))
+    in_flight = deque()  # AsyncResults of the chunks sent to workers, oldest first
+    try:
+        while True:
+            while not stats['stopped_by'] and len(in_flight) < processes * 2:
+                chunk = []
+                for contact_id in contact_ids:
+                    chunk.append(contact_id)
+                    if len(chunk) >= chunk_size:
+                        break
+                if not chunk:
+                    break
+                in_flight.append(pool.apply_async(_send_chunk, (campaign_id, chunk, send_date, max_workers)))
+            if not in_flight:
+                break
+            for contact_id, dict_result in in_flight.popleft().get():
+                if dict_result.get('ok'):
+                    stats['sent'] += 1
+                elif dict_result.get('attempted', True):
+                    stats['failed'] += 1
+                    if dict_result.get('error_code') in PyDotMailer.CAMPAIGN_WIDE_ERROR_CODES:
+                        stats['stopped_by'] = dict_result.get('error_code')
+                else:
+                    stats['not_attempted'] += 1
+                yield contact_id, dot_mailer.make_result(dict_result)
+        if stats['stopped_by']:
+            logger.warning("Stopped sending campaign %s: %s" % (campaign_id, stats['stopped_by']))
+            for contact_id in contact_ids:
+                stats['not_attempted'] += 1
+                yield contact_id, dot_mailer.make_result({
+                    'ok': False, 'attempted': False, 'error_code': stats['stopped_by'],
+                    'errors': ['Not sent because an earlier send failed with %s' % stats['stopped_by']]})
+    finally:
+        pool.terminate()  # if the caller stopped iterating early, abandon chunks not yet finished
+        pool.join()
+        stats['seconds'] = time.time() - started
+        if stats['seconds']:
+            stats['per_second'] = (stats['sent'] + stats['failed']) / stats['seconds']
+        logger.info("send_campaign_to_contacts_in_processes campaign %s: %s" % (campaign_id, stats))
+
+
+def _init_worker(pickled_dot_mailer, worker_setup):
+    global _worker_dot_mailer
+    _worker_dot_mailer = pickle.loads(pickled_dot_mailer)
+    if worker_setup is not None:
+        worker_setup(_worker_dot_mailer)
+
+
+def _send_chunk(campaign_id, contact_ids, send_date, max_workers):
+    """ Runs in a worker. @return list of (contact_id, dict_result) for the chunk, as plain picklable dicts """
+    from .dotmailerresult import drop_raw
+    results = []
+    for contact_id, dict_result in _worker_dot_mailer.send_campaign_to_contacts(campaign_id, contact_ids,
+                                                                              send_date=send_date,
+                                                                              max_workers=max_workers):
+        results.append((contact_id, drop_raw(dict(dict_result))))
+    return results
@@ -0,0 +1,146 @@
+# dotmailerprofiler - Where the time goes in each call to the dotMailer API, written in Python.
+# Copyright (c) 2012 Triggered Messaging Ltd, released under the MIT license
+# Home page:
+# https://github.com/TriggeredMessaging/pydotmailer/
+# See README and LICENSE files.
+#
+# dotMailer API docs are at http://www.dotmailer.co.uk/api/
+import threading
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    wall_timer = time.perf_counter
+except AttributeError:
+    wall_timer = time.time  # Python 2
+try:
+    cpu_timer = time.thread_time
+except AttributeError:
+    cpu_timer = time.clock  # Python 2: CPU time of the whole process, so only meaningful with one thread calling
+
+# The phases of a call, in the order they happen:
+#   wait       rate limiter, circuit breaker and getting the thread's suds client (loading the WSDL, the first time)
+#   marshal    suds building the request envelope from the arguments
+#   plugin     DotMailerSudsPlugin.marshalled patching the envelope
+#   render     suds serialising the envelope to XML, or the fast path rendering it from a template
+#   network    the HTTP round trip through the connection pool, including waiting for a pooled connection
+#   parse      parsing the reply XML (for the fast path, all of reading the reply)
+#   unmarshal  suds building the result objects (or fault) from the parsed reply
+#   process    PyDotMailer turning that into dict_result, e.g. _clean_returned_data_fields
+PHASES = ('wait', 'marshal', 'plugin', 'render', 'network', 'parse', 'unmarshal', 'process')
+
+
+class DotMailerProfiler(object):
+    """
+    Attributes the wall clock and CPU time of each SOAP call a PyDotMailer makes to the phases in PHASES, and adds
+    them up per operation over a run. Read them with snapshot() or report().
+    The suds phases are timed by DotMailerProfilingPlugin (see dotmailersudsplugin), from the suds plugin lifecycle
+    (marshalled, sending, received, parsed). Each attempt of a retried call is timed separately.
+    Thread-safe. One can be shared by several PyDotMailer instances.
+    """
+    def __init__(self):
+        self._totals = {}  # operation -> {phase: [count, wall seconds, cpu seconds, max wall seconds]}
+        self._calls = {}  # operation -> number of calls timed
+        self._lock = threading.Lock()
+        self._thread_state = threading.local()
+
+    def start_call(self, operation):
+        """ Start timing a call on this thread, from the 'wait' phase. """
+        self._thread_state.call = [operation, wall_timer(), cpu_timer(), None, {}]
+
+    def mark(self, phase=None):
+        """
+        End a phase of this thread's call: the time since the last mark is added to phase.
+        @param phase one of PHASES, or None for the phase after the last one marked, e.g. 'network' if the call failed
+            after 'render'
+        """
+        call = getattr(self._thread_state, 'call', None)
+        if call is None:
+            return
+        operation, last_wall, last_cpu, last_phase, phases = call
+        if phase is None:
+            next_phase = PHASES.index(last_phase) + 1 if last_phase is not None else 0
+            phase = PHASES[min(next_phase, len(PHASES) - 1)]
+        wall = wall_timer()
+        cpu = cpu_timer()
+        times = phases.get(phase)
+        if times is None:
+            phases[phase] = [wall - last_wall, cpu - last_cpu]
+        else:
+            times[0] += wall - last_wall
+            times[1] += cpu - last_cpu
+        call[1], call[2], call[3] = wall, cpu, phase
+
+    def end_call(self):
+        """ Add this thread's call to the totals. Its 'process' phase runs on to finish_result. """
+        call = getattr(self._thread_state, 'call', None)
+        if call is None:
+            return
+        operation, last_wall, last_cpu, last_phase, phases = call
+        with self._lock:
+            self._calls[operation] = self._calls.get(operation, 0) + 1
+            for phase, (wall, cpu) in phases.items():
+                self._add(operation, phase, wall, cpu)
+        call[3], call[4] = 'process', {}
+
+    def finish_result(self):
+        """ End the 'process' phase of this thread's last call, when its dict_result is ready. """
+        call = getattr(self._thread_state, 'call', None)
+        if call is None or call[3] != 'process':
+            return
+        self._thread_state.call = None
+        wall = wall_timer() - call[1]
+        cpu = cpu_timer() - call[2]
+        with self._lock:
+            self._add(call[0], 'process', wall, cpu)
+
+    def reset(self):
+        with self._lock:
+            self._totals = {}
+            self._calls = {}
+
+    def snapshot(self):
+        """
+        @return dict e.g. {'GetContactById': {'calls': 100, 'phases': {'network': {'count': 100,
+            'wall_seconds': 1.2, 'cpu_seconds': 0.01, 'max_wall_seconds': 0.05}, ...}}}
+        """
+        with self._lock:
+            return dict((operation, {'calls': self._calls.get(operation, 0),
+                                     'phases': dict((phase, {'count': count, 'wall_seconds': wall, 'cpu_seconds': cpu,
+                                                             'max_wall_seconds': max_wall})
+                                                    for phase, (count, wall, cpu, max_wall) in phases.items())})
+                        for operation, phases in self._totals.items())
+
+    def report(self):
+        """ @return the totals as a text table: mean wall and CPU milliseconds per call, and share of wall time,
+        for each phase of each operation """
+        lines = ['%-36s %-10s %7s %10s %10s %10s %6s' % ('operation', 'phase', 'calls', 'wall ms', 'cpu ms',
+                                                         'max ms', 'wall%')]
+        for operation, totals in sorted(self.snapshot().items()):
+            calls = totals['calls'] or 1
+            total_wall = sum(times['wall_seconds'] for times in totals['phases'].values()) or 1
+            for phase in PHASES:
+                times = totals['phases'].get(phase)
+                if times is None:
+                    continue
+                lines.append('%-36s %-10s %7d %10.3f %10.3f %10.3f %5.1f%%' % (
+                    operation, phase, times['count'], times['wall_seconds'] * 1e3 / calls,
+                    times['cpu_seconds'] * 1e3 / calls, times['max_wall_seconds'] * 1e3,
+                    100.0 * times['wall_seconds'] / total_wall))
+        return '\n'.join(lines) + '\n'
+
+    def _add(self, operation, phase, wall, cpu):
+        phases = self._totals.get(operation)
+        if phases is None:
+            phases = self._totals[operation] = {}
+        totals = phases.get(phase)
+        if totals is None:
+            phases[phase] = [1, wall, cpu, wall]
+        else:
+            totals[0] += 1
+            totals[1] += wall
+            totals[2] += cpu
+            if wall > totals[3]:
+                totals[3] = wall
@@ -0,0 +1,157 @@
+# dotmailerratelimit - Client-side rate limiting for the dotMailer API, written in Python.
+# Copyright (c) 2012 Triggered Messaging Ltd, released under the MIT license
+# Home page:
+# https://github.com/TriggeredMessaging/pydotmailer/
+# See README and LICENSE files.
+#
+# dotMailer API docs are at http://www.dotmailer.co.uk/api/
+import threading
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveRateLimiter(object):
+    """
+    Token bucket whose rate adapts to the API quota: it halves (down to min_rate) when dotMailer reports
+    ERROR_APIUSAGE_EXCEEDED, then climbs back by recovery_step calls/second each second while calls succeed, up to
+    max_rate. So throughput settles just under the quota rather than bursting into it and getting locked out.
+    Thread-safe.
+    """
+    def __init__(self, max_rate=10.0, min_rate=0.2, burst=None, backoff_factor=0.5, recovery_step=None,
+                 backoff_interval=1.0, name=None):
+        """
+        @param max_rate calls per second allowed when dotMailer isn't complaining
+        @param min_rate never back off below this many calls per second
+        @param burst calls that can be made at once after a quiet spell. Defaults to max_rate (at least 1).
+        @param backoff_factor multiply the rate by this on each usage-exceeded fault
+        @param recovery_step calls/second added back per second of successful calls. Defaults to max_rate / 20,
+            so recovering from min_rate takes about 20 seconds.
+        @param backoff_interval seconds after backing off during which further usage-exceeded faults (from calls
+            already in flight) don't back off again
+        @param name for logging
+        """
+        self.max_rate = float(max_rate)
+        self.min_rate = float(min(min_rate, max_rate))
+        self.burst = float(burst or max(max_rate, 1.0))
+        self.backoff_factor = backoff_factor
+        self.recovery_step = recovery_step or self.max_rate / 20
+        self.backoff_interval = backoff_interval
+        self.name = name
+        self.rate = self.max_rate
+        self.throttled_count = 0
+        self.waited_seconds = 0.0
+        self._tokens = self.burst
+        self._updated = time.time()
+        self._last_backoff = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """ Wait until a call is allowed. @return seconds waited """
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    self.waited_seconds += waited
+                    return waited
+                wait_seconds = (1 - self._tokens) / self.rate
+            time.sleep(wait_seconds)
+            waited += wait_seconds
+
+    def on_success(self):
+        """ A call went through: creep back up towards max_rate. """
+        with self._lock:
+            if self.rate < self.max_rate:
+                # at the current rate there are about self.rate calls a second, so this adds recovery_step per second
+                self.rate = min(self.rate + self.recovery_step / max(self.rate, 1.0), self.max_rate)
+
+    def on_throttled(self):
+        """ dotMailer said ERROR_APIUSAGE_EXCEEDED: back off. """
+        with self._lock:
+            self.throttled_count += 1
+            now = time.time()
+            # calls already in flight will fail too; only back off once for them
+            if now - self._last_backoff < self.backoff_interval:
+                return
+            self._last_backoff = now
+            self.rate = max(self.rate * self.backoff_factor, self.min_rate)
+            self._tokens = 0.0
+            logger.warning("dotMailer API usage exceeded%s, backing off to %.2f calls/second" %
+                           (' for %s' % self.name if self.name else '', self.rate))
+
+    def stats(self):
+        """ @return dict e.g. {'rate': 8.5, 'max_rate': 10.0, 'throttled': 3, 'waited_seconds': 12.2} """
+        with self._lock:
+            return {'rate': self.rate, 'max_rate': self.max_rate, 'throttled': self.throttled_count,
+                    'waited_seconds': self.waited_seconds}
+
+    def _refill(self):
+        now = time.time()
+        self._tokens = min(self._tokens + (now - self._updated) * self.rate, self.burst)
+        self._updated = now
+
+
+class AccountRateLimiter(object):
+    """
+    Rate limits for one dotMailer account: every call passes the account-wide limiter, and calls to an operation
+    with its own limit (e.g. SendCampaignToContact) pass that one too.
+    Share one between every PyDotMailer using the account (see get_account_rate_limiter) since the quota is
+    per account.
+    """
+    def __init__(self, rate=10.0, operation_rates=None, **kwargs):
+        """
+        @param rate calls per second for the whole account
+        @param operation_rates dict of operation name -> calls per second, e.g. {'SendCampaignToContact': 2}
+        @param kwargs other AdaptiveRateLimiter arguments, applied to every limiter
+        """
+        self.account_limiter = AdaptiveRateLimiter(max_rate=rate, name='account', **kwargs)
+        self.operation_limiters = dict((operation, AdaptiveRateLimiter(max_rate=operation_rate, name=operation,
+                                                                       **kwargs))
+                                       for operation, operation_rate in (operation_rates or {}).items())
+
+    def acquire(self, operation):
+        """ Wait until operation may be called. @return seconds waited """
+        waited = 0.0
+        operation_limiter = self.operation_limiters.get(operation)
+        if operation_limiter is not None:
+            waited += operation_limiter.acquire()
+        return waited + self.account_limiter.acquire()
+
+    def on_success(self, operation):
+        self.account_limiter.on_success()
+        operation_limiter = self.operation_limiters.get(operation)
+        if operation_limiter is not None:
+            operation_limiter.on_success()
+
+    def on_throttled(self, operation):
+        self.account_limiter.on_throttled()
+        operation_limiter = self.operation_limiters.get(operation)
+        if operation_limiter is not None:
+            operation_limiter.on_throttled()
+
+    def stats(self):
+        """ @return dict of limiter name -> AdaptiveRateLimiter.stats() """
+        stats = {'account': self.account_limiter.stats()}
+        for operation, operation_limiter in self.operation_limiters.items():
+            stats[operation] = operation_limiter.stats()
+        return stats
+
+
+_account_rate_limiters = {}  # api_username -> AccountRateLimiter
+_account_rate_limiters_lock = threading.Lock()
+
+
+def get_account_rate_limiter(api_username, **kwargs):
+    """
+    The AccountRateLimiter shared by everything in this process using api_username, created with kwargs
+    (see AccountRateLimiter) on first use. Later kwargs are ignored.
+    """
+    with _account_rate_limiters_lock:
+        rate_limiter = _account_rate_limiters.get(api_username)
+        if rate_limiter is None:
+            rate_limiter = AccountRateLimiter(**kwargs)
+            _account_rate_limiters[api_username] = rate_limiter
+        return rate_limiter
@@ -0,0 +1,114 @@
+# dotmailerresponses - Parse dotMailer SOAP replies without building suds objects, written in Python.
+# Copyright (c) 2012 Triggered Messaging Ltd, released under the MIT license
+# Home page:
+# https://github.com/TriggeredMessaging/pydotmailer/
+# See README and LICENSE files.
+#
+# dotMailer API docs are at http://www.dotmailer.co.uk/api/
+import re
+from datetime import datetime
+from decimal import Decimal
+from io import BytesIO
+try:
+    from xml.etree.cElementTree import iterparse  # Python 2
+except ImportError:
+    from xml.etree.ElementTree import iterparse
+
+import logging
+logger = logging.getLogger(__name__)
+
+XSI_NAMESPACE = 'http://www.w3.org/2001/XMLSchema-instance'
+_XSI_TYPE = '{%s}type' % XSI_NAMESPACE
+_XSI_NIL = '{%s}nil' % XSI_NAMESPACE
+_DATETIME_RE = re.compile(r'^(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.(\d{1,6})\d*)?$')
+
+
+class DotMailerFault(Exception):
+    """
+    A SOAP fault from dotMailer, shaped like suds.WebFault (e.fault.faultstring, same message) so
+    PyDotMailer.unpack_exception treats it the same way.
+    """
+    def __init__(self, fault_string):
+        self.fault = _Fault(fault_string)
+        Exception.__init__(self, "Server raised fault: '%s'" % fault_string)
+
+
+class _Fault(object):
+    def __init__(self, faultstring):
+        self.faultstring = faultstring
+
+
+def parse_contact_reply(status, reason, body):
+    """
+    Read an APIContact reply (GetContactByEmail, GetContactById) in one pass over the XML, keeping only what
+    PyDotMailer returns.
+    Data field values are converted from their xsi:type as suds would (int, Decimal, datetime, bool...).
+    @param status HTTP status
+    @param reason HTTP reason
+    @param body response bytes
+    @return dict {'contact_id': 123, 'email': u'...', 'data_field_keys': [...], 'data_field_values': [...]},
+        keys and values as sent by dotMailer, so possibly of different lengths (see Case 1886)
+    @raise DotMailerFault for a SOAP fault
+    """
+    if status not in (200, 500):
+        raise Exception((status, reason))
+    contact = {'contact_id': None, 'email': None, 'data_field_keys': [], 'data_field_values': []}
+    fault_string = None
+    path = []  # local names of the open elements
+    for event, element in iterparse(BytesIO(body), events=('start', 'end')):
+        name = element.tag.rpartition('}')[2]
+        if event == 'start':
+            path.append(name)
+            continue
+        path.pop()
+        parent = path[-1] if path else ''
+        if parent == 'Values' and name == 'anyType':
+            contact['data_field_values'].append(_convert_value(element))
+        elif parent == 'Keys' and name == 'string':
+            contact['data_field_keys'].append(element.text)
+        elif parent.endswith('Result'):
+            if name == 'ID':
+                contact['contact_id'] = int(element.text)
+            elif name == 'Email':
+                contact['email'] = element.text
+        elif name == 'faultstring':
+            fault_string = element.text or ''
+        if name not in ('Keys', 'Values'):
+            element.clear()
+    if fault_string is not None:
+        raise DotMailerFault(fault_string)
+    if status != 200:
+        raise Exception((status, reason))
+    return contact
+
+
+def _convert_value(element):
+    """ @return the value of an anyType element, typed by its xsi:type """
+    if element.get(_XSI_NIL) == 'true':
+        return None
+    text = element.text
+    xsi_type = element.get(_XSI_TYPE)
+    if not text:
+        return None  # suds returns None for an empty value, whatever its type
+    if xsi_type is None:
+        return text
+    xsi_type = xsi_type.rpartition(':')[2]
+    try:
+        if xsi_type in ('int', 'long', 'short', 'byte', 'integer', 'unsignedInt', 'unsignedLong', 'unsignedShort'):
+            return int(text)
+        if xsi_type == 'decimal':
+            return Decimal(text)
+        if xsi_type in ('double', 'float'):
+            return float(text)
+        if xsi_type == 'boolean':
+            return text.strip() in ('true', '1')
+        if xsi_type == 'dateTime':
+            match = _DATETIME_RE.match(text.strip())
+            if match:
+                # dotMailer sends server times without a time zone. Anything else is left as text.
+                parts = [int(part) for part in match.groups()[:6]]
+                microseconds = int((match.group(7) or '0').ljust(6, '0'))
+                return datetime(*(parts + [microseconds]))
+    except ValueError:
+        logger.warning("Unexpected %s value from dotMailer: %r" % (xsi_type, text))
+    return text
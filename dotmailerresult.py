@@ -0,0 +1,132 @@
+# dotmailerresult - Compact results for PyDotMailer calls, written in Python.
+# Copyright (c) 2012 Triggered Messaging Ltd, released under the MIT license
+# Home page:
+# https://github.com/TriggeredMessaging/pydotmailer/
+# See README and LICENSE files.
+#
+# dotMailer API docs are at http://www.dotmailer.co.uk/api/
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping  # Python 2
+
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    text_type = unicode  # Python 2
+except NameError:
+    text_type = str
+
+
+class DotMailerResult(MutableMapping):
+    """
+    A dict_result in far less memory than a dict: the usual members are slots, and anything else goes in a small
+    dict made only when needed. It behaves as a dict for reading and updating (result.get('ok'), result['d_fields'],
+    'result' in result, result.update(...), ==) but isn't one, so use to_dict() for json.dumps and the like.
+    Created by PyDotMailer when compact_results=True.
+    """
+    FIELDS = ('ok', 'errors', 'error_code', 'contact_id', 'email', 'd_fields', 'result', 'contact', 'progress_id',
+              'attempts', 'elapsed_seconds', 'cached', 'attempted', 'skipped')
+    __slots__ = FIELDS + ('_extra',)
+
+    def __init__(self, dict_result=None, **kwargs):
+        self._extra = None
+        if dict_result:
+            self.update(dict_result)
+        if kwargs:
+            self.update(kwargs)
+
+    def get(self, key, default=None):
+        # MutableMapping's get goes through __getitem__ and KeyError, which is slow for the commonest call
+        try:
+            return getattr(self, key) if key in DotMailerResult.FIELDS else self._extra[key]
+        except (AttributeError, KeyError, TypeError):
+            return default
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key) if key in DotMailerResult.FIELDS else self._extra[key]
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in DotMailerResult.FIELDS:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        try:
+            if key in DotMailerResult.FIELDS:
+                delattr(self, key)
+            else:
+                del self._extra[key]
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        if key in DotMailerResult.FIELDS:
+            return hasattr(self, key)
+        return self._extra is not None and key in self._extra
+
+    def __iter__(self):
+        for key in DotMailerResult.FIELDS:
+            if hasattr(self, key):
+                yield key
+        if self._extra:
+            for key in self._extra:
+                yield key
+
+    def __len__(self):
+        return sum(1 for key in DotMailerResult.FIELDS if hasattr(self, key)) + len(self._extra or ())
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+    def __getstate__(self):
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        self._extra = None
+        self.update(state)
+
+    def copy(self):
+        return DotMailerResult(self)
+
+    def to_dict(self):
+        """ @return the result as a plain dict """
+        return dict(self.items())
+
+
+def drop_raw(dict_result):
+    """
+    Remove the suds objects from a dict_result ('result' when it's a suds object, and 'contact') and turn the strings
+    suds returned into plain ones, so nothing in it keeps suds data alive.
+    @return dict_result
+    """
+    if hasattr(dict_result.get('result'), '__keylist__'):
+        del dict_result['result']
+    elif 'result' in dict_result:
+        dict_result['result'] = _plain(dict_result['result'])  # e.g. 'Finished'
+    if 'contact' in dict_result:
+        del dict_result['contact']
+    for name in ('contact_id', 'email', 'progress_id'):
+        if name in dict_result:
+            dict_result[name] = _plain(dict_result[name])
+    d_fields = dict_result.get('d_fields')
+    if d_fields:
+        dict_result['d_fields'] = dict((_plain(field_name), _plain(field_value))
+                                       for field_name, field_value in d_fields.items())
+    return dict_result
+
+
+def _plain(value):
+    """ suds returns strings as subclasses of unicode, carrying extra attributes """
+    if isinstance(value, text_type) and type(value) is not text_type:
+        return text_type(value)
+    if isinstance(value, int) and not isinstance(value, bool) and type(value) is not int:
+        return int(value)
+    return value
@@ -0,0 +1,103 @@
+# dotmailerretry - Retry policy for transient dotMailer API failures, written in Python.
+# Copyright (c) 2012 Triggered Messaging Ltd, released under the MIT license
+# Home page:
+# https://github.com/TriggeredMessaging/pydotmailer/
+# See README and LICENSE files.
+#
+# dotMailer API docs are at http://www.dotmailer.co.uk/api/
+import errno
+import random
+import socket
+
+try:
+    import http.client as httplib
+except ImportError:
+    import httplib  # Python 2
+
+from suds.transport import TransportError
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class RetryPolicy(object):
+    """
+    When and how often PyDotMailer retries a failed SOAP call.
+    Timeouts, connection failures, HTTP errors without a SOAP fault, and API usage exceeded are retried, with
+    exponential backoff and full jitter, until max_attempts or deadline_seconds runs out. SOAP faults
+    (e.g. ERROR_CONTACT_NOT_FOUND) are dotMailer's answer, so they aren't, and nor is anything else raised, e.g. a
+    TypeError from a bad argument, which no number of attempts will fix.
+    Calls which aren't safe to repeat (NON_IDEMPOTENT_OPERATIONS, e.g. sending a campaign: a timed out send may
+    still have gone) are only retried when the request certainly never took effect, or when dedup_guard says so.
+    """
+    # Repeating these after an unknown outcome could e.g. send a contact the same campaign twice
+    NON_IDEMPOTENT_OPERATIONS = ('SendCampaignToContact', 'SendCampaignToContacts',
+                                 'AddContactsToAddressBookWithProgress')
+
+    def __init__(self, max_attempts=3, deadline_seconds=30.0, base_delay=0.5, max_delay=10.0, dedup_guard=None):
+        """
+        @param max_attempts most calls to make, including the first
+        @param deadline_seconds don't start another attempt if it would begin this long after the first
+        @param base_delay backoff before the second attempt is up to this many seconds, doubling each time after
+        @param max_delay longest backoff between attempts
+        @param dedup_guard optional function(operation, kwargs, exception) for non-idempotent operations, returning
+            True if it's safe to repeat the call, e.g. because the caller has checked the first attempt didn't
+            take effect
+        """
+        self.max_attempts = max_attempts
+        self.deadline_seconds = deadline_seconds
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.dedup_guard = dedup_guard
+
+    def is_retryable(self, operation, kwargs, e, error_code):
+        """
+        @param operation the SOAP operation name
+        @param kwargs its arguments
+        @param e the exception it raised
+        @param error_code from PyDotMailer.unpack_exception(e)
+        @return True if the call should be tried again
+        """
+        from .pydotmailer import PyDotMailer
+        usage_exceeded = error_code == PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_CAMPAIGN_APINOTPERMITTED
+        if not usage_exceeded and not is_transport_error(e):
+            return False
+        if operation not in self.NON_IDEMPOTENT_OPERATIONS:
+            return True
+        if usage_exceeded or self._never_sent(e):
+            return True  # dotMailer refused it, or it never got there, so nothing happened
+        if self.dedup_guard is not None:
+            try:
+                return bool(self.dedup_guard(operation, kwargs, e))
+            except Exception:
+                logger.exception("Exception in retry dedup_guard for %s" % operation)
+        return False
+
+    def backoff_seconds(self, failed_attempts):
+        """ @return seconds to wait after failed_attempts attempts have failed """
+        return random.uniform(0, min(self.base_delay * (2 ** (failed_attempts - 1)), self.max_delay))
+
+    def _never_sent(self, e):
+        """ True if the request can't have reached dotMailer, e.g. the connection was refused """
+        reason = getattr(e, 'reason', None)
+        for error in (e, reason):
+            if getattr(error, 'never_sent', False):
+                return True  # e.g. dotmailertransport.ConnectionPoolTimeout
+            if isinstance(error, socket.error) and not isinstance(error, socket.timeout) and \
+                    getattr(error, 'errno', None) in (errno.ECONNREFUSED, errno.EHOSTUNREACH, errno.ENETUNREACH):
+                return True
+            if isinstance(error, socket.gaierror):
+                return True  # couldn't look up the host
+        return False
+
+
+def is_transport_error(e):
+    """ True if e is a failure to get the request to dotMailer or its reply back: a socket error (including
+    timeouts and refused connections), or an HTTP error without a SOAP fault. Also used by PyDotMailer to decide
+    what its circuit breaker counts as a failure. """
+    if isinstance(e, (socket.error, httplib.HTTPException, TransportError)) or \
+            isinstance(getattr(e, 'reason', None), socket.error):
+        return True
+    # suds (and the fast path, as suds does) raises an HTTP error status as Exception((status, reason))
+    return type(e) is Exception and len(e.args) == 1 and isinstance(e.args[0], tuple) and \
+        len(e.args[0]) == 2 and isinstance(e.args[0][0], int)
@@ -0,0 +1,268 @@
+# dotmailersendqueue - Durable local queue of campaign sends, written in Python.
+# Copyright (c) 2012 Triggered Messaging Ltd, released under the MIT license
+# Home page:
+# https://github.com/TriggeredMessaging/pydotmailer/
+# See README and LICENSE files.
+#
+# dotMailer API docs are at http://www.dotmailer.co.uk/api/
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+try:
+    import simplejson as json
+except ImportError:
+    import json  # fall back to traditional json module.
+
+import logging
+logger = logging.getLogger(__name__)
+
+ISO_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'  # as PyDotMailer.dt_to_iso_date
+
+
+class SendQueue(object):
+    """
+    Campaign sends queued in a local SQLite file, in front of PyDotMailer.send_campaign_to_contact, so a process which
+    dies part way through a campaign can pick up where it left off without sending anyone the campaign twice.
+    Each (campaign_id, contact_id, send_date) is queued once however often it's enqueued, and the outcome of each send
+    is recorded as soon as it's known. Item states:
+        pending      waiting to be sent (including after dotMailer refused it for now, e.g. API usage exceeded)
+        in_progress  claimed by a drain
+        sent         dotMailer accepted it
+        failed       dotMailer rejected it, e.g. ERROR_CONTACT_UNSUBSCRIBED
+        unknown      the send may or may not have gone: it timed out or lost its connection, or the process draining
+                     it died. Never resent automatically; see requeue_unknown.
+    Several processes may drain one queue file at once.
+    """
+    PENDING = 'pending'
+    IN_PROGRESS = 'in_progress'
+    SENT = 'sent'
+    FAILED = 'failed'
+    UNKNOWN = 'unknown'
+    STATES = (PENDING, IN_PROGRESS, SENT, FAILED, UNKNOWN)
+
+    def __init__(self, dot_mailer, path, workers=10, claim_size=100, lease_seconds=600):
+        """
+        @param dot_mailer PyDotMailer to send with
+        @param path SQLite database file. Created if it doesn't exist.
+        @param workers default number of concurrent sends while draining
+        @param claim_size items claimed from the queue at a time
+        @param lease_seconds an item in_progress for longer than this belongs to a drain which died, and is marked
+            unknown. Must be longer than any send could take, retries included.
+        """
+        self.dot_mailer = dot_mailer
+        self.path = path
+        self.workers = workers
+        self.claim_size = claim_size
+        self.lease_seconds = lease_seconds
+        self.last_drain_stats = None
+        self._owner = '%s-%s' % (os.getpid(), uuid.uuid4().hex)  # marks the items this queue has claimed
+        self._local = threading.local()  # sqlite connections can't be shared between threads
+        connection = self._connection()
+        connection.execute('PRAGMA journal_mode=WAL')  # so enqueueing doesn't wait for a drain's writes, and vice versa
+        connection.execute('CREATE TABLE IF NOT EXISTS send_queue '
+                           '(campaign_id INTEGER, contact_id INTEGER, send_date TEXT, status TEXT, attempts INTEGER, '
+                           'error_code TEXT, result TEXT, owner TEXT, enqueued_at REAL, claimed_at REAL, '
+                           'finished_at REAL, PRIMARY KEY (campaign_id, contact_id, send_date))')
+        connection.execute('CREATE INDEX IF NOT EXISTS send_queue_status ON send_queue (status, enqueued_at)')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)  # autocommit
+            self._local.connection = connection
+        return connection
+
+    def enqueue(self, campaign_id, contact_id, send_date=None):
+        """
+        @param send_date date/time in server time when the campaign should be sent, or None to send when drained
+        @return True if queued, False if it was already in the queue (in any state)
+        """
+        return self.enqueue_many(campaign_id, [contact_id], send_date) == 1
+
+    def enqueue_many(self, campaign_id, contact_ids, send_date=None):
+        """ Queue a send to each of contact_ids, in one transaction. @return number of sends newly queued """
+        send_date = send_date.strftime(ISO_DATE_FORMAT) if send_date else ''
+        now = time.time()
+        connection = self._connection()
+        before = connection.total_changes
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.executemany('INSERT OR IGNORE INTO send_queue (campaign_id, contact_id, send_date, status, '
+                                   'attempts, enqueued_at) VALUES (?, ?, ?, ?, 0, ?)',
+                                   ((campaign_id, contact_id, send_date, SendQueue.PENDING, now)
+                                    for contact_id in contact_ids))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return connection.total_changes - before
+
+    def drain(self, workers=None, max_items=None):
+        """
+        Send pending items, workers at a time, until none are left (or max_items have been sent).
+        After a campaign-wide error (PyDotMailer.CAMPAIGN_WIDE_ERROR_CODES, e.g. ERROR_CAMPAIGN_SENDNOTPERMITTED) no
+        more of that campaign's items are sent in this drain; they stay pending. The drain also stops after a send
+        is refused for now (API usage exceeded, or the circuit breaker is open), leaving the rest pending.
+        Items left in_progress by a drain which died are marked unknown first (see lease_seconds).
+        @return dict, also kept as self.last_drain_stats, e.g. {'sent': 980, 'failed': 12, 'unknown': 0,
+            'requeued': 8, 'recovered': 0, 'stopped_campaigns': {}, 'seconds': 11.6, 'per_second': 85.5}
+        """
+        workers = workers or self.workers
+        stats = {'sent': 0, 'failed': 0, 'unknown': 0, 'requeued': 0, 'recovered': self.recover(),
+                 'stopped_campaigns': {}, 'seconds': 0.0, 'per_second': 0.0}
+        self.last_drain_stats = stats
+        started = time.time()
+        try:
+            # stop once an item is requeued: dotMailer is refusing sends for now, so claiming more won't help
+            while not stats['requeued'] and \
+                    (max_items is None or stats['sent'] + stats['failed'] + stats['unknown'] < max_items):
+                claim_size = self.claim_size
+                if max_items is not None:
+                    claim_size = min(claim_size, max_items - stats['sent'] - stats['failed'] - stats['unknown'])
+                items = self._claim(claim_size, stats['stopped_campaigns'])
+                if not items:
+                    break
+                self._send_claimed(items, workers, stats)
+        finally:
+            stats['seconds'] = time.time() - started
+            if stats['seconds']:
+                stats['per_second'] = (stats['sent'] + stats['failed'] + stats['unknown']) / stats['seconds']
+            logger.info("SendQueue drain of %s: %s" % (self.path, stats))
+        return stats
+
+    def _send_claimed(self, items, workers, stats):
+        """ Send items claimed by drain, workers at a time, recording each outcome and adding it to stats """
+        from .pydotmailer import PyDotMailer
+        started = set()  # items whose send has begun, so may have reached dotMailer
+        lock = threading.Lock()
+
+        def send(item):
+            with lock:
+                if started is None:  # this batch is being wound up, don't start anything more
+                    return {'ok': False, 'errors': ['Drain stopped'], 'error_code': None}
+                started.add(item)
+            return self.dot_mailer.send_campaign_to_contact(
+                item[0], item[1], send_date=datetime.strptime(item[2], ISO_DATE_FORMAT) if item[2] else None)
+        results = self.dot_mailer.fan_out(send, iter(items), workers,
+                                           stop_error_codes=PyDotMailer.CAMPAIGN_WIDE_ERROR_CODES)
+        try:
+            for item, dict_result in results:
+                status = self._record(item, dict_result)
+                stats['requeued' if status == SendQueue.PENDING else status] += 1
+                if dict_result.get('error_code') in PyDotMailer.CAMPAIGN_WIDE_ERROR_CODES:
+                    stats['stopped_campaigns'][item[0]] = dict_result.get('error_code')
+        finally:
+            # also reached if _record raises. Items never started (e.g. after a campaign-wide error) go back
+            # to pending; ones started but not recorded stay in_progress, for recover() to mark unknown.
+            results.close()
+            with lock:
+                never_started = [item for item in items if item not in started]
+                started = None
+            self._release(never_started)
+
+    def recover(self):
+        """ Mark items whose lease has run out, i.e. whose drain died mid-send, as unknown.
+        @return the number marked """
+        connection = self._connection()
+        before = connection.total_changes
+        connection.execute('UPDATE send_queue SET status = ?, error_code = NULL, finished_at = ? '
+                           'WHERE status = ? AND claimed_at < ?',
+                           (SendQueue.UNKNOWN, time.time(), SendQueue.IN_PROGRESS, time.time() - self.lease_seconds))
+        recovered = connection.total_changes - before
+        if recovered:
+            logger.warning("SendQueue %s: %d sends were in progress when their drain stopped, so may or may not "
+                           "have gone. Marked unknown." % (self.path, recovered))
+        return recovered
+
+    def requeue_unknown(self, campaign_id=None):
+        """ Make unknown items pending again, once you've decided resending is better than possibly not sending.
+        @param campaign_id only this campaign's. None for every campaign.
+        @return the number requeued """
+        connection = self._connection()
+        before = connection.total_changes
+        if campaign_id is None:
+            connection.execute('UPDATE send_queue SET status = ? WHERE status = ?', (SendQueue.PENDING,
+                                                                                    SendQueue.UNKNOWN))
+        else:
+            connection.execute('UPDATE send_queue SET status = ? WHERE status = ? AND campaign_id = ?',
+                               (SendQueue.PENDING, SendQueue.UNKNOWN, campaign_id))
+        return connection.total_changes - before
+
+    def get(self, campaign_id, contact_id, send_date=None):
+        """ @return dict e.g. {'status': 'failed', 'attempts': 1, 'error_code': 'ERROR_CONTACT_UNSUBSCRIBED',
+            'result': {'ok': False, 'errors': [...], 'error_code': ...}}, or None if it was never queued """
+        send_date = send_date.strftime(ISO_DATE_FORMAT) if send_date else ''
+        row = self._connection().execute('SELECT status, attempts, error_code, result FROM send_queue '
+                                         'WHERE campaign_id = ? AND contact_id = ? AND send_date = ?',
+                                         (campaign_id, contact_id, send_date)).fetchone()
+        if row is None:
+            return None
+        return {'status': row[0], 'attempts': row[1], 'error_code': row[2],
+                'result': json.loads(row[3]) if row[3] else None}
+
+    def depth(self, campaign_id=None):
+        """ @return dict of state -> number of items, e.g. {'pending': 1200, 'in_progress': 100, 'sent': 8700,
+            'failed': 12, 'unknown': 0} """
+        if campaign_id is None:
+            rows = self._connection().execute('SELECT status, COUNT(*) FROM send_queue GROUP BY status')
+        else:
+            rows = self._connection().execute('SELECT status, COUNT(*) FROM send_queue WHERE campaign_id = ? '
+                                              'GROUP BY status', (campaign_id,))
+        depth = dict((state, 0) for state in SendQueue.STATES)
+        depth.update(rows.fetchall())
+        return depth
+
+    def _claim(self, claim_size, stopped_campaigns):
+        """ Claim up to claim_size pending items, oldest first, skipping stopped_campaigns.
+        @return list of (campaign_id, contact_id, send_date) """
+        connection = self._connection()
+        now = time.time()
+        excluded = list(stopped_campaigns)
+        connection.execute('BEGIN IMMEDIATE')  # so two drains can't claim the same items
+        try:
+            connection.execute('UPDATE send_queue SET status = ?, owner = ?, claimed_at = ?, attempts = attempts + 1 '
+                               'WHERE rowid IN (SELECT rowid FROM send_queue WHERE status = ? %s '
+                               'ORDER BY enqueued_at LIMIT ?)'
+                               % ('AND campaign_id NOT IN (%s)' % ','.join('?' * len(excluded)) if excluded else ''),
+                               [SendQueue.IN_PROGRESS, self._owner, now, SendQueue.PENDING] + excluded + [claim_size])
+            items = connection.execute('SELECT campaign_id, contact_id, send_date FROM send_queue '
+                                       'WHERE status = ? AND owner = ? AND claimed_at = ? ORDER BY enqueued_at',
+                                       (SendQueue.IN_PROGRESS, self._owner, now)).fetchall()
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return items
+
+    def _release(self, items):
+        """ Make claimed items which weren't sent pending again """
+        if items:
+            self._connection().executemany('UPDATE send_queue SET status = ?, attempts = attempts - 1 '
+                                           'WHERE campaign_id = ? AND contact_id = ? AND send_date = ? AND owner = ?',
+                                           [(SendQueue.PENDING,) + tuple(item) + (self._owner,) for item in items])
+
+    def _record(self, item, dict_result):
+        """ Store the outcome of sending item. @return its new status """
+        from .pydotmailer import PyDotMailer
+        error_code = dict_result.get('error_code')
+        if dict_result.get('ok'):
+            status = SendQueue.SENT
+        elif error_code in (PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_CAMPAIGN_APINOTPERMITTED,
+                            PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_CIRCUIT_OPEN):
+            status = SendQueue.PENDING  # refused before it was sent, so try again later
+        elif error_code in (PyDotMailer.RESULT_FIELDS_ERROR_CODE.TIMEOUT_ERROR,
+                            PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_OTHER):
+            status = SendQueue.UNKNOWN  # no answer, so it may have gone
+        else:
+            status = SendQueue.FAILED
+        result = json.dumps({'ok': bool(dict_result.get('ok')), 'error_code': error_code,
+                             'errors': ['%s' % error for error in dict_result.get('errors') or []],
+                             'attempts': dict_result.get('attempts')})
+        self._connection().execute('UPDATE send_queue SET status = ?, error_code = ?, result = ?, finished_at = ? '
+                                   'WHERE campaign_id = ? AND contact_id = ? AND send_date = ?',
+                                   (status, error_code, result, time.time()) + tuple(item))
+        return status
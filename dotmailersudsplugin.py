@@ -56,4 +56,33 @@ class DotMailerSudsPlugin(MessagePlugin):
 
 
         except:
-            logger.exception("Exception in DotMailerSudsPlugin::marshalled")
\ No newline at end of file
+            logger.exception("Exception in DotMailerSudsPlugin::marshalled")
+
+class DotMailerProfilingPlugin(MessagePlugin):
+    """
+    plugin for SUDS which times the phases of each call for a dotmailerprofiler.DotMailerProfiler, wrapping
+    another plugin (normally DotMailerSudsPlugin) so the time spent in that is timed as its own phase.
+    """
+    def __init__(self, profiler, plugin):
+        self.profiler = profiler
+        self.plugin = plugin
+
+    def marshalled(self, context):
+        self.profiler.mark('marshal')
+        self.plugin.marshalled(context)
+        self.profiler.mark('plugin')
+
+    def sending(self, context):
+        self.plugin.sending(context)
+        self.profiler.mark('render')
+
+    def received(self, context):
+        self.profiler.mark('network')
+        self.plugin.received(context)
+
+    def parsed(self, context):
+        self.plugin.parsed(context)
+        self.profiler.mark('parse')
+
+    def unmarshalled(self, context):
+        self.plugin.unmarshalled(context)
@@ -0,0 +1,268 @@
+# dotmailertransport - Keep-alive connection pooling for SOAP calls to the dotMailer API, written in Python.
+# Copyright (c) 2012 Triggered Messaging Ltd, released under the MIT license
+# Home page:
+# https://github.com/TriggeredMessaging/pydotmailer/
+# See README and LICENSE files.
+#
+# dotMailer API docs are at http://www.dotmailer.co.uk/api/
+import os
+import socket
+import threading
+import time
+from io import BytesIO
+
+try:
+    import http.client as httplib
+except ImportError:
+    import httplib  # Python 2
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse  # Python 2
+
+from suds.transport import Transport, TransportError, Reply
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Errors writing a request which mean a kept-alive connection was closed by the server while it sat in the pool.
+STALE_CONNECTION_ERRORS = (httplib.CannotSendRequest, socket.error)
+
+
+class ConnectionPoolTimeout(socket.timeout):
+    """ No pooled connection to the host came free within the pool's acquire_timeout. The request was never sent,
+    so it's safe to repeat (see dotmailerretry). """
+    never_sent = True
+
+
+class DotMailerPooledTransport(Transport):
+    """
+    suds transport which sends requests through a DotMailerConnectionPool, so a SOAP call reuses a kept-alive
+    connection instead of paying for a new TCP connection and TLS handshake each time (as the default suds
+    urllib transport does).
+    suds ties each transport instance to the options of one client, so every client gets its own (cheap)
+    transport; it's the connection pool behind them which is shared.
+    """
+    def __init__(self, connection_pool):
+        """
+        @param connection_pool DotMailerConnectionPool, or any object with the same request() method
+        """
+        Transport.__init__(self)
+        self.connection_pool = connection_pool
+
+    def open(self, request):
+        """ GET request.url, e.g. the WSDL. @return file-like object with the body """
+        status, reason, headers, body = self.connection_pool.request('GET', request.url, None, request.headers)
+        if status != httplib.OK:
+            raise TransportError(reason, status, BytesIO(body))
+        return BytesIO(body)
+
+    def send(self, request):
+        """ POST a SOAP envelope. @return suds Reply, or None for an empty 202/204 response """
+        status, reason, headers, body = self.connection_pool.request('POST', request.url, request.message,
+                                                                     request.headers)
+        if status in (httplib.ACCEPTED, httplib.NO_CONTENT):
+            return None
+        if status != httplib.OK:
+            # suds reads the SOAP fault from the body of the error (normally a 500)
+            raise TransportError(reason, status, BytesIO(body))
+        return Reply(status, headers, body)
+
+
+class DotMailerConnectionPool(object):
+    """
+    Keep-alive HTTP(S) connections, pooled per host. Thread-safe: one pool can serve many threads and many
+    PyDotMailer instances.
+    Timeouts are raised as socket.timeout, which PyDotMailer.unpack_exception reports as TIMEOUT_ERROR.
+    A request is only ever written once: if a pooled connection turns out to have been closed by the server, it's
+    sent again on a new connection only when writing it failed, never once the server may have received it.
+    """
+    def __init__(self, pool_size=10, connect_timeout=10.0, read_timeout=60.0, keep_alive=True, idle_timeout=30.0,
+                 acquire_timeout=60.0):
+        """
+        @param pool_size maximum number of connections open to one host at once. Further calls wait for a free one.
+        @param connect_timeout seconds allowed to establish a connection
+        @param read_timeout seconds allowed for the server to respond to a request
+        @param keep_alive False to close each connection after use (i.e. the old behaviour)
+        @param idle_timeout seconds an unused connection is kept before being discarded, so we don't reuse
+            connections the server has already dropped
+        @param acquire_timeout seconds to wait for a free connection when pool_size are in use, before raising
+            ConnectionPoolTimeout. None to wait as long as it takes
+        """
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.keep_alive = keep_alive
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self._pools = {}  # (scheme, host, port) -> _HostPool
+        self._pools_lock = threading.Lock()
+        self._pid = os.getpid()
+        self._thread_state = threading.local()  # sizes of this thread's last request, for take_last_sizes
+
+    def close(self):
+        """ Close every pooled connection. The pool can still be used afterwards. """
+        with self._pools_lock:
+            pools = list(self._pools.values())
+            self._pools = {}
+        for pool in pools:
+            pool.close()
+
+    def request(self, method, url, body=None, headers=None):
+        """ Make one HTTP request over a pooled connection.
+        @return (status, reason, headers dict, body bytes)
+        """
+        if self._pid != os.getpid():
+            self._after_fork()
+        url = urlparse(url)
+        pool = self._get_pool(url)
+        path = url.path or '/'
+        if url.query:
+            path = '%s?%s' % (path, url.query)
+        headers = dict(headers or {})
+        headers['Connection'] = 'keep-alive' if self.keep_alive else 'close'
+        connection, reused = pool.acquire()
+        try:
+            try:
+                self._send(connection, method, path, body, headers)
+            except socket.timeout:
+                raise
+            except STALE_CONNECTION_ERRORS:
+                if not reused:
+                    raise
+                # The server closed an idle keep-alive connection, so we couldn't write our request. Try once more
+                # on a new connection.
+                logger.debug("Stale pooled connection to %s, reconnecting" % url.netloc)
+                connection.close()
+                connection = pool.new_connection()
+                self._send(connection, method, path, body, headers)
+            # Once the request is written, a failure may come after dotMailer acted on it, so it's raised for the
+            # caller's retry policy to judge rather than repeated here.
+            response = connection.getresponse()
+            data = response.read()
+            reusable = self.keep_alive and not response.will_close
+            pool.release(connection, reusable)
+            connection = None
+            self._thread_state.last_sizes = (len(body or ''), len(data))
+            return response.status, response.reason, dict(response.getheaders()), data
+        finally:
+            if connection is not None:
+                # something went wrong part way through a request, so the connection is in an unknown state
+                pool.release(connection, False)
+
+    def _after_fork(self):
+        """ This is a forked copy, sharing the parent's sockets. Drop them (without a word to the server, which is
+        still talking to the parent) and start afresh. """
+        self._pid = os.getpid()
+        self._pools = {}
+        self._pools_lock = threading.Lock()
+        self._thread_state = threading.local()
+
+    def take_last_sizes(self):
+        """ @return (request body bytes, response body bytes) of this thread's last request since the last call,
+        or (None, None) """
+        last_sizes = getattr(self._thread_state, 'last_sizes', None)
+        self._thread_state.last_sizes = None
+        return last_sizes or (None, None)
+
+    def _send(self, connection, method, path, body, headers):
+        """ write the request on a connection, connecting first if need be """
+        if connection.sock is None:
+            connection.connect()  # uses connect_timeout
+        connection.sock.settimeout(self.read_timeout)
+        connection.request(method, path, body, headers)
+
+    def _get_pool(self, url):
+        scheme = url.scheme or 'http'
+        port = url.port or (443 if scheme == 'https' else 80)
+        key = (scheme, url.hostname, port)
+        pool = self._pools.get(key)
+        if pool is None:
+            with self._pools_lock:
+                pool = self._pools.get(key)
+                if pool is None:
+                    pool = _HostPool(scheme, url.hostname, port, self.pool_size, self.connect_timeout,
+                                     self.idle_timeout, self.acquire_timeout)
+                    self._pools[key] = pool
+        return pool
+
+
+class _HostPool(object):
+    """ Idle connections to one host, reused most-recently-used first, with at most size connections in use. """
+    def __init__(self, scheme, host, port, size, connect_timeout, idle_timeout, acquire_timeout):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self.size = size
+        self._idle = []  # list of (connection, time it was returned to the pool)
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition()  # not Semaphore.acquire(timeout=...), which Python 2 lacks
+        self._in_use = 0
+
+    def acquire(self):
+        """ @return (connection, reused) where reused is True if it was taken from the idle list """
+        with self._slot_freed:
+            deadline = time.time() + self.acquire_timeout if self.acquire_timeout is not None else None
+            while self._in_use >= self.size:
+                remaining = deadline - time.time() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    raise ConnectionPoolTimeout('No free connection to %s within %s seconds'
+                                                % (self.host, self.acquire_timeout))
+                self._slot_freed.wait(remaining)
+            self._in_use += 1
+        now = time.time()
+        with self._lock:
+            while self._idle:
+                connection, returned_at = self._idle.pop()
+                if now - returned_at < self.idle_timeout:
+                    return connection, True
+                connection.close()
+        return self.new_connection(), False
+
+    def release(self, connection, reusable):
+        if reusable:
+            with self._lock:
+                self._idle.append((connection, time.time()))
+        else:
+            connection.close()
+        with self._slot_freed:
+            self._in_use -= 1
+            self._slot_freed.notify()
+
+    def new_connection(self):
+        if self.scheme == 'https':
+            return httplib.HTTPSConnection(self.host, self.port, timeout=self.connect_timeout)
+        return httplib.HTTPConnection(self.host, self.port, timeout=self.connect_timeout)
+
+    def close(self):
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+        for connection, returned_at in idle:
+            connection.close()
+
+
+_default_connection_pool = None
+_default_connection_pool_lock = threading.Lock()
+
+
+def _reset_lock_after_fork():
+    """ Another thread may have held the lock when the process forked, leaving it locked for good in the child """
+    global _default_connection_pool_lock
+    _default_connection_pool_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):  # Python 3.7+
+    os.register_at_fork(after_in_child=_reset_lock_after_fork)
+
+
+def get_default_connection_pool():
+    """ The connection pool shared by every PyDotMailer which isn't given its own. """
+    global _default_connection_pool
+    with _default_connection_pool_lock:
+        if _default_connection_pool is None:
+            _default_connection_pool = DotMailerConnectionPool()
+        return _default_connection_pool
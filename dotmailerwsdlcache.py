@@ -0,0 +1,174 @@
+# dotmailerwsdlcache - Cache the parsed dotMailer service definition, written in Python.
+# Copyright (c) 2012 Triggered Messaging Ltd, released under the MIT license
+# Home page:
+# https://github.com/TriggeredMessaging/pydotmailer/
+# See README and LICENSE files.
+#
+# dotMailer API docs are at http://www.dotmailer.co.uk/api/
+import hashlib
+import os
+import shutil
+import stat
+import threading
+
+import suds
+from suds.cache import NoCache, ObjectCache
+from suds.client import Client as SOAPClient, Factory, ServiceSelector
+from suds.options import Options
+from suds.transport.https import HttpAuthenticated
+
+from .pydotmailer import __version__
+
+import logging
+logger = logging.getLogger(__name__)
+
+from .dotmailersudsplugin import DotMailerSudsPlugin
+
+# Default time to live for the on-disk copy of the parsed WSDL.
+DEFAULT_WSDL_CACHE_SECONDS = 24 * 60 * 60
+
+# One parsed client per (api_url, cache location). Each PyDotMailer gets a clone, which shares the WSDL.
+_shared_clients = {}
+_shared_clients_lock = threading.Lock()
+
+
+def _reset_lock_after_fork():
+    """ Another thread may have held the lock when the process forked, leaving it locked for good in the child.
+    The parsed clients themselves are still good, so a forked worker needn't load the WSDL again. """
+    global _shared_clients_lock
+    _shared_clients_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):  # Python 3.7+
+    os.register_at_fork(after_in_child=_reset_lock_after_fork)
+
+
+def default_cache_location():
+    """ Folder used for the on-disk cache when the caller doesn't choose one: pydotmailer in the user's own cache
+    folder ($XDG_CACHE_HOME, or ~/.cache).
+    Unlike the suds default (a temporary folder removed at process exit) this survives restarts, so a new
+    worker process can load the pickled service definition instead of downloading and parsing the WSDL.
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'pydotmailer')
+
+
+def is_safe_cache_location(location):
+    """
+    Create location if need be, readable by the current user only, and check that it's safe to load pickles from.
+    suds unpickles whatever it finds in the cache, so a folder another user can write to would let them run code as
+    this one: it must belong to the current user, and not be writable by anyone else.
+    @return True if it's safe
+    """
+    try:
+        os.makedirs(location, 0o700)
+    except OSError:
+        if not os.path.isdir(location):
+            logger.warning("Can't create WSDL cache folder %s" % location)
+            return False
+    if not hasattr(os, 'getuid'):
+        return True  # Windows: no POSIX owner and mode to check
+    status = os.stat(location)
+    if status.st_uid != os.getuid() or status.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        logger.warning("Not using WSDL cache folder %s: it must belong to this user, and not be writable by others"
+                       % location)
+        return False
+    return True
+
+
+class DotMailerWsdlCache(ObjectCache):
+    """
+    suds ObjectCache holding the parsed WSDL (suds Definitions object) for the dotMailer API.
+    Entries are stored under a sub-folder named after the pydotmailer and suds versions and the API URL,
+    so an upgrade of either library, or a different endpoint, never loads an incompatible pickle.
+    suds itself keys entries by URL and expires them after the given duration.
+    """
+    def __init__(self, api_url, location=None, seconds=DEFAULT_WSDL_CACHE_SECONDS):
+        """
+        @param api_url the WSDL URL being cached
+        @param location base folder for the cache. Defaults to default_cache_location()
+        @param seconds time to live of a cached definition
+        """
+        self.api_url = api_url
+        self.base_location = location or default_cache_location()
+        url_key = hashlib.sha1(api_url.encode('utf-8')).hexdigest()[:16]
+        versioned_location = os.path.join(self.base_location,
+                                          'pydotmailer-%s-suds-%s' % (__version__, suds.__version__),
+                                          url_key)
+        ObjectCache.__init__(self, location=versioned_location, seconds=seconds)
+
+    def invalidate(self):
+        """ Remove every cached definition for this URL, forcing a fresh download on next construction. """
+        try:
+            self.clear()
+        except OSError:
+            pass  # nothing cached yet
+
+
+def get_shared_client(api_url, cache_location=None, cache_seconds=DEFAULT_WSDL_CACHE_SECONDS, use_cache=True,
+                      transport_factory=None):
+    """
+    Return a suds client for api_url, sharing one parsed service definition across the process.
+    The first call loads the definition (from the on-disk cache if present, otherwise from the network);
+    later calls return a clone of that client. Clones share the WSDL but have their own options and plugins.
+    @param api_url the WSDL URL
+    @param cache_location base folder for the on-disk cache
+    @param cache_seconds time to live of the on-disk copy
+    @param use_cache False to bypass both the in-process and the on-disk cache
+    @param transport_factory callable returning a new suds transport. suds needs a separate transport instance
+        per client. None for the suds default.
+    @return suds Client
+    """
+    transport_factory = transport_factory or HttpAuthenticated
+    if not use_cache:
+        return SOAPClient(api_url, plugins=[DotMailerSudsPlugin()], transport=transport_factory())
+    key = (api_url, cache_location)
+    with _shared_clients_lock:
+        client = _shared_clients.get(key)
+        if client is None:
+            logger.debug("Loading service definition for %s" % api_url)
+            if is_safe_cache_location(cache_location or default_cache_location()):
+                cache = DotMailerWsdlCache(api_url, location=cache_location, seconds=cache_seconds)
+            else:
+                cache = NoCache()  # parse the WSDL every time rather than trust someone else's pickles
+            # cachingpolicy=1 caches the parsed Definitions object rather than the raw XML documents
+            client = SOAPClient(api_url, plugins=[DotMailerSudsPlugin()],  # Plugin makes a tiny XML patch for dotMailer
+                                cache=cache, cachingpolicy=1, transport=transport_factory())
+            _shared_clients[key] = client
+            logger.debug("Loaded service definition for %s" % api_url)
+    return _clone_client(client, transport_factory())
+
+
+def _clone_client(client, transport):
+    """
+    Cheap copy of a suds client sharing its parsed WSDL, equivalent to Client.clone().
+    Client.clone() deep-copies the options, which recurses forever on some suds releases, so build the
+    handful of attributes Client.__init__ sets by hand instead. This never touches the network.
+    """
+    clone = SOAPClient.__new__(SOAPClient)  # skip __init__, which would load the WSDL again
+    clone.options = Options()
+    clone.options.transport = transport
+    clone.set_options(plugins=[DotMailerSudsPlugin()],
+                      cache=client.options.cache, cachingpolicy=client.options.cachingpolicy)
+    clone.wsdl = client.wsdl
+    clone.factory = Factory(client.wsdl)
+    clone.service = ServiceSelector(clone, client.wsdl.services)
+    clone.sd = client.sd
+    clone.messages = dict(tx=None, rx=None)
+    return clone
+
+
+def invalidate_wsdl_cache(api_url=None, cache_location=None):
+    """
+    Explicitly drop cached service definitions, both in-process and on disk.
+    @param api_url only invalidate this URL. None to invalidate every URL in the given location.
+    @param cache_location base folder of the on-disk cache
+    """
+    with _shared_clients_lock:
+        for key in list(_shared_clients.keys()):
+            if (api_url is None or key[0] == api_url) and key[1] == cache_location:
+                del _shared_clients[key]
+    if api_url:
+        DotMailerWsdlCache(api_url, location=cache_location).invalidate()
+    else:
+        shutil.rmtree(cache_location or default_cache_location(), ignore_errors=True)
@@ -7,9 +7,19 @@
 # dotMailer API docs are at http://www.dotmailer.co.uk/api/
 # This class was influenced by earllier work: https://github.com/JeremyJones/dotmailer-client/blob/master/dotmailer.py
 import base64
+import copy
+import csv
+import itertools
+import os
+import socket
+import threading
 import time
-from datetime import datetime, timedelta
-from suds.client import Client as SOAPClient
+from collections import deque
+from datetime import date, datetime
+try:
+    from StringIO import StringIO  # Python 2, where the csv module writes bytes
+except ImportError:
+    from io import StringIO
 __version__ = '0.1.2'
 try:
     import simplejson as json
@@ -17,7 +27,23 @@ except ImportError:
     import json  # fall back to traditional json module.
 import logging
 logger = logging.getLogger(__name__)
-from dotmailersudsplugin import DotMailerSudsPlugin
+# suds and the modules that use it are imported on first use (see PyDotMailer.client), keeping this import cheap.
+
+
+def _clone_suds_object(suds_object):
+    """ @return a copy of suds_object, with copies of the objects and lists in it, sharing its (read only) schema
+    metadata. Much quicker than copy.deepcopy, which copies the schema too. """
+    clone = copy.copy(suds_object)
+    clone.__keylist__ = list(suds_object.__keylist__)
+    for name in suds_object.__keylist__:
+        value = suds_object.__dict__[name]
+        if hasattr(value, '__keylist__'):
+            clone.__dict__[name] = _clone_suds_object(value)
+        elif isinstance(value, list):
+            clone.__dict__[name] = list(value)
+    return clone
+
+
 class PyDotMailer(object):
     version = '0.1'
     class RESULT_FIELDS_ERROR_CODE:
@@ -37,11 +63,33 @@ class PyDotMailer(object):
         TIMEOUT_ERROR = 'Timeout Error' # Timeout from ESP
         ERROR_UNFINISHED = "ERROR_UNFINISHED" # Load had not finished
         ERROR_ESP_LOAD_FAIL = 'ERROR_ESP_LOAD_FAIL' # Data not loaded
+        ERROR_CIRCUIT_OPEN = 'ERROR_CIRCUIT_OPEN'  # not sent, because recent calls to the ESP have been failing
+        ERROR_DATA_FIELDS = 'ERROR_DATA_FIELDS'  # not sent, because the data fields don't match the account's
+    # Errors which will fail every send in a campaign, not just the current contact, so bulk sends stop early.
+    CAMPAIGN_WIDE_ERROR_CODES = (RESULT_FIELDS_ERROR_CODE.ERROR_CAMPAIGN_NOT_FOUND,
+                                 RESULT_FIELDS_ERROR_CODE.ERROR_CAMPAIGN_SENDNOTPERMITTED,
+                                 RESULT_FIELDS_ERROR_CODE.ERROR_CAMPAIGN_APINOTPERMITTED)
+    # Limits on the number of contacts per SendCampaignToContacts call in send_campaign_to_contacts_batched
+    SEND_BATCH_SIZE_MIN = 10
+    SEND_BATCH_SIZE_START = 50
+    SEND_BATCH_SIZE_MAX = 1000
+    SEND_BATCH_TARGET_SECONDS = 5.0  # grow batches while a call takes less than this
+    # add_contacts_to_address_book splits contact files larger than this into several uploads
+    MAX_CONTACTS_UPLOAD_BYTES = 10 * 1024 * 1024
+    # upsert_contacts' starting guesses at how long one AddContactToAddressBook and one
+    # AddContactsToAddressBookWithProgress call take. Each instance then learns from the calls it makes.
+    UPSERT_SINGLE_SECONDS_START = 0.5
+    UPSERT_UPLOAD_SECONDS_START = 1.0
+    UPSERT_DECIDE_MAX = 1000  # most records upsert_contacts reads before settling on single calls
     # Cache the information on the API location on the server
     api_url = ''
 
 
-    def __init__(self, api_username='', api_password='', secure=True):
+    def __init__(self, api_username='', api_password='', secure=True, api_url=None,
+                 use_wsdl_cache=True, wsdl_cache_location=None, wsdl_cache_seconds=None, lazy=False,
+                 connection_pool=None, contact_cache=None, rate_limiter=None, retry_policy=None,
+                 circuit_breaker=None, fast_path=False, data_field_schema=None, compact_results=False,
+                 keep_raw_results=True, metrics=None, profiler=None, contact_fingerprints=None):
         """
         Connect to the dotMailer API at apiconnector.com, using SUDS.
         param string $ap_key Not present, because the dotMailer API doesn't support an API key
@@ -49,27 +97,351 @@ class PyDotMailer(object):
         @param api_password Your dotMailer password
         @param secure Whether or not this should use a secure connection (HTTPS).
                               Always True if the ESP doesn't support an insecure API.
+        @param api_url WSDL URL to use instead of apiconnector.com, e.g. a local stand-in for testing.
+        @param use_wsdl_cache Share one parsed service definition between instances in this process and keep
+                              a copy on disk for new processes. False to download and parse the WSDL every time.
+        @param wsdl_cache_location Folder for the on-disk copy. Defaults to ~/.cache/pydotmailer. It must belong to
+                              the current user and not be writable by others, or isn't used.
+        @param wsdl_cache_seconds How long the on-disk copy is trusted before the WSDL is downloaded again.
+                              Defaults to one day.
+        @param lazy Don't import suds or connect until the first service call needs the client.
+        @param connection_pool Keep-alive connections used for every call. Defaults to a pool shared by all
+                              PyDotMailer instances in the process. Pass a dotmailertransport.DotMailerConnectionPool
+                              to choose the pool size, keep-alive and connect/read timeouts.
+        @param contact_cache dotmailercontactcache.ContactCache to answer get_contact_by_email / get_contact_by_id
+                              from, where possible. None (the default) to always ask dotMailer.
+        @param rate_limiter dotmailerratelimit.AccountRateLimiter which paces calls and backs off when dotMailer
+                              reports ERROR_APIUSAGE_EXCEEDED. Share one per account, e.g. from
+                              get_account_rate_limiter(api_username, rate=10, operation_rates={'GetContactById': 5}).
+                              None (the default) for no limit.
+        @param retry_policy dotmailerretry.RetryPolicy to retry timeouts, connection failures and usage exceeded
+                              faults. None (the default) to return the first failure.
+        @param circuit_breaker dotmailerbreaker.CircuitBreaker which fails calls straight away with ERROR_CIRCUIT_OPEN
+                              while dotMailer is down, e.g. get_circuit_breaker(api_url). None (the default) for none.
+        @param fast_path Send SendCampaignToContact, GetContactByEmail and GetContactById from precompiled templates
+                              (see dotmailerenvelopes) instead of having suds build each request.
+        @param data_field_schema dotmailerdatafields.DataFieldSchema to check d_fields in add_contact_to_address_book
+                              against the account's data fields before calling dotMailer, e.g.
+                              get_data_field_schema(api_username). None (the default) to send them as given.
+        @param compact_results Return each dict_result as a dotmailerresult.DotMailerResult, which reads and updates
+                              like a dict in a fraction of the memory. For holding very many results at once.
+        @param keep_raw_results False to drop the suds objects from results ('result' for contact lookups, 'contact')
+                              and not keep self.last_exception, so results don't keep suds data alive.
+        @param metrics dotmailermetrics.DotMailerMetrics to count every call in: latency, bytes, errors and calls in
+                              flight, per operation. None (the default) for none.
+        @param profiler dotmailerprofiler.DotMailerProfiler to time the phases of every call in (building the request,
+                              the round trip, parsing the reply, ...), to see where the time goes. None (the default)
+                              for none.
+        @param contact_fingerprints dotmailerfingerprints.ContactFingerprints of what each contact is known to hold, so
+                              add_contact_to_address_book skips calls which wouldn't change anything. None (the
+                              default) to always call dotMailer.
         """
+        # Check the credentials before doing anything expensive
+        if (not api_username) or (not api_password):
+            raise Exception('Bad username or password')
         # Remember the HTTPS flag
         self.secure = secure or False  # Cast to a boolean (?)
         # Choose the dotMailer API URL
-        if secure:
+        if api_url:
+            self.api_url = api_url
+        elif secure:
             self.api_url = 'https://apiconnector.com/API.asmx?WSDL'
         else:
             self.api_url = 'http://apiconnector.com/API.asmx?WSDL'
-        # Connect to the API, using SUDS. Log before and after to track the time taken.
-        logger.debug("Connecting to web service")
-        self.client = SOAPClient(self.api_url,
-                                 plugins=[DotMailerSudsPlugin()])  # Plugin makes a tiny XML patch for dotMailer
-        logger.debug("Connected to web service")
-        # Change the logging level to CRITICAL to avoid logging errors for every API call which fails via suds
-        logging.getLogger('suds.client').setLevel(logging.CRITICAL)
+        self.use_wsdl_cache = use_wsdl_cache
+        self.wsdl_cache_location = wsdl_cache_location
+        self.wsdl_cache_seconds = wsdl_cache_seconds
+        self.connection_pool = connection_pool
+        self.contact_cache = contact_cache
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy
+        self.circuit_breaker = circuit_breaker
+        self.fast_path = fast_path
+        self._fast_path_targets = {}  # operation -> (location, SOAPAction, suds Method)
+        self.data_field_schema = data_field_schema
+        self.compact_results = compact_results
+        self.keep_raw_results = keep_raw_results
+        self.metrics = metrics
+        self.profiler = profiler
+        self.contact_fingerprints = contact_fingerprints
         # Remember the username and password. There's no API key to remember with dotMailer
         self.api_username = api_username
         self.api_password = api_password
-        if (not api_username) or (not api_password):
-            raise Exception('Bad username or password')
         self.last_exception = None
+        self.last_send_stats = None  # totals from the last send_campaign_to_contacts
+        self.last_lookup_stats = None  # totals from the last get_contacts_by_emails / get_contacts_by_ids
+        self.last_upsert_stats = None  # totals from the last upsert_contacts
+        # moving averages of call times, used by upsert_contacts to choose between single calls and imports
+        self.upsert_single_seconds = PyDotMailer.UPSERT_SINGLE_SECONDS_START
+        self.upsert_upload_seconds = PyDotMailer.UPSERT_UPLOAD_SECONDS_START
+        self._thread_state = threading.local()  # holds each thread's suds client
+        self._import_tracker = None
+        self._import_tracker_lock = threading.Lock()
+        self._pid = os.getpid()  # to notice being forked, see client
+        if not lazy:
+            self._connect()
+
+
+    # Constructor arguments kept when pickling. The rest (connection pool, cache, rate limiter, circuit breaker,
+    # data field schema, metrics, profiler, contact fingerprints) belong to one process, so an unpickled copy starts
+    # without them.
+    PICKLED_ATTRIBUTES = ('api_username', 'api_password', 'secure', 'api_url', 'use_wsdl_cache', 'wsdl_cache_location',
+                          'wsdl_cache_seconds', 'retry_policy', 'fast_path', 'compact_results', 'keep_raw_results')
+
+
+    def __getstate__(self):
+        """ Pickle as credentials and configuration, e.g. to hand to a multiprocessing worker. The copy connects
+        lazily in its own process, from the shared on-disk copy of the WSDL (see dotmailerwsdlcache). """
+        return dict((name, getattr(self, name)) for name in PyDotMailer.PICKLED_ATTRIBUTES)
+
+
+    def __setstate__(self, state):
+        self.__init__(lazy=True, **state)
+
+
+    @property
+    def client(self):
+        """ The suds client for the calling thread, connected on first use.
+        suds clients aren't safe to share between threads, so each thread gets its own clone of the shared
+        service definition (which is cheap, see dotmailerwsdlcache).
+        """
+        if self._pid != os.getpid():
+            self._after_fork()
+        client = getattr(self._thread_state, 'client', None)
+        if client is None:
+            client = self._connect()
+        return client
+
+
+    def _after_fork(self):
+        """ This is a forked copy: forget the parent's per-thread state and import tracker, which belong to threads
+        that don't exist here. The connection pool notices the fork itself (see DotMailerConnectionPool.request). """
+        logger.debug("Forked from process %s, resetting" % self._pid)
+        self._pid = os.getpid()
+        self._thread_state = threading.local()
+        self._import_tracker = None
+        self._import_tracker_lock = threading.Lock()
+
+
+    def _connect(self):
+        """ Connect to the API, using SUDS. Log before and after to track the time taken.
+        @return the suds client for the calling thread
+        """
+        from .dotmailerwsdlcache import get_shared_client, DEFAULT_WSDL_CACHE_SECONDS
+        from .dotmailertransport import DotMailerPooledTransport, get_default_connection_pool
+        if self.connection_pool is None:
+            self.connection_pool = get_default_connection_pool()
+        connection_pool = self.connection_pool
+        logger.debug("Connecting to web service")
+        # get_shared_client serialises the first load of the WSDL, so concurrent first calls are safe
+        client = get_shared_client(self.api_url, cache_location=self.wsdl_cache_location,
+                                   cache_seconds=self.wsdl_cache_seconds or DEFAULT_WSDL_CACHE_SECONDS,
+                                   use_cache=self.use_wsdl_cache,
+                                   transport_factory=lambda: DotMailerPooledTransport(connection_pool))
+        logger.debug("Connected to web service")
+        # Change the logging level to CRITICAL to avoid logging errors for every API call which fails via suds
+        logging.getLogger('suds.client').setLevel(logging.CRITICAL)
+        if self.profiler is not None:
+            from .dotmailersudsplugin import DotMailerSudsPlugin, DotMailerProfilingPlugin
+            client.set_options(plugins=[DotMailerProfilingPlugin(self.profiler, DotMailerSudsPlugin())])
+        self._thread_state.client = client
+        return client
+
+
+    @property
+    def import_tracker(self):
+        """ dotmailerimports.ImportProgressTracker which waits for this account's contact imports to complete.
+        Created on first use. Call import_tracker.track(progress_id) to wait for imports started elsewhere.
+        """
+        if self._import_tracker is None:
+            from .dotmailerimports import ImportProgressTracker
+            with self._import_tracker_lock:
+                if self._import_tracker is None:
+                    self._import_tracker = ImportProgressTracker(self)
+        return self._import_tracker
+
+
+    def _call_service(self, operation, reply_parser=None, **kwargs):
+        """
+        Make one SOAP call, e.g. self._call_service('GetContactById', username=..., password=..., id=123)
+        Every call to dotMailer goes through here, so the rate limiter, retry policy and circuit breaker see them all.
+        If there's a retry_policy, the number of attempts and time taken are kept for _finish_result.
+        @param reply_parser function(status, reason, body) to read the reply with instead of suds, if the call goes by
+            the fast path. See dotmailerresponses.
+        @return whatever suds (or reply_parser) returns. Exceptions are raised as from suds, for the caller to
+            unpack_exception.
+        """
+        call_service_once = self._call_service_once if self.profiler is None else self._call_service_profiled
+        retry_policy = self.retry_policy
+        if retry_policy is None:
+            return call_service_once(operation, kwargs, reply_parser)
+        started = time.time()
+        attempts = 0
+        try:
+            while True:
+                attempts += 1
+                try:
+                    return call_service_once(operation, kwargs, reply_parser)
+                except Exception as e:
+                    error_code = self.unpack_exception(e).get('error_code')
+                    if attempts >= retry_policy.max_attempts or \
+                            not retry_policy.is_retryable(operation, kwargs, e, error_code):
+                        raise
+                    delay = retry_policy.backoff_seconds(attempts)
+                    if time.time() + delay - started > retry_policy.deadline_seconds:
+                        raise
+                    logger.info("Retrying %s in %.2f seconds after %s" % (operation, delay, error_code))
+                    time.sleep(delay)
+        finally:
+            self._thread_state.last_call = (attempts, time.time() - started)
+
+
+    def _call_service_once(self, operation, kwargs, reply_parser):
+        circuit_breaker = self.circuit_breaker
+        metrics = self.metrics
+        if circuit_breaker is not None:
+            try:
+                circuit_breaker.before_call()  # raises CircuitOpenError if dotMailer looks to be down
+            except Exception as e:
+                if metrics is not None:
+                    metrics.call_rejected(operation, self.unpack_exception(e).get('error_code'))
+                raise
+        rate_limiter = self.rate_limiter
+        if rate_limiter is None and circuit_breaker is None and metrics is None:
+            return self._invoke(operation, kwargs, reply_parser)
+        started = None
+        try:
+            if rate_limiter is not None:
+                rate_limiter.acquire(operation)
+            if metrics is not None:
+                self._take_last_sizes()  # forget any earlier call's, in case this one never reaches the pool
+                metrics.call_started(operation, kwargs)
+            started = time.time()
+            return_code = self._invoke(operation, kwargs, reply_parser)
+        except Exception as e:
+            if rate_limiter is not None and hasattr(e, 'fault') and \
+                    'ERROR_APIUSAGE_EXCEEDED' in (getattr(e.fault, 'faultstring', None) or ''):
+                rate_limiter.on_throttled(operation)
+            if circuit_breaker is not None:
+                from .dotmailerretry import is_transport_error
+                if hasattr(e, 'fault'):
+                    # a SOAP fault is an answer from dotMailer, so the endpoint is up
+                    circuit_breaker.record(False, time.time() - started)
+                elif is_transport_error(e) and not getattr(e, 'never_sent', False) and \
+                        not getattr(getattr(e, 'reason', None), 'never_sent', False):
+                    circuit_breaker.record(True, time.time() - (started or time.time()))
+                else:
+                    # says nothing about dotMailer, e.g. a bug, a rate limiter error or our own pool being full
+                    circuit_breaker.discard()
+            if metrics is not None and started is not None:
+                request_bytes, response_bytes = self._take_last_sizes()
+                metrics.call_finished(operation, time.time() - started, self.unpack_exception(e).get('error_code'),
+                                      request_bytes, response_bytes)
+            raise
+        if rate_limiter is not None:
+            rate_limiter.on_success(operation)
+        if circuit_breaker is not None:
+            circuit_breaker.record(False, time.time() - started)
+        if metrics is not None:
+            request_bytes, response_bytes = self._take_last_sizes()
+            metrics.call_finished(operation, time.time() - started, None, request_bytes, response_bytes)
+        return return_code
+
+
+    def _call_service_profiled(self, operation, kwargs, reply_parser):
+        """ _call_service_once, timing the phases of the call for self.profiler """
+        profiler = self.profiler
+        profiler.start_call(operation)
+        try:
+            return self._call_service_once(operation, kwargs, reply_parser)
+        finally:
+            profiler.end_call()
+
+
+    def _take_last_sizes(self):
+        """ @return (request bytes, response bytes) of this thread's last call through the connection pool, if the
+        pool keeps them (DotMailerConnectionPool does), else (None, None) """
+        take_last_sizes = getattr(self.connection_pool, 'take_last_sizes', None)
+        if take_last_sizes is None:
+            return None, None
+        return take_last_sizes()
+
+
+    def _invoke(self, operation, kwargs, reply_parser=None):
+        """ The SOAP call itself, through suds or, if enabled and possible, the fast path. """
+        client = self.client
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.mark('wait')
+        try:
+            if self.fast_path:
+                from .dotmailerenvelopes import render_envelope, process_reply
+                envelope = render_envelope(operation, kwargs)
+                if envelope is not None:
+                    location, action, method = self._get_fast_path_target(client, operation)
+                    if profiler is not None:
+                        profiler.mark('render')
+                    status, reason, headers, body = self.connection_pool.request(
+                        'POST', location, envelope, {'Content-Type': 'text/xml; charset=utf-8',
+                                                     'SOAPAction': action})
+                    if profiler is not None:
+                        profiler.mark('network')
+                    if reply_parser is not None:
+                        return reply_parser(status, reason, body)
+                    return process_reply(method, status, reason, body)
+            return getattr(client.service, operation)(**kwargs)
+        finally:
+            if profiler is not None:
+                profiler.mark()  # the phase the call finished (or failed) in: 'unmarshal' if suds got that far
+
+
+    def _get_fast_path_target(self, client, operation):
+        """ @return (location, SOAPAction, suds Method) for operation, from the service definition """
+        target = self._fast_path_targets.get(operation)
+        if target is None:
+            method = client.wsdl.services[0].ports[0].methods[operation]
+            target = (client.options.location or method.location, method.soap.action, method)
+            self._fast_path_targets[operation] = target
+        return target
+
+
+    def _finish_result(self, dict_result):
+        """ Single exit point for the dict_result of a SOAP call: adds details of the call that options ask for.
+        With a retry_policy that's 'attempts' and 'elapsed_seconds' (including backoff).
+        """
+        last_call = getattr(self._thread_state, 'last_call', None)
+        if last_call is not None:
+            self._thread_state.last_call = None
+            dict_result['attempts'], dict_result['elapsed_seconds'] = last_call
+        if self.profiler is not None:
+            self.profiler.finish_result()
+        return self.make_result(dict_result)
+
+
+    def make_result(self, dict_result):
+        """
+        Put a dict_result made outside this class (e.g. by dotmailerprocesses, from another process's result) in the
+        form this PyDotMailer's methods return.
+        @param dict_result e.g. {'ok': False, 'errors': [...], 'error_code': ...}
+        @return dict_result in the form the compact_results and keep_raw_results options ask for
+        """
+        if self.keep_raw_results and not self.compact_results:
+            return dict_result
+        from .dotmailerresult import DotMailerResult, drop_raw
+        if not self.keep_raw_results:
+            drop_raw(dict_result)
+        if self.compact_results:
+            dict_result = DotMailerResult(dict_result)
+        return dict_result
+
+
+    def invalidate_wsdl_cache(self):
+        """
+        Drop the cached service definition for this API URL, in-process and on disk, e.g. after dotMailer
+        changes the WSDL. Existing instances keep working; the next PyDotMailer constructed reloads the WSDL.
+        """
+        from .dotmailerwsdlcache import invalidate_wsdl_cache
+        invalidate_wsdl_cache(self.api_url, cache_location=self.wsdl_cache_location)
 
 
     def unpack_exception(self, e):
@@ -81,13 +453,20 @@ class PyDotMailer(object):
                                    'errors':[e.message],
                                    'error_code':PyDotMailer.ERRORS.ERROR_CAMPAIGN_NOT_FOUND }
         """
-        self.last_exception = e  # in case caller cares
+        if self.keep_raw_results:
+            self.last_exception = e  # in case caller cares
         fault_string = ''
         # http://stackoverflow.com/questions/610883/how-to-know-if-an-object-has-an-attribute-in-python
         if e and hasattr(e, 'fault') and hasattr(e.fault, 'faultstring'):
             fault_string = e.fault.faultstring
+        from .dotmailerbreaker import CircuitOpenError
         # todo clearly a more generic way of doing this would be good.
-        if 'ERROR_CAMPAIGN_NOT_FOUND' in fault_string:
+        if isinstance(e, CircuitOpenError):
+            error_code = PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_CIRCUIT_OPEN
+        elif isinstance(e, socket.timeout) or isinstance(getattr(e, 'reason', None), socket.timeout):
+            # raised by the transport when connecting or waiting for a reply takes too long
+            error_code = PyDotMailer.RESULT_FIELDS_ERROR_CODE.TIMEOUT_ERROR
+        elif 'ERROR_CAMPAIGN_NOT_FOUND' in fault_string:
             error_code = PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_CAMPAIGN_NOT_FOUND
         elif 'ERROR_CAMPAIGN_SENDNOTPERMITTED' in fault_string:
             error_code = PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_CAMPAIGN_SENDNOTPERMITTED
@@ -100,47 +479,201 @@ class PyDotMailer(object):
             error_code = PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_CONTACT_UNSUBSCRIBED
         else:
             error_code = PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_OTHER
-        dict_result = {'ok': False, 'errors': [e.message], 'error_code': error_code}
+        # Python 3 exceptions have no .message
+        error_message = getattr(e, 'message', None) or '%s' % (e,)
+        dict_result = {'ok': False, 'errors': [error_message], 'error_code': error_code}
         return dict_result
 
 
-    def add_contacts_to_address_book(self, address_book_id, s_contacts, wait_to_complete_seconds=False):
+    def add_contacts_to_address_book(self, address_book_id, s_contacts=None, wait_to_complete_seconds=False,
+                                     contacts_path=None, max_upload_bytes=None):
         """
         Add a list of contacts to the address book
+        The contacts are read a record at a time with the csv module and, if there's more than max_upload_bytes of
+        them, split into several AddContactsToAddressBookWithProgress uploads, each starting with the header line.
+        So memory use is bounded by max_upload_bytes however big the file is, and quoted values (even ones holding
+        newlines) are never split. Each upload is written back out with the csv module.
+        If waiting, all uploads are made first and then waited for together by self.import_tracker.
         @param address_book_id the id of the address book
-        @param s_contacts containing the contacts to be added. You may upload either a .csv or .xls file.
+        @param s_contacts containing the contacts to be added, as CSV. One of:
+            a string (as before), a file object opened for reading, or an iterable of rows, where each row is either
+            a line of CSV or a list/tuple of values.
             It must contain one column with the heading "Email".
             Other columns must will attempt to map to your custom data fields.
         @param wait_to_complete_seconds seconds to wait.
-        @return dict  e.g. {'progress_id': 15edf1c4-ce5f-42e3-b182-3b20c880bcf8, 'ok': True, 'result': Finished}
+        @param contacts_path read the CSV from this file instead of s_contacts. ValueError if neither is given.
+        @param max_upload_bytes largest CSV upload to send in one call. Defaults to MAX_CONTACTS_UPLOAD_BYTES.
+        @return dict  e.g. {'progress_id': 15edf1c4-ce5f-42e3-b182-3b20c880bcf8, 'ok': True, 'result': Finished,
+                            'progress_ids': [15edf1c4-ce5f-42e3-b182-3b20c880bcf8]}
+            If the contacts were split, 'progress_ids' lists every upload, 'uploads' holds the dict_result of each,
+            and the other members describe the first failed upload, if any. Uploads stop at the first failure.
         http://www.dotmailer.co.uk/api/address_books/add_contacts_to_address_book_with_progress.aspx
         """
+        if s_contacts is None and not contacts_path:
+            raise ValueError('add_contacts_to_address_book needs s_contacts or contacts_path')
+        max_upload_bytes = max_upload_bytes or PyDotMailer.MAX_CONTACTS_UPLOAD_BYTES
+        upload_results = []
+        contacts_file = None
+        try:
+            if contacts_path:
+                contacts_file = open(contacts_path, 'rb')
+                s_contacts = contacts_file
+            for csv_data in self._split_contacts_csv(s_contacts, max_upload_bytes):
+                upload_bytes = len(csv_data)
+                if self.contact_cache is not None:
+                    self._invalidate_cached_contacts(csv_data)
+                dict_result = self._upload_contacts_csv(address_book_id, csv_data)
+                if dict_result.get('ok') and wait_to_complete_seconds:
+                    # imports run in parallel at dotMailer while we upload the rest
+                    dict_result['future'] = self.import_tracker.track(dict_result.get('progress_id'),
+                                                                      upload_bytes=upload_bytes,
+                                                                      timeout_seconds=wait_to_complete_seconds)
+                upload_results.append(dict_result)
+                if not dict_result.get('ok'):
+                    break
+        finally:
+            if contacts_file:
+                contacts_file.close()
+        for index, upload_result in enumerate(upload_results):
+            future = upload_result.pop('future', None)
+            if future is not None:
+                # E.g: {'error_code': 'ERROR_UNFINISHED', 'ok': False, 'result': NotFinished}
+                return_code = future.result()
+                upload_results[index] = dict(return_code, progress_id=upload_result.get('progress_id'))
+        return self.combine_upload_results(upload_results, wait_to_complete_seconds)
+
+
+    def combine_upload_results(self, upload_results, waited):
+        """
+        Combine the results of the uploads add_contacts_to_address_book split its contacts into, e.g. after waiting
+        for their imports elsewhere, as AsyncPyDotMailer does.
+        @param upload_results the dict_result of each upload, or of its import if waited (each with its progress_id)
+        @param waited True if upload_results are of the finished imports
+        @return add_contacts_to_address_book's dict_result for them all
+        """
+        if len(upload_results) == 1:
+            dict_result = upload_results[0]
+        else:
+            failed_results = [upload_result for upload_result in upload_results if not upload_result.get('ok')]
+            if failed_results:
+                dict_result = dict(failed_results[0])
+            else:
+                dict_result = {'ok': True}
+                if waited:
+                    dict_result['result'] = 'Finished'
+            dict_result['uploads'] = upload_results
+        dict_result['progress_ids'] = [upload_result.get('progress_id') for upload_result in upload_results
+                                       if upload_result.get('progress_id')]
+        return dict_result
+
+
+    def _upload_contacts_csv(self, address_book_id, csv_data):
+        """
+        One AddContactsToAddressBookWithProgress call.
+        @param csv_data bytes
+        @return dict_result e.g. {'ok': True, 'progress_id': 15edf1c4-ce5f-42e3-b182-3b20c880bcf8}
+        """
         dict_result = {'ok': True}
-        return_code = None
-        base64_data = base64.b64encode(s_contacts)
+        base64_data = base64.b64encode(csv_data).decode('ascii')
         try:
-            progress_id = self.client.service.AddContactsToAddressBookWithProgress(username=self.api_username,
-                                                                                   password=self.api_password,
-                                                                                   addressbookID=address_book_id,
-                                                                                   data=base64_data,
-                                                                                   dataType='CSV')
-            dict_result = {'ok': True}
-            if wait_to_complete_seconds:
-                # retry loop...
-                dt_wait_until = datetime.utcnow() + timedelta(seconds=wait_to_complete_seconds)  # wait for max
-                sleep_time = 0.2  # start with short sleep between retries
-                while (not return_code or return_code.get('result') == 'NotFinished') and \
-                        datetime.utcnow() < dt_wait_until:
-                    time.sleep(sleep_time)
-                    return_code = self.get_contact_import_progress(progress_id) # E.g: {'error_code': 'ERROR_UNFINISHED', 'ok': False, 'result': NotFinished}
-                    # gradually backoff with longer sleep intervals up to a max of 5 seconds
-                    sleep_time = min(sleep_time * 2, 5.0)
-                if return_code:
-                    dict_result = return_code
-            dict_result.update({'progress_id': progress_id})
+            progress_id = self._call_service('AddContactsToAddressBookWithProgress', username=self.api_username,
+                                                                                     password=self.api_password,
+                                                                                     addressbookID=address_book_id,
+                                                                                     data=base64_data,
+                                                                                     dataType='CSV')
+            dict_result = {'ok': True, 'progress_id': progress_id}
         except Exception as e:
             dict_result = self.unpack_exception(e)
-        return dict_result
+        return self._finish_result(dict_result)
+
+
+    def _invalidate_cached_contacts(self, csv_data):
+        """ drop every contact in an upload from self.contact_cache, since the import may change them """
+        if not isinstance(csv_data, str):
+            csv_data = csv_data.decode('utf-8', 'replace')  # Python 3's csv module reads text
+        rows = csv.reader(self._iter_string_lines(csv_data))
+        header = [name.strip().lower() for name in next(rows, [])]
+        if 'email' not in header:
+            return
+        email_index = header.index('email')
+        for row in rows:
+            if len(row) > email_index:
+                self.contact_cache.invalidate(email=row[email_index])
+
+
+    def _split_contacts_csv(self, s_contacts, max_upload_bytes):
+        """
+        Split CSV contacts into pieces of at most max_upload_bytes (unless a single record is longer), each
+        starting with the header line. Pieces are split between records, not lines, so a quoted value containing a
+        newline stays whole.
+        @param s_contacts string, file object, or iterable of lines / lists of values. See add_contacts_to_address_book
+        @return generator of bytes
+        """
+        header = None
+        lines = []
+        size = 0
+        for row in self._iter_csv_rows(s_contacts):
+            line = self._csv_line(row)
+            if header is None:
+                header = line
+                continue
+            if lines and size + len(line) > max_upload_bytes:
+                yield b''.join(lines)
+                lines = []
+            if not lines:
+                lines.append(header)
+                size = len(header)
+            lines.append(line)
+            size += len(line)
+        if lines:
+            yield b''.join(lines)
+        elif header is not None:
+            yield header  # just a header, no contacts. Send it anyway, as before.
+
+
+    def _iter_csv_rows(self, s_contacts):
+        """
+        @return generator of the records in s_contacts, each a list of values. They're read with the csv module, so
+            a quoted value may hold commas, quotes and newlines. Blank lines between records are skipped.
+        """
+        if isinstance(s_contacts, (bytes, type(u''))):
+            s_contacts = self._iter_string_lines(s_contacts)
+        for row in csv.reader(self._iter_native_lines(s_contacts)):
+            if row:
+                yield row
+
+
+    def _iter_native_lines(self, s_contacts):
+        """ lines of s_contacts as the csv module reads them: text on Python 3, bytes on Python 2. Rows given as
+        lists of values are written as CSV first. """
+        for line in s_contacts:
+            if isinstance(line, (list, tuple)):
+                line = self._csv_line(line)
+            if not isinstance(line, str):
+                line = line.decode('utf-8') if isinstance(line, bytes) else line.encode('utf-8')
+            yield line
+
+
+    def _csv_line(self, values):
+        """ @return values as one record of CSV, bytes ending with a newline, quoted wherever the csv module needs """
+        if str is bytes:  # Python 2's csv module writes bytes
+            values = [value.encode('utf-8') if isinstance(value, type(u'')) else value for value in values]
+        output = StringIO()
+        csv.writer(output, lineterminator='\n').writerow(values)
+        line = output.getvalue()
+        return line if isinstance(line, bytes) else line.encode('utf-8')
+
+
+    def _iter_string_lines(self, s_data):
+        """ lines of s_data, without first making a list of all of them as splitlines() would """
+        newline = b'\n' if isinstance(s_data, bytes) else u'\n'
+        start = 0
+        while start < len(s_data):
+            end = s_data.find(newline, start)
+            if end == -1:
+                end = len(s_data) - 1
+            yield s_data[start:end + 1]
+            start = end + 1
 
 
     def add_contact_to_address_book(self, address_book_id, email_address, d_fields, email_type="Html",
@@ -154,9 +687,25 @@ class PyDotMailer(object):
             columns must map to standard fields in DM or will attempt to map to your custom data fields in DM.
         @param email_type = "Html" - the new contact will be set to receive this format by default.
         @return dict e.g. {'contact_id': 123532543, 'ok': True, 'contact': APIContact object }
+            or, if contact_fingerprints show the contact already holds d_fields, {'contact_id': 123532543, 'ok': True,
+            'skipped': True} without calling dotMailer
         """
         # Initialise the result dictionary
         dict_result = {'ok': False}
+        data_fields = [(field_name, d_fields.get(field_name)) for field_name in d_fields
+                       if field_name != 'email' and d_fields.get(field_name)]
+        if self.data_field_schema is not None:
+            data_fields, errors = self.data_field_schema.normalise(data_fields, self.list_contact_data_labels)
+            if errors:
+                return self.make_result({'ok': False, 'errors': errors,
+                                          'error_code': PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_DATA_FIELDS})
+        contact_fingerprints = self.contact_fingerprints
+        options = (email_type, audience_type, opt_in_type)
+        if contact_fingerprints is not None:
+            contact_id = contact_fingerprints.unchanged(address_book_id, email_address, data_fields, options)
+            contact_fingerprints.count(contact_id is not None)
+            if contact_id is not None:
+                return self.make_result({'ok': True, 'contact_id': contact_id, 'skipped': True})
         # Create an APIContact object with the details of the record to load. For example:
         # APIContact: (APIContact){
         #   ID = None, Email = None,
@@ -166,14 +715,12 @@ class PyDotMailer(object):
         #   OptInType = (ContactOptInTypes){ value = None }
         #   EmailType = (ContactEmailTypes){ value = None }
         #   Notes = None }
-        contact = self.client.factory.create('APIContact')
-        del contact.ID
+        contact = self._new_contact()
         contact.Email = email_address
         # Copy field data into the call
-        for field_name in d_fields:
-            if field_name != 'email' and d_fields.get(field_name):
-                contact.DataFields.Keys[0].append(field_name)
-                contact.DataFields.Values[0].append(d_fields.get(field_name))
+        for field_name, value in data_fields:
+            contact.DataFields.Keys[0].append(field_name)
+            contact.DataFields.Values[0].append(value)
         # remove some empty values that will upset suds/dotMailer
         ####del contact.AudienceType
         ####del contact.OptInType
@@ -182,10 +729,10 @@ class PyDotMailer(object):
         contact.EmailType = email_type
         #### logging.getLogger('suds.client').setLevel(logging.DEBUG)
         try:
-            created_contact = self.client.service.AddContactToAddressBook(username=self.api_username,
-                                                                          password=self.api_password,
-                                                                          contact=contact,
-                                                                          addressbookId=address_book_id)
+            created_contact = self._call_service('AddContactToAddressBook', username=self.api_username,
+                                                                            password=self.api_password,
+                                                                            contact=contact,
+                                                                            addressbookId=address_book_id)
             # Example dict_result contents:
             # { 'contact': (APIContact){ ID = 417373614, Email = "test.mailings+unit_tests@triggeredmessaging.com",
             #   AudienceType = "Unknown",
@@ -197,7 +744,281 @@ class PyDotMailer(object):
             dict_result = ({'ok': True, 'contact_id': created_contact.ID, 'contact': created_contact})
         except Exception as e:
             dict_result = self.unpack_exception(e)
-        return dict_result
+        if self.contact_cache is not None:
+            # even a failed call may have changed the contact
+            self.contact_cache.invalidate(email=email_address, contact_id=dict_result.get('contact_id'))
+        if contact_fingerprints is not None:
+            if dict_result.get('ok'):
+                contact_fingerprints.remember(address_book_id, email_address, dict_result.get('contact_id'),
+                                              data_fields, options)
+            else:
+                contact_fingerprints.forget(address_book_id, email_address)
+        return self._finish_result(dict_result)
+
+
+    def _new_contact(self):
+        """
+        @return an empty APIContact, without an ID.
+        Creating one with the suds factory resolves the type from the WSDL every time, so that's done once per thread
+        and the result cloned.
+        """
+        template = getattr(self._thread_state, 'contact_template', None)
+        if template is None:
+            template = self.client.factory.create('APIContact')
+            del template.ID
+            self._thread_state.contact_template = template
+        return _clone_suds_object(template)
+
+
+    def upsert_contacts(self, address_book_id, contacts, max_workers=10, wait_to_complete_seconds=600, route=None,
+                        max_upload_bytes=None):
+        """
+        Add or update many contacts in an address book, by whichever is expected to finish sooner: one
+        AddContactToAddressBook call per contact, max_workers at a time, or CSV imports.
+        Records are read until they run out, and so are sent one at a time, or until importing those read so far is
+        expected to be quicker than single calls, and so everything is imported. The expected times come from the
+        calls this instance has made (self.upsert_single_seconds, self.upsert_upload_seconds) and how long past
+        imports took (self.import_tracker). After UPSERT_DECIDE_MAX records without imports winning, the rest are
+        sent one at a time too.
+        Imports are written with the csv module, so values are quoted as they need to be, with the Email column first.
+        Records with the same field names share an upload, whose header lists exactly those fields, so a field one
+        record doesn't have is never sent as a blank which would overwrite it. data_field_schema and
+        contact_fingerprints apply to imported records as they do to add_contact_to_address_book.
+        This is a generator. Records sent one at a time yield add_contact_to_address_book's result as each completes.
+        Imported records yield their import's result once it's finished, e.g.
+            {'ok': True, 'result': 'Finished', 'progress_id': 15edf1c4-ce5f-42e3-b182-3b20c880bcf8, 'imported': True}
+        dotMailer doesn't report on the rows of an import, so a row it rejected still gets its import's result.
+        If an upload fails, nothing more is uploaded; records not yet uploaded are yielded with 'attempted': False.
+        Once the generator is exhausted, self.last_upsert_stats holds the totals, e.g.
+            {'route': 'bulk', 'contacts': 5000, 'ok': 4998, 'failed': 2, 'skipped': 0, 'not_attempted': 0,
+             'single_calls': 0, 'uploads': 1, 'seconds': 8.3, 'per_second': 602.4}
+        @param address_book_id the id of the address book
+        @param contacts iterable of dicts, each with an 'email' and the data fields to set, e.g.
+            {'email': 'mike@example.com', 'firstname': 'mike'}. Fields which are None or '' are left as they are.
+            It's consumed lazily, so it may be a generator.
+        @param max_workers number of concurrent single calls
+        @param wait_to_complete_seconds how long to wait for each import to finish. False not to wait: imported
+            records are yielded as soon as they're uploaded, and the choice of route ignores import times.
+        @param route 'single' or 'bulk' to choose instead of estimating
+        @param max_upload_bytes largest CSV upload. Defaults to MAX_CONTACTS_UPLOAD_BYTES.
+        @return generator of (email, dict_result)
+        """
+        stats = {'route': route, 'contacts': 0, 'ok': 0, 'failed': 0, 'skipped': 0, 'not_attempted': 0,
+                 'single_calls': 0, 'uploads': 0, 'seconds': 0.0, 'per_second': 0.0}
+        self.last_upsert_stats = stats
+        started = time.time()
+        contacts = iter(contacts)
+        read = []  # records read while choosing the route
+        if route is None:
+            route = 'single'
+            csv_bytes = 0
+            for record in contacts:
+                read.append(record)
+                csv_bytes += sum(len(u'%s' % value) + 1 for value in record.values())
+                if self._upsert_bulk_is_quicker(len(read), csv_bytes, max_workers, wait_to_complete_seconds):
+                    route = 'bulk'
+                    break
+                if len(read) >= PyDotMailer.UPSERT_DECIDE_MAX:
+                    break
+            stats['route'] = route
+        records = itertools.chain(read, contacts)
+        if route == 'bulk':
+            results = self._upsert_bulk(address_book_id, records, wait_to_complete_seconds, max_upload_bytes, stats)
+        else:
+            results = self._upsert_single(address_book_id, records, max_workers, stats)
+        try:
+            for email, dict_result in results:
+                stats['contacts'] += 1
+                if dict_result.get('ok'):
+                    stats['ok'] += 1
+                    if dict_result.get('skipped'):
+                        stats['skipped'] += 1
+                elif dict_result.get('attempted') is False:
+                    stats['not_attempted'] += 1
+                else:
+                    stats['failed'] += 1
+                yield email, dict_result
+        finally:
+            results.close()
+            stats['seconds'] = time.time() - started
+            if stats['seconds']:
+                stats['per_second'] = stats['contacts'] / stats['seconds']
+            logger.info("upsert_contacts address book %s: %s" % (address_book_id, stats))
+
+
+    def _upsert_bulk_is_quicker(self, count, csv_bytes, max_workers, wait_to_complete_seconds):
+        """ @return whether importing count records, about csv_bytes of CSV, is expected to beat single calls """
+        single_seconds = -(-count // max_workers) * self.upsert_single_seconds
+        bulk_seconds = self.upsert_upload_seconds
+        if wait_to_complete_seconds:
+            import_tracker = self.import_tracker
+            bulk_seconds += import_tracker.seconds_overhead + csv_bytes * import_tracker.seconds_per_byte
+        return bulk_seconds < single_seconds
+
+
+    def _upsert_single(self, address_book_id, records, max_workers, stats):
+        """ upsert_contacts' route of one add_contact_to_address_book call per record """
+        def add(record):
+            if not record.get('email'):
+                return self.make_result({'ok': False, 'errors': ['No email address'],
+                                          'error_code': PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_CONTACT_NOT_FOUND})
+            call_started = time.time()
+            dict_result = self.add_contact_to_address_book(address_book_id, record['email'], record)
+            if not dict_result.get('skipped') and \
+                    dict_result.get('error_code') != PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_CIRCUIT_OPEN:
+                self.upsert_single_seconds = 0.8 * self.upsert_single_seconds + 0.2 * (time.time() - call_started)
+            return dict_result
+
+        for record, dict_result in self.fan_out(add, records, max_workers):
+            if record.get('email') and not dict_result.get('skipped'):
+                stats['single_calls'] += 1
+            yield record.get('email'), dict_result
+
+
+    def _upsert_bulk(self, address_book_id, records, wait_to_complete_seconds, max_upload_bytes, stats):
+        """
+        upsert_contacts' route of CSV imports. Each set of field names has an upload being filled, which is sent
+        when it reaches max_upload_bytes. If all of them together reach it, the largest is sent, so no more than
+        about twice max_upload_bytes of CSV is held at once.
+        Uploaded records are yielded as their imports finish, in the order of the uploads.
+        """
+        max_upload_bytes = max_upload_bytes or PyDotMailer.MAX_CONTACTS_UPLOAD_BYTES
+        options = ('Html', 'Unknown', 'Unknown')  # what add_contact_to_address_book sends by default
+        uploads = {}  # tuple of field names -> {'lines': [...], 'emails': [...], 'bytes': n} being filled
+        buffered_bytes = 0
+        sent = deque()  # (emails, dict_result, future) of each upload made, in order
+        failed = None  # the first upload which failed
+        for record in records:
+            email = record.get('email')
+            if not email:
+                yield email, self.make_result({
+                    'ok': False, 'errors': ['No email address'],
+                    'error_code': PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_CONTACT_NOT_FOUND})
+                continue
+            data_fields = sorted((field_name, record.get(field_name)) for field_name in record
+                                 if field_name != 'email' and record.get(field_name))
+            if self.data_field_schema is not None:
+                data_fields, errors = self.data_field_schema.normalise(data_fields, self.list_contact_data_labels)
+                if errors:
+                    yield email, self.make_result({
+                        'ok': False, 'errors': errors,
+                        'error_code': PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_DATA_FIELDS})
+                    continue
+            if self.contact_fingerprints is not None:
+                contact_id = self.contact_fingerprints.unchanged(address_book_id, email, data_fields, options)
+                self.contact_fingerprints.count(contact_id is not None)
+                if contact_id is not None:
+                    yield email, self.make_result({'ok': True, 'contact_id': contact_id, 'skipped': True})
+                    continue
+                self.contact_fingerprints.forget(address_book_id, email)  # dotMailer won't say if the row failed
+            field_names = tuple(field_name for field_name, value in data_fields)
+            line = self._csv_line([email] + [self._csv_value(value) for field_name, value in data_fields])
+            upload = uploads.get(field_names)
+            full = upload is not None and upload['bytes'] + len(line) > max_upload_bytes
+            if full:
+                buffered_bytes -= upload['bytes']
+                sent.append(self._send_upsert_upload(address_book_id, field_names, uploads.pop(field_names),
+                                                     wait_to_complete_seconds, stats))
+                upload = None
+            if upload is None:
+                upload = uploads[field_names] = {'lines': [], 'emails': [], 'bytes': 0}
+            upload['lines'].append(line)
+            upload['emails'].append(email)
+            upload['bytes'] += len(line)
+            buffered_bytes += len(line)
+            if not full and buffered_bytes > max_upload_bytes:
+                field_names = max(uploads, key=lambda field_names: uploads[field_names]['bytes'])
+                buffered_bytes -= uploads[field_names]['bytes']
+                sent.append(self._send_upsert_upload(address_book_id, field_names, uploads.pop(field_names),
+                                                     wait_to_complete_seconds, stats))
+            if sent and not sent[-1][1].get('ok'):
+                failed = sent.pop()
+                break
+            while sent and (sent[0][2] is None or sent[0][2].done()):
+                for email, dict_result in self._upsert_upload_results(*sent.popleft()):
+                    yield email, dict_result
+        while failed is None and uploads:
+            field_names = next(iter(uploads))
+            sent.append(self._send_upsert_upload(address_book_id, field_names, uploads.pop(field_names),
+                                                 wait_to_complete_seconds, stats))
+            if not sent[-1][1].get('ok'):
+                failed = sent.pop()
+        while sent:
+            for email, dict_result in self._upsert_upload_results(*sent.popleft()):
+                yield email, dict_result
+        if failed is not None:
+            emails, dict_result, future = failed
+            for email in emails:
+                yield email, self.make_result(dict(dict_result))
+            error_code = dict_result.get('error_code')
+            logger.warning("Stopped importing contacts to address book %s: %s" % (address_book_id, error_code))
+            not_attempted = lambda: self.make_result({
+                'ok': False, 'attempted': False, 'error_code': error_code,
+                'errors': ['Not imported because an earlier upload failed with %s' % error_code]})
+            for upload in uploads.values():
+                for email in upload['emails']:
+                    yield email, not_attempted()
+            for record in records:
+                yield record.get('email'), not_attempted()
+
+
+    def _send_upsert_upload(self, address_book_id, field_names, upload, wait_to_complete_seconds, stats):
+        """
+        Upload one of _upsert_bulk's CSV files, and start tracking its import if waiting.
+        @return (emails, dict_result, future), future None if not waiting or the upload failed
+        """
+        csv_data = self._csv_line(['Email'] + list(field_names)) + b''.join(upload['lines'])
+        upload['lines'] = None
+        if self.contact_cache is not None:
+            self._invalidate_cached_contacts(csv_data)
+        stats['uploads'] += 1
+        call_started = time.time()
+        dict_result = self._upload_contacts_csv(address_book_id, csv_data)
+        if dict_result.get('error_code') != PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_CIRCUIT_OPEN:
+            self.upsert_upload_seconds = 0.8 * self.upsert_upload_seconds + 0.2 * (time.time() - call_started)
+        future = None
+        if dict_result.get('ok') and wait_to_complete_seconds:
+            future = self.import_tracker.track(dict_result.get('progress_id'), upload_bytes=len(csv_data),
+                                               timeout_seconds=wait_to_complete_seconds)
+        return upload['emails'], dict_result, future
+
+
+    def _upsert_upload_results(self, emails, dict_result, future):
+        """ @return generator of (email, dict_result) for each record in an upload, once its import is done """
+        if future is not None:
+            dict_result = dict(future.result(), progress_id=dict_result.get('progress_id'))
+        for email in emails:
+            yield email, self.make_result(dict(dict_result, imported=True))
+
+
+    def _csv_value(self, value):
+        """ @return a data field value as text for a CSV import, written as AddContactToAddressBook would send it """
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        if isinstance(value, datetime):
+            return self.dt_to_iso_date(value)
+        if isinstance(value, date):
+            return value.isoformat()
+        return value
+
+
+    def list_contact_data_labels(self):
+        """
+        @return dict e.g. {'ok': True, 'data_labels': [{'name': 'FIRSTNAME', 'type': 'String',
+                                                         'default_value': None}, ...]}
+        http://www.dotmailer.co.uk/api/contacts/list_contact_data_labels.aspx
+        """
+        dict_result = {'ok': True}
+        try:
+            return_code = self._call_service('ListContactDataLabels', username=self.api_username,
+                                                                      password=self.api_password)
+            labels = getattr(return_code, 'ContactDataLabel', None) or []
+            dict_result = {'ok': True, 'data_labels': [{'name': label.Name, 'type': label.Type,
+                                                        'default_value': getattr(label, 'DefaultValue', None)}
+                                                       for label in labels]}
+        except Exception as e:
+            dict_result = self.unpack_exception(e)
+        return self._finish_result(dict_result)
 
 
     def get_contact_import_progress(self, progress_id):
@@ -208,9 +1029,9 @@ class PyDotMailer(object):
         """
         dict_result = {'ok': True}
         try:
-            return_code = self.client.service.GetContactImportProgress(username=self.api_username,
-                                                                       password=self.api_password,
-                                                                       progressID=progress_id)
+            return_code = self._call_service('GetContactImportProgress', username=self.api_username,
+                                                                         password=self.api_password,
+                                                                         progressID=progress_id)
             if return_code == 'Finished':
                 dict_result = {'ok': True, 'result': return_code, 'errors': [' Load OK. See report at https://r1-app.dotmailer.com/Contacts/Import/WatchdogReport.aspx?g=%s ' % progress_id] }
             elif return_code == 'RejectedByWatchdog':
@@ -224,7 +1045,7 @@ class PyDotMailer(object):
                                'errors': [' Load Unfinished. See report at https://r1-app.dotmailer.com/Contacts/Import/WatchdogReport.aspx?g=%s ' % progress_id]}
         except Exception as e:
             dict_result = self.unpack_exception(e)
-        return dict_result # E.g: {'ok': True, 'result': Finished, 'errors': [u'<a href="https://r1-app.dotmailer.com/Contacts/Import/WatchdogReport.aspx?g=d82602bb-adfb-4e2d-aabc-5fb77af2ae3d">Load OK Report</a>']}
+        return self._finish_result(dict_result) # E.g: {'ok': True, 'result': Finished, 'errors': [u'<a href="https://r1-app.dotmailer.com/Contacts/Import/WatchdogReport.aspx?g=d82602bb-adfb-4e2d-aabc-5fb77af2ae3d">Load OK Report</a>']}
 
 
     def send_campaign_to_contact(self, campaign_id, contact_id, send_date=None):
@@ -244,23 +1065,228 @@ class PyDotMailer(object):
         iso_send_date = self.dt_to_iso_date(send_date)
         return_code = None
         try:
-            return_code = self.client.service.SendCampaignToContact(username=self.api_username,
-                                                                    password=self.api_password,
-                                                                    campaignId=campaign_id,
-                                                                    contactid=contact_id,
-                                                                    sendDate=iso_send_date)  # note inconsistent case
-                                                                                             # in DM API
+            return_code = self._call_service('SendCampaignToContact', username=self.api_username,
+                                                                      password=self.api_password,
+                                                                      campaignId=campaign_id,
+                                                                      contactid=contact_id,
+                                                                      sendDate=iso_send_date)  # note inconsistent case
+                                                                                               # in DM API
             if return_code:
                 # return code, which means an error
                 dict_result = {'ok': False, 'result': return_code}
         except Exception as e:
             dict_result = self.unpack_exception(e)
-        return dict_result
+        return self._finish_result(dict_result)
+
+
+    def send_campaign_to_contacts(self, campaign_id, contact_ids, send_date=None, max_workers=10):
+        """
+        Send a campaign to many contacts, making up to max_workers SendCampaignToContact calls at once.
+        This is a generator: results are yielded as each send completes, not in the order of contact_ids.
+        If a send fails with an error that will affect every contact (see CAMPAIGN_WIDE_ERROR_CODES), no more sends
+        are started; contacts which were never attempted are yielded with that error code and 'attempted': False.
+        Once the generator is exhausted, self.last_send_stats holds the totals and throughput, e.g.
+            {'sent': 998, 'failed': 2, 'not_attempted': 0, 'seconds': 12.1, 'per_second': 82.6, 'stopped_by': None}
+        @param campaign_id
+        @param contact_ids iterable of contact ids. It's consumed lazily, so it may be a generator.
+        @param send_date date/time in server time when the campaign should be sent. Same for every contact.
+        @param max_workers number of concurrent SOAP calls
+        @return generator of (contact_id, dict_result), dict_result as from send_campaign_to_contact
+        """
+        if not send_date:
+            send_date = datetime.utcnow()  # one timestamp for the whole send
+        stats = {'sent': 0, 'failed': 0, 'not_attempted': 0, 'seconds': 0.0, 'per_second': 0.0, 'stopped_by': None}
+        self.last_send_stats = stats
+        started = time.time()
+        contact_ids = iter(contact_ids)
+        send = lambda contact_id: self.send_campaign_to_contact(campaign_id, contact_id, send_date=send_date)
+        try:
+            for contact_id, dict_result in self.fan_out(send, contact_ids, max_workers,
+                                                         stop_error_codes=PyDotMailer.CAMPAIGN_WIDE_ERROR_CODES):
+                if dict_result.get('ok'):
+                    stats['sent'] += 1
+                else:
+                    stats['failed'] += 1
+                    if dict_result.get('error_code') in PyDotMailer.CAMPAIGN_WIDE_ERROR_CODES:
+                        stats['stopped_by'] = dict_result.get('error_code')
+                yield contact_id, dict_result
+            if stats['stopped_by']:
+                logger.warning("Stopped sending campaign %s: %s" % (campaign_id, stats['stopped_by']))
+                for contact_id in contact_ids:
+                    stats['not_attempted'] += 1
+                    yield contact_id, self.make_result({
+                        'ok': False, 'attempted': False, 'error_code': stats['stopped_by'],
+                        'errors': ['Not sent because an earlier send failed with %s' % stats['stopped_by']]})
+        finally:
+            stats['seconds'] = time.time() - started
+            if stats['seconds']:
+                stats['per_second'] = (stats['sent'] + stats['failed']) / stats['seconds']
+            logger.info("send_campaign_to_contacts campaign %s: %s" % (campaign_id, stats))
+
+
+    def send_campaign_to_contacts_batched(self, campaign_id, contact_ids, send_date=None, batch_size=None,
+                                          fallback_workers=4):
+        """
+        Send a campaign to many contacts using SendCampaignToContacts, which takes a list of contact ids, so N
+        contacts cost N / batch size SOAP calls rather than N.
+        Unless batch_size is given, the batch size adapts: it doubles while calls succeed in under
+        SEND_BATCH_TARGET_SECONDS and halves when a call fails or is slow.
+        If dotMailer rejects a batch with a fault that applies to the whole campaign (CAMPAIGN_WIDE_ERROR_CODES),
+        every contact in it gets that error and nothing more is sent (the rest are yielded with 'attempted': False).
+        Any other fault, e.g. one contact in the batch being suppressed, means the batch wasn't sent, so only the
+        contacts in that batch are retried one at a time with send_campaign_to_contact to find out which ones fail.
+        If the call fails without a fault (e.g. a timeout) the batch may or may not have been sent, so it isn't
+        retried; each contact gets the error.
+        Same results and last_send_stats as send_campaign_to_contacts, plus 'batches' and 'fallback_sends' stats.
+        @param campaign_id
+        @param contact_ids iterable of contact ids
+        @param send_date date/time in server time when the campaign should be sent. Same for every contact.
+        @param batch_size fixed number of contacts per call. None to adapt automatically.
+        @param fallback_workers concurrent single sends when falling back for a rejected batch
+        @return generator of (contact_id, dict_result)
+        http://www.dotmailer.co.uk/api/campaigns/send_campaign_to_contacts.aspx
+        """
+        if not send_date:
+            send_date = datetime.utcnow()  # one timestamp for the whole send
+        stats = {'sent': 0, 'failed': 0, 'not_attempted': 0, 'seconds': 0.0, 'per_second': 0.0, 'stopped_by': None,
+                 'batches': 0, 'fallback_sends': 0}
+        self.last_send_stats = stats
+        started = time.time()
+        contact_ids = iter(contact_ids)
+        unsent = iter(())  # what's left of a batch being sent one at a time, if a campaign-wide error stops it
+        current_batch_size = batch_size or PyDotMailer.SEND_BATCH_SIZE_START
+        try:
+            while not stats['stopped_by']:
+                batch = []
+                for contact_id in contact_ids:
+                    batch.append(contact_id)
+                    if len(batch) >= current_batch_size:
+                        break
+                if not batch:
+                    break
+                stats['batches'] += 1
+                call_started = time.time()
+                dict_result, exception = self._send_campaign_to_contact_batch(campaign_id, batch, send_date)
+                call_seconds = time.time() - call_started
+                error_code = dict_result.get('error_code')
+                if dict_result.get('ok') or not (exception is not None and hasattr(exception, 'fault')) or \
+                        error_code in PyDotMailer.CAMPAIGN_WIDE_ERROR_CODES:
+                    # the whole batch shares one outcome
+                    for contact_id in batch:
+                        stats['sent' if dict_result.get('ok') else 'failed'] += 1
+                        yield contact_id, dict_result.copy()
+                    if error_code in PyDotMailer.CAMPAIGN_WIDE_ERROR_CODES:
+                        stats['stopped_by'] = error_code
+                else:
+                    # dotMailer rejected the batch because of (we assume) some of its contacts. Find out which.
+                    send = lambda contact_id: self.send_campaign_to_contact(campaign_id, contact_id,
+                                                                            send_date=send_date)
+                    unsent = iter(batch)
+                    for contact_id, single_result in self.fan_out(
+                            send, unsent, fallback_workers,
+                            stop_error_codes=PyDotMailer.CAMPAIGN_WIDE_ERROR_CODES):
+                        stats['fallback_sends'] += 1
+                        stats['sent' if single_result.get('ok') else 'failed'] += 1
+                        if single_result.get('error_code') in PyDotMailer.CAMPAIGN_WIDE_ERROR_CODES:
+                            stats['stopped_by'] = single_result.get('error_code')
+                        yield contact_id, single_result
+                if not batch_size:
+                    if dict_result.get('ok') and call_seconds < PyDotMailer.SEND_BATCH_TARGET_SECONDS:
+                        current_batch_size = min(current_batch_size * 2, PyDotMailer.SEND_BATCH_SIZE_MAX)
+                    elif not dict_result.get('ok') or call_seconds > PyDotMailer.SEND_BATCH_TARGET_SECONDS:
+                        current_batch_size = max(current_batch_size // 2, PyDotMailer.SEND_BATCH_SIZE_MIN)
+            if stats['stopped_by']:
+                logger.warning("Stopped sending campaign %s: %s" % (campaign_id, stats['stopped_by']))
+                for contact_id in itertools.chain(unsent, contact_ids):
+                    stats['not_attempted'] += 1
+                    yield contact_id, self.make_result({
+                        'ok': False, 'attempted': False, 'error_code': stats['stopped_by'],
+                        'errors': ['Not sent because an earlier send failed with %s' % stats['stopped_by']]})
+        finally:
+            stats['seconds'] = time.time() - started
+            if stats['seconds']:
+                stats['per_second'] = (stats['sent'] + stats['failed']) / stats['seconds']
+            logger.info("send_campaign_to_contacts_batched campaign %s: %s" % (campaign_id, stats))
 
 
-    def get_contact_by_email(self, email):
+    def _send_campaign_to_contact_batch(self, campaign_id, contact_ids, send_date):
+        """
+        One SendCampaignToContacts call.
+        @return (dict_result, exception) where exception is whatever the call raised, or None
+        """
+        dict_result = {'ok': True}
+        exception = None
+        try:
+            contacts = self.client.factory.create('ArrayOfInt')
+            contacts.int = list(contact_ids)
+            return_code = self._call_service('SendCampaignToContacts', username=self.api_username,
+                                                                       password=self.api_password,
+                                                                       campaignId=campaign_id,
+                                                                       contacts=contacts,
+                                                                       sendDate=self.dt_to_iso_date(send_date))
+            if return_code:
+                # return code, which means an error
+                dict_result = {'ok': False, 'result': return_code}
+        except Exception as e:
+            exception = e
+            dict_result = self.unpack_exception(e)
+        return self._finish_result(dict_result), exception
+
+
+    def fan_out(self, call, keys, max_workers, stop_error_codes=(), ordered=False):
+        """
+        Run call(key) for each key on a pool of threads, yielding (key, dict_result) as each call completes.
+        The bulk methods (e.g. get_contacts_by_emails) and dotmailersendqueue are built on it.
+        Only a couple of calls per worker are queued at a time, so keys can be a long or lazy iterable.
+        Nothing more is started once a result has an error_code in stop_error_codes; keys not yet started are
+        left unconsumed in the keys iterator. Closing the generator early cancels calls queued but not yet running.
+        @param call function(key) returning a dict_result, e.g. a bound PyDotMailer method
+        @param keys iterator of keys. Pass an iterator, not a list, to see which keys weren't started.
+        @param max_workers number of calls in progress at once
+        @param stop_error_codes error codes after which nothing more is started, e.g. CAMPAIGN_WIDE_ERROR_CODES
+        @param ordered yield in the order of keys instead. A slow call then holds back the results after it.
+        @return generator of (key, dict_result)
+        """
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED  # 'futures' package on Python 2
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        in_flight = {}  # future -> key
+        submitted = deque()  # futures in the order of keys, if ordered
+        stopping = False
+        try:
+            while True:
+                while not stopping and len(in_flight) < max_workers * 2:
+                    try:
+                        key = next(keys)
+                    except StopIteration:
+                        break
+                    future = executor.submit(call, key)
+                    in_flight[future] = key
+                    if ordered:
+                        submitted.append(future)
+                if not in_flight:
+                    break
+                if ordered:
+                    done = [submitted.popleft()]
+                else:
+                    done, not_done = wait(list(in_flight.keys()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    dict_result = future.result()
+                    if dict_result.get('error_code') in stop_error_codes:
+                        stopping = True
+                    yield in_flight.pop(future), dict_result
+        finally:
+            # if the caller stops iterating early, drop anything queued but not yet running
+            for future in in_flight:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+
+    def get_contact_by_email(self, email, raw_result=False):
         """
         @param email email address to search for.
+        @param raw_result With fast_path, the reply is read straight into contact_id, email and d_fields, without
+            building suds objects, so there's no 'result' member. True to have suds build 'result' as before.
+        If there's a contact_cache, the result may come from it instead, with 'cached': True and no 'result' member.
         @return dict  e.g. {'ok': True,
                         contact_id: 32323232, # the dotMailer contact ID
                         email: # the email address of the returned record
@@ -296,28 +1322,39 @@ class PyDotMailer(object):
                      }}
             http://www.dotmailer.co.uk/api/contacts/get_contact_by_email.aspx
         """
+        if self.contact_cache is not None:
+            cached_result = self.contact_cache.get_by_email(email)
+            if cached_result is not None:
+                return self.make_result(cached_result)
+        reply_parser = None
+        if self.fast_path and not raw_result:
+            from .dotmailerresponses import parse_contact_reply as reply_parser
         dict_result = {'ok': True}
         data_fields = None
         try:
-            return_code = self.client.service.GetContactByEmail(username=self.api_username,
-                                                                password=self.api_password,
-                                                                email=email)
-            dict_result = {'ok': True, 'result': return_code}
-            if dict_result.get('ok'):
-                # create a dictionary with structure { field_name: field_value }
-                try:
-                    data_fields = dict_result.get('result').DataFields
-                    d_fields = self._clean_returned_data_fields(data_fields=data_fields)
-                    dict_result.update({'d_fields': d_fields})
-                except:
-                    logger.exception("Exception unpacking fields in GetContactByEmail for email=%s" % email)
-                    # log additional info separately in case something bad has happened
-                    # which'll cause this logging line to raise.
-                    logger.error("Further info: data_fields=%s" % data_fields)
-            contact_id = return_code.ID
-            dict_result.update({'contact_id': contact_id})
-            returned_email_address = return_code.Email
-            dict_result.update({'email': returned_email_address})
+            return_code = self._call_service('GetContactByEmail', reply_parser=reply_parser,
+                                                                  username=self.api_username,
+                                                                  password=self.api_password,
+                                                                  email=email)
+            if isinstance(return_code, dict):
+                dict_result = self._contact_result_from_reply(return_code)
+            else:
+                dict_result = {'ok': True, 'result': return_code}
+                if dict_result.get('ok'):
+                    # create a dictionary with structure { field_name: field_value }
+                    try:
+                        data_fields = dict_result.get('result').DataFields
+                        d_fields = self._clean_returned_data_fields(data_fields=data_fields)
+                        dict_result.update({'d_fields': d_fields})
+                    except:
+                        logger.exception("Exception unpacking fields in GetContactByEmail for email=%s" % email)
+                        # log additional info separately in case something bad has happened
+                        # which'll cause this logging line to raise.
+                        logger.error("Further info: data_fields=%s" % data_fields)
+                contact_id = return_code.ID
+                dict_result.update({'contact_id': contact_id})
+                returned_email_address = return_code.Email
+                dict_result.update({'email': returned_email_address})
         except Exception as e:
             dict_result = self.unpack_exception(e)
             error_code = dict_result.get("error_code")
@@ -327,7 +1364,9 @@ class PyDotMailer(object):
                 pass
             else:
                 logger.exception("Exception in GetContactByEmail")
-        return dict_result
+        if self.contact_cache is not None:
+            self.contact_cache.put(dict_result, email=email)
+        return self._finish_result(dict_result)
 
 
     def dt_to_iso_date(self, dt):
@@ -369,9 +1408,12 @@ class PyDotMailer(object):
                     value_index += 1 # Step on to next value
                 name_index += 1 # Next key
         """
+        return self._pair_data_fields(data_fields.Keys[0], data_fields.Values[0])
+
+
+    def _pair_data_fields(self, data_fields_keys, data_fields_values):
+        """ @return dict of field name -> value, from the lists of names and values dotMailer returns (Case 1886) """
         d_fields = {}
-        data_fields_keys = data_fields.Keys[0]
-        data_fields_values = data_fields.Values[0]
         # Case 1886: If there's an empty first name/last name key, then dotMailer fails to return a value,
         # so the lengths don't match
         # If this happens, scan through the keys and add an extra value of None just before the dodgy key(s)
@@ -405,9 +1447,27 @@ class PyDotMailer(object):
         return d_fields
 
 
-    def get_contact_by_id(self, contact_id):
+    def _contact_result_from_reply(self, contact):
+        """
+        @param contact dict from dotmailerresponses.parse_contact_reply
+        @return dict_result as from get_contact_by_email, without 'result'
+        """
+        dict_result = {'ok': True, 'contact_id': contact.get('contact_id'), 'email': contact.get('email')}
+        try:
+            dict_result['d_fields'] = self._pair_data_fields(contact.get('data_field_keys'),
+                                                             contact.get('data_field_values'))
+        except Exception:
+            logger.exception("Exception unpacking fields for contact_id=%s" % contact.get('contact_id'))
+            logger.error("Further info: contact=%s" % contact)
+        return dict_result
+
+
+    def get_contact_by_id(self, contact_id, raw_result=False):
         """
         @param contact_id - id to search for
+        @param raw_result With fast_path, the reply is read straight into contact_id, email and d_fields, without
+            building suds objects, so there's no 'result' member. True to have suds build 'result' as before.
+        If there's a contact_cache, the result may come from it instead, with 'cached': True and no 'result' member.
         @return dict  e.g. {'ok': True,
                         contact_id: 32323232, # the dotMailer contact ID
                         email: # the email address of the returned record
@@ -443,28 +1503,41 @@ class PyDotMailer(object):
                      }}
             http://www.dotmailer.co.uk/api/contacts/get_contact_by_id.aspx
         """
+        if self.contact_cache is not None:
+            cached_result = self.contact_cache.get_by_id(contact_id)
+            if cached_result is not None:
+                return self.make_result(cached_result)
+        requested_contact_id = contact_id
+        reply_parser = None
+        if self.fast_path and not raw_result:
+            from .dotmailerresponses import parse_contact_reply as reply_parser
         dict_result = {'ok': True}
         data_fields = None
         try:
-            return_code = self.client.service.GetContactById(username=self.api_username, password=self.api_password,
-                                                             id=contact_id)
-            dict_result = {'ok': True, 'result': return_code}
-            if dict_result.get('ok'):
-                # create a dictionary with structure { field_name: field_value }
-                try:
-                    d_fields = {}
-                    data_fields = dict_result.get('result').DataFields
-                    d_fields = self._clean_returned_data_fields(data_fields=data_fields)
-                    dict_result.update({'d_fields': d_fields })
-                except:
-                    logger.exception("Exception unpacking fields in GetContactById for id=%s" % contact_id)
-                    # log additional info separately in case something bad has happened
-                    # which'll cause this logging line to raise.
-                    logger.error("Further info: data_fields=%s" % data_fields)
-            contact_id = return_code.ID
-            dict_result.update({'contact_id': contact_id})
-            returned_email_address = return_code.Email
-            dict_result.update({'email': returned_email_address})
+            return_code = self._call_service('GetContactById', reply_parser=reply_parser,
+                                                               username=self.api_username,
+                                                               password=self.api_password,
+                                                               id=contact_id)
+            if isinstance(return_code, dict):
+                dict_result = self._contact_result_from_reply(return_code)
+            else:
+                dict_result = {'ok': True, 'result': return_code}
+                if dict_result.get('ok'):
+                    # create a dictionary with structure { field_name: field_value }
+                    try:
+                        d_fields = {}
+                        data_fields = dict_result.get('result').DataFields
+                        d_fields = self._clean_returned_data_fields(data_fields=data_fields)
+                        dict_result.update({'d_fields': d_fields })
+                    except:
+                        logger.exception("Exception unpacking fields in GetContactById for id=%s" % contact_id)
+                        # log additional info separately in case something bad has happened
+                        # which'll cause this logging line to raise.
+                        logger.error("Further info: data_fields=%s" % data_fields)
+                contact_id = return_code.ID
+                dict_result.update({'contact_id': contact_id})
+                returned_email_address = return_code.Email
+                dict_result.update({'email': returned_email_address})
         except Exception as e:
             dict_result = self.unpack_exception(e)
             error_code = dict_result.get('error_code')
@@ -472,7 +1545,107 @@ class PyDotMailer(object):
                 pass  # Don't log these expected errors
             elif error_code == PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_CAMPAIGN_APINOTPERMITTED:
                 pass
-        return dict_result
+        if self.contact_cache is not None:
+            self.contact_cache.put(dict_result, contact_id=requested_contact_id)
+        return self._finish_result(dict_result)
+
+
+    def get_contacts_by_emails(self, emails, max_workers=10, ordered=False, raw_result=False):
+        """
+        Look up many contacts, making up to max_workers GetContactByEmail calls at once.
+        This is a generator. Each address is looked up once, however often (and in whatever case) it appears. Unless
+        ordered, results found in the contact_cache are yielded first and the rest as each call completes.
+        ERROR_CONTACT_NOT_FOUND is an ordinary result, as from get_contact_by_email.
+        Once the generator is exhausted, self.last_lookup_stats holds the totals and throughput, e.g.
+            {'found': 990, 'not_found': 8, 'failed': 2, 'cached': 120, 'duplicates': 5, 'seconds': 3.2,
+             'per_second': 312.5}
+        @param emails iterable of email addresses. It's consumed lazily, so it may be a generator.
+        @param max_workers number of concurrent SOAP calls. The connection pool should allow at least as many.
+        @param ordered yield results in the order of emails (as first seen)
+        @param raw_result see get_contact_by_email
+        @return generator of (email, dict_result), dict_result as from get_contact_by_email
+        """
+        get_cached = self.contact_cache.get_by_email if self.contact_cache is not None else None
+        lookup = lambda email: self.get_contact_by_email(email, raw_result=raw_result)
+        return self._get_contacts(emails, lambda email: email.strip().lower(), get_cached, lookup, max_workers,
+                                  ordered)
+
+
+    def get_contacts_by_ids(self, contact_ids, max_workers=10, ordered=False, raw_result=False):
+        """
+        Look up many contacts by id, as get_contacts_by_emails does by email address.
+        An id which isn't a number (e.g. 'abc' or None) gets an ERROR_CONTACT_NOT_FOUND result without calling
+        dotMailer.
+        @return generator of (contact_id, dict_result), dict_result as from get_contact_by_id
+        """
+        def normalise(contact_id):
+            try:
+                return int(contact_id)
+            except (TypeError, ValueError):
+                return repr(contact_id)  # not an id, but still only reported once
+
+        def lookup(contact_id):
+            if isinstance(normalise(contact_id), int):
+                return self.get_contact_by_id(contact_id, raw_result=raw_result)
+            return self.make_result({'ok': False, 'errors': ['%r is not a contact id' % (contact_id,)],
+                                      'error_code': PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_CONTACT_NOT_FOUND})
+        get_cached = self.contact_cache.get_by_id if self.contact_cache is not None else None
+        return self._get_contacts(contact_ids, normalise, get_cached, lookup, max_workers, ordered)
+
+
+    def _get_contacts(self, keys, normalise, get_cached, lookup, max_workers, ordered):
+        """
+        The generator behind get_contacts_by_emails and get_contacts_by_ids.
+        @param normalise function(key) giving the same value for keys which are the same contact
+        @param get_cached function(key) returning the cached dict_result, or None. None if there's no cache.
+        @param lookup function(key) returning a dict_result
+        """
+        stats = {'found': 0, 'not_found': 0, 'failed': 0, 'cached': 0, 'duplicates': 0, 'seconds': 0.0,
+                 'per_second': 0.0}
+        self.last_lookup_stats = stats
+        started = time.time()
+        cached_results = deque()  # (key, dict_result) found while looking for keys to look up
+
+        def keys_to_look_up():
+            seen = set()
+            for key in keys:
+                normalised_key = normalise(key)
+                if normalised_key in seen:
+                    stats['duplicates'] += 1
+                    continue
+                seen.add(normalised_key)
+                if get_cached is not None and not ordered:
+                    cached_result = get_cached(key)
+                    if cached_result is not None:
+                        cached_results.append((key, self.make_result(cached_result)))
+                        continue
+                yield key
+
+        def results():
+            # with ordered, cache hits come back through lookup (which checks the cache) so they keep their place
+            for key, dict_result in self.fan_out(lookup, keys_to_look_up(), max_workers, ordered=ordered):
+                while cached_results:
+                    yield cached_results.popleft()
+                yield key, dict_result
+            while cached_results:
+                yield cached_results.popleft()
+
+        try:
+            for key, dict_result in results():
+                if dict_result.get('cached'):
+                    stats['cached'] += 1
+                if dict_result.get('ok'):
+                    stats['found'] += 1
+                elif dict_result.get('error_code') == PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_CONTACT_NOT_FOUND:
+                    stats['not_found'] += 1
+                else:
+                    stats['failed'] += 1
+                yield key, dict_result
+        finally:
+            stats['seconds'] = time.time() - started
+            if stats['seconds']:
+                stats['per_second'] = (stats['found'] + stats['not_found'] + stats['failed']) / stats['seconds']
+            logger.info("get_contacts: %s" % stats)
 
 
 """
@@ -0,0 +1,354 @@
+""" A local stand-in for the dotMailer SOAP API (apiconnector.com), for tests and benchmarks which mustn't need a
+dotMailer account.
+It serves tests/fixtures/fake_dotmailer.wsdl and answers AddContactToAddressBook,
+AddContactsToAddressBookWithProgress, GetContactImportProgress, SendCampaignToContact, SendCampaignToContacts,
+GetContactByEmail, GetContactById and ListContactDataLabels from contacts kept in memory, with dotMailer's faults
+(e.g. ERROR_CONTACT_NOT_FOUND) and optional latency, random failures and an API quota.
+Usage, in process:
+    with FakeDotMailerServer(latency_seconds=0.05) as server:
+        dot_mailer = PyDotMailer('user', 'password', api_url=server.api_url)
+or on its own:
+    python tests/fake_dotmailer_server.py --port 18080 --latency 0.05
+"""
+import argparse
+import base64
+import csv
+import io
+import os
+import random
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer  # Python 2
+    from SocketServer import ThreadingMixIn
+from xml.sax.saxutils import escape
+
+import logging
+logger = logging.getLogger(__name__)
+
+WSDL_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fixtures', 'fake_dotmailer.wsdl')
+API_NAMESPACE = 'http://apiconnector.com'
+_ENVELOPE = (u'<?xml version="1.0" encoding="utf-8"?>'
+             u'<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/" '
+             u'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:xsd="http://www.w3.org/2001/XMLSchema">'
+             u'<soap:Body>%s</soap:Body></soap:Envelope>')
+DEFAULT_DATA_LABELS = [('FIRSTNAME', 'String'), ('LASTNAME', 'String'), ('FULLNAME', 'String'),
+                       ('POSTCODE', 'String'), ('GENDER', 'String')]
+
+
+class FakeDotMailerServer(object):
+    """
+    The stand-in server, run on a background thread. Contacts added through any call can be looked up and sent to.
+    Faults are dotMailer's: ERROR_CONTACT_NOT_FOUND, ERROR_CAMPAIGN_NOT_FOUND for a campaign not in campaign_ids,
+    ERROR_CONTACT_SUPPRESSED for a contact in suppressed_contact_ids and ERROR_APIUSAGE_EXCEEDED over the quota.
+    """
+    def __init__(self, host='127.0.0.1', port=0, latency_seconds=0.0, latency_jitter_seconds=0.0, fault_rate=0.0,
+                 http_error_rate=0.0, quota_per_second=None, import_seconds=0.5, campaign_ids=None,
+                 data_labels=None, seed=None):
+        """
+        @param port 0 to pick a free one (see api_url)
+        @param latency_seconds time taken by every call
+        @param latency_jitter_seconds up to this much more, at random
+        @param fault_rate proportion of calls answered with a SOAP fault (ERROR_FAKE_FAULT) instead
+        @param http_error_rate proportion of calls answered with HTTP 503 and no SOAP fault instead
+        @param quota_per_second calls allowed per second (with a burst of one second's worth), beyond which calls
+            get ERROR_APIUSAGE_EXCEEDED. None for no quota.
+        @param import_seconds how long an AddContactsToAddressBookWithProgress import stays NotFinished
+        @param campaign_ids ids SendCampaignToContact(s) accept. None to accept any.
+        @param data_labels list of (name, type) for ListContactDataLabels. Defaults to DEFAULT_DATA_LABELS.
+        @param seed for the random latency and failures
+        """
+        self.latency_seconds = latency_seconds
+        self.latency_jitter_seconds = latency_jitter_seconds
+        self.fault_rate = fault_rate
+        self.http_error_rate = http_error_rate
+        self.quota_per_second = quota_per_second
+        self.import_seconds = import_seconds
+        self.campaign_ids = campaign_ids
+        self.data_labels = data_labels or DEFAULT_DATA_LABELS
+        self.suppressed_contact_ids = set()
+        self.sends = []  # (campaign_id, contact_id)
+        self.call_counts = {}  # operation -> calls
+        self._random = random.Random(seed)
+        self._contacts_by_email = {}  # lower case email -> contact dict
+        self._contacts_by_id = {}
+        self._next_contact_id = 1000
+        self._imports = {}  # progress id -> time finished
+        self._quota_tokens = quota_per_second
+        self._quota_updated_at = time.time()
+        self._lock = threading.Lock()
+        with open(WSDL_PATH, 'rb') as wsdl_file:
+            self._wsdl_template = wsdl_file.read()
+        self._httpd = _ThreadingHTTPServer((host, port), _RequestHandler)
+        self._httpd.fake = self
+        self.host, self.port = self._httpd.server_address[:2]
+        self.location = 'http://%s:%s/API.asmx' % (self.host, self.port)
+        self.api_url = self.location + '?WSDL'
+        self.wsdl = self._wsdl_template.replace(b'http://localhost/API.asmx', self.location.encode('ascii'))
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='FakeDotMailerServer')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """ Serve on the calling thread, until stop() """
+        self._httpd.serve_forever()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def add_contact(self, email, data_fields=None):
+        """ @return the contact id of email, adding it if it's new. data_fields dict of name -> value """
+        with self._lock:
+            contact = self._contacts_by_email.get(email.lower())
+            if contact is None:
+                self._next_contact_id += 1
+                contact = {'id': self._next_contact_id, 'email': email, 'data_fields': {}}
+                self._contacts_by_email[email.lower()] = contact
+                self._contacts_by_id[contact['id']] = contact
+            for name, value in (data_fields or {}).items():
+                contact['data_fields'][name.upper()] = value
+            return contact['id']
+
+    def set_quota(self, per_second, tokens=None):
+        """
+        Change the API usage quota, e.g. to put the server in a given quota state mid-test.
+        @param per_second calls allowed per second. None for no quota.
+        @param tokens calls allowed straight away, before the quota refills. Defaults to one second's worth.
+        """
+        with self._lock:
+            self.quota_per_second = per_second
+            self._quota_tokens = per_second if tokens is None else tokens
+            self._quota_updated_at = time.time()
+
+    def stats(self):
+        """ @return dict e.g. {'calls': {'GetContactByEmail': 10}, 'contacts': 5, 'sends': 3} """
+        with self._lock:
+            return {'calls': dict(self.call_counts), 'contacts': len(self._contacts_by_id), 'sends': len(self.sends)}
+
+    def handle(self, operation, request):
+        """
+        @param operation e.g. 'GetContactById'
+        @param request dict of the request's parameters (local name -> element)
+        @return (HTTP status, response body)
+        """
+        with self._lock:
+            self.call_counts[operation] = self.call_counts.get(operation, 0) + 1
+            delay = self.latency_seconds + self._random.uniform(0, self.latency_jitter_seconds)
+            chance = self._random.random()
+            over_quota = not self._take_quota_token()
+        if delay:
+            time.sleep(delay)
+        if chance < self.http_error_rate:
+            return 503, b'Service Unavailable'
+        if chance < self.http_error_rate + self.fault_rate:
+            return _fault('Fake fault ERROR_FAKE_FAULT')
+        if over_quota:
+            return _fault('API usage exceeded ERROR_APIUSAGE_EXCEEDED')
+        handler = getattr(self, '_%s' % operation, None)
+        if handler is None:
+            return _fault('Unknown operation %s' % operation)
+        return handler(request)
+
+    def _take_quota_token(self):
+        if self.quota_per_second is None:
+            return True
+        now = time.time()
+        self._quota_tokens = min(self._quota_tokens + (now - self._quota_updated_at) * self.quota_per_second,
+                                 self.quota_per_second)
+        self._quota_updated_at = now
+        if self._quota_tokens < 1:
+            return False
+        self._quota_tokens -= 1
+        return True
+
+    def _AddContactToAddressBook(self, request):
+        contact = request['contact']
+        keys = [element.text for element in _find(contact, 'DataFields', 'Keys')]
+        values = [element.text for element in _find(contact, 'DataFields', 'Values')]
+        contact_id = self.add_contact(_find(contact, 'Email').text, dict(zip(keys, values)))
+        return self._contact_response('AddContactToAddressBook', self._contacts_by_id.get(contact_id))
+
+    def _AddContactsToAddressBookWithProgress(self, request):
+        data = base64.b64decode(request['data'].text or '').decode('utf-8')
+        for row in csv.DictReader(io.StringIO(data)):
+            fields = dict((name, value) for name, value in row.items() if name and name.lower() != 'email')
+            email = row.get('email') or row.get('Email') or row.get('EMAIL')
+            if email:
+                self.add_contact(email, fields)
+        with self._lock:
+            progress_id = '%08x-fake-%d' % (self._random.getrandbits(32), len(self._imports))
+            self._imports[progress_id] = time.time() + self.import_seconds
+        return _response('AddContactsToAddressBookWithProgress', _escape(progress_id))
+
+    def _GetContactImportProgress(self, request):
+        finished_at = self._imports.get(request['progressID'].text)
+        if finished_at is None:
+            return _fault('Import not found ERROR_IMPORT_NOT_FOUND')
+        return _response('GetContactImportProgress', 'Finished' if time.time() >= finished_at else 'NotFinished')
+
+    def _SendCampaignToContact(self, request):
+        return self._send(int(request['campaignId'].text), [int(request['contactid'].text)],
+                          'SendCampaignToContact')
+
+    def _SendCampaignToContacts(self, request):
+        return self._send(int(request['campaignId'].text),
+                          [int(element.text) for element in request.get('contacts', [])], 'SendCampaignToContacts')
+
+    def _send(self, campaign_id, contact_ids, operation):
+        if self.campaign_ids is not None and campaign_id not in self.campaign_ids:
+            return _fault('Campaign not found ERROR_CAMPAIGN_NOT_FOUND')
+        for contact_id in contact_ids:
+            if contact_id not in self._contacts_by_id:
+                return _fault('Contact not found ERROR_CONTACT_NOT_FOUND')
+            if contact_id in self.suppressed_contact_ids:
+                return _fault('Contact is suppressed. ERROR_CONTACT_SUPPRESSED')
+        with self._lock:
+            self.sends.extend((campaign_id, contact_id) for contact_id in contact_ids)
+        return 200, (_ENVELOPE % (u'<%sResponse xmlns="%s"/>' % (operation, API_NAMESPACE))).encode('utf-8')
+
+    def _GetContactByEmail(self, request):
+        return self._contact_response('GetContactByEmail',
+                                      self._contacts_by_email.get((request['email'].text or '').lower()))
+
+    def _GetContactById(self, request):
+        return self._contact_response('GetContactById', self._contacts_by_id.get(int(request['id'].text)))
+
+    def _contact_response(self, operation, contact):
+        if contact is None:
+            return _fault('Contact not found ERROR_CONTACT_NOT_FOUND')
+        with self._lock:  # add_contact may be updating it
+            return _response(operation, _contact_xml(contact))
+
+    def _ListContactDataLabels(self, request):
+        return _response('ListContactDataLabels', u''.join(
+            u'<ContactDataLabel><Name>%s</Name><Type>%s</Type></ContactDataLabel>' % (_escape(name), data_type)
+            for name, data_type in self.data_labels))
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, as apiconnector.com
+    disable_nagle_algorithm = True  # otherwise small replies on a kept-alive connection wait for a delayed ACK
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def do_GET(self):
+        self._send(200, self.server.fake.wsdl)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        operation = (self.headers.get('SOAPAction') or '').strip('"').rsplit('/', 1)[-1]
+        try:
+            request = _parse_request(body)
+        except Exception as e:
+            status, response = _fault('Bad request: %s' % e, 'soap:Client')
+        else:
+            try:
+                status, response = self.server.fake.handle(operation, request)
+            except Exception as e:
+                logger.exception("Exception handling %s" % operation)
+                status, response = _fault('Server error: %s' % e)
+        self._send(status, response)
+
+    def _send(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _parse_request(body):
+    """ @return dict of the operation's parameters, local name -> element """
+    envelope = ElementTree.fromstring(body)
+    soap_body = [child for child in envelope if _local_name(child.tag) == 'Body'][0]
+    operation = list(soap_body)[0]
+    return dict((_local_name(child.tag), child) for child in operation)
+
+
+def _local_name(tag):
+    return tag.rpartition('}')[2]
+
+
+def _find(element, *names):
+    """ @return the descendant of element with the given local names, in turn """
+    for name in names:
+        element = [child for child in element if _local_name(child.tag) == name][0]
+    return element
+
+
+def _escape(text):
+    return escape(u'%s' % text)
+
+
+def _response(operation, result_xml):
+    return 200, (_ENVELOPE % (u'<%sResponse xmlns="%s"><%sResult>%s</%sResult></%sResponse>'
+                              % (operation, API_NAMESPACE, operation, result_xml, operation, operation))
+                 ).encode('utf-8')
+
+
+def _fault(fault_string, fault_code='soap:Server'):
+    return 500, (_ENVELOPE % (u'<soap:Fault><faultcode>%s</faultcode><faultstring>'
+                              u'Server was unable to process request. ---&gt; %s</faultstring></soap:Fault>'
+                              % (fault_code, _escape(fault_string)))).encode('utf-8')
+
+
+def _contact_xml(contact):
+    fields = sorted(contact['data_fields'].items())
+    values = []
+    for name, value in fields:
+        if value is None or value == '':
+            values.append(u'<anyType xsi:nil="true"/>')
+        else:
+            values.append(u'<anyType xsi:type="xsd:string">%s</anyType>' % _escape(value))
+    return (u'<ID>%d</ID><Email>%s</Email><AudienceType>Unknown</AudienceType><DataFields><Keys>%s</Keys>'
+            u'<Values>%s</Values></DataFields><OptInType>Unknown</OptInType><EmailType>Html</EmailType>'
+            % (contact['id'], _escape(contact['email']),
+               u''.join(u'<string>%s</string>' % _escape(name) for name, value in fields), u''.join(values)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds per call')
+    parser.add_argument('--jitter', type=float, default=0.0, help='up to this many more seconds per call')
+    parser.add_argument('--fault-rate', type=float, default=0.0)
+    parser.add_argument('--http-error-rate', type=float, default=0.0)
+    parser.add_argument('--quota', type=float, default=None, help='calls per second before usage exceeded faults')
+    parser.add_argument('--import-seconds', type=float, default=0.5)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    server = FakeDotMailerServer(host=args.host, port=args.port, latency_seconds=args.latency,
+                                 latency_jitter_seconds=args.jitter, fault_rate=args.fault_rate,
+                                 http_error_rate=args.http_error_rate, quota_per_second=args.quota,
+                                 import_seconds=args.import_seconds)
+    logger.info("Fake dotMailer API at %s" % server.api_url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
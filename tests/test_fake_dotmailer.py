@@ -0,0 +1,407 @@
+""" PyDotMailer tests against the local stand-in for the dotMailer API (fake_dotmailer_server.py), so they need no
+dotMailer account or secrets.py, and can check behaviour live tests can't provoke: faults, quotas and failures.
+"""
+import asyncio
+import os
+import pickle
+import shutil
+import socket
+import sqlite3
+import tempfile
+import time
+import unittest
+from datetime import datetime
+from decimal import Decimal
+
+from pydotmailer.pydotmailer import PyDotMailer
+from pydotmailer.dotmailerasync import AsyncPyDotMailer
+from pydotmailer.dotmailerretry import RetryPolicy
+from pydotmailer.dotmailerbreaker import CircuitBreaker
+from pydotmailer.dotmailertransport import ConnectionPoolTimeout
+from pydotmailer.dotmailermetrics import DotMailerMetrics
+from pydotmailer.dotmailerprofiler import DotMailerProfiler, PHASES
+from pydotmailer.dotmailerprocesses import send_campaign_to_contacts_in_processes
+from pydotmailer.dotmaileraccounts import AccountPool
+from pydotmailer.dotmailersendqueue import SendQueue
+from pydotmailer.dotmailercontactcache import ContactCache, SqliteContactCacheBackend
+from pydotmailer.dotmailerfingerprints import ContactFingerprints
+from pydotmailer.dotmailerimports import ImportProgressTracker
+from fake_dotmailer_server import FakeDotMailerServer
+
+import logging
+logger = logging.getLogger(__name__)
+
+CAMPAIGN_ID = 1234
+ADDRESS_BOOK_ID = 5678
+
+
+class TestFakeDotMailer(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeDotMailerServer(campaign_ids={CAMPAIGN_ID}).start()
+        self.dot_mailer = PyDotMailer(api_username='test', api_password='test', api_url=self.server.api_url)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_add_and_get_contact(self):
+        dict_result = self.dot_mailer.add_contact_to_address_book(ADDRESS_BOOK_ID, 'fake@example.com',
+                                                                  {'firstname': 'mike', 'postcode': 'SW1A 0AA'})
+        self.assertTrue(dict_result.get('ok'), dict_result)
+        contact_id = dict_result.get('contact_id')
+        dict_result = self.dot_mailer.get_contact_by_email('fake@example.com')
+        self.assertEqual(dict_result.get('contact_id'), contact_id)
+        self.assertEqual(dict_result.get('d_fields'), {'FIRSTNAME': 'mike', 'POSTCODE': 'SW1A 0AA'})
+        self.assertEqual(self.dot_mailer.get_contact_by_id(contact_id).get('email'), 'fake@example.com')
+        self.assertEqual(self.dot_mailer.get_contact_by_email('nobody@example.com').get('error_code'),
+                         PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_CONTACT_NOT_FOUND)
+
+    def test_get_contacts_by_ids(self):
+        contact_ids = [self.server.add_contact('many%d@example.com' % number) for number in range(3)]
+        dict_results = list(self.dot_mailer.get_contacts_by_ids(contact_ids[:2] + ['abc', str(contact_ids[0]), None,
+                                                                                   contact_ids[2]], ordered=True))
+        self.assertEqual([contact_id for contact_id, dict_result in dict_results],
+                         contact_ids[:2] + ['abc', None, contact_ids[2]])
+        self.assertEqual([dict_result.get('error_code') for contact_id, dict_result in dict_results],
+                         [None, None, PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_CONTACT_NOT_FOUND,
+                          PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_CONTACT_NOT_FOUND, None])
+        self.assertEqual((self.dot_mailer.last_lookup_stats['found'], self.dot_mailer.last_lookup_stats['not_found'],
+                          self.dot_mailer.last_lookup_stats['duplicates']), (3, 2, 1))
+
+    def test_fast_path_matches_suds(self):
+        self.server.add_contact('fast@example.com', {'FIRSTNAME': 'Fast', 'LASTNAME': None, 'POSTCODE': 'E1'})
+        fast_dot_mailer = PyDotMailer(api_username='test', api_password='test', api_url=self.server.api_url,
+                                      fast_path=True)
+        dict_result = self.dot_mailer.get_contact_by_email('fast@example.com')
+        fast_result = fast_dot_mailer.get_contact_by_email('fast@example.com')
+        for key in ('ok', 'contact_id', 'email', 'd_fields'):
+            self.assertEqual(fast_result.get(key), dict_result.get(key), key)
+        self.assertTrue(fast_dot_mailer.send_campaign_to_contact(CAMPAIGN_ID, fast_result.get('contact_id'))
+                        .get('ok'))
+
+    def test_send_campaign_faults(self):
+        contact_id = self.server.add_contact('send@example.com')
+        self.assertTrue(self.dot_mailer.send_campaign_to_contact(CAMPAIGN_ID, contact_id).get('ok'))
+        self.assertEqual(self.dot_mailer.send_campaign_to_contact(CAMPAIGN_ID + 1, contact_id).get('error_code'),
+                         PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_CAMPAIGN_NOT_FOUND)
+        self.server.suppressed_contact_ids.add(contact_id)
+        self.assertEqual(self.dot_mailer.send_campaign_to_contact(CAMPAIGN_ID, contact_id).get('error_code'),
+                         PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_CONTACT_UNSUBSCRIBED)
+        self.assertEqual(self.server.sends, [(CAMPAIGN_ID, contact_id)])
+
+    def test_send_campaign_batched(self):
+        contact_ids = [self.server.add_contact('batch%d@example.com' % number) for number in range(30)]
+        self.server.suppressed_contact_ids.add(contact_ids[3])
+        dict_results = dict(self.dot_mailer.send_campaign_to_contacts_batched(CAMPAIGN_ID, contact_ids,
+                                                                             batch_size=10))
+        stats = self.dot_mailer.last_send_stats
+        self.assertEqual((stats['sent'], stats['failed'], stats['batches'], stats['fallback_sends']),
+                         (29, 1, 3, 10), stats)
+        self.assertEqual(dict_results[contact_ids[3]].get('error_code'),
+                         PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_CONTACT_UNSUBSCRIBED)
+        self.assertEqual(len(self.server.sends), 29)
+        # a campaign-wide error while sending a rejected batch one at a time stops the send, and every contact
+        # left is reported
+        self.server.set_quota(1, tokens=1)  # enough for the batch, not the single sends
+        dict_results = dict(self.dot_mailer.send_campaign_to_contacts_batched(CAMPAIGN_ID, contact_ids,
+                                                                             batch_size=10, fallback_workers=1))
+        stats = self.dot_mailer.last_send_stats
+        self.assertEqual(len(dict_results), 30)
+        self.assertEqual(stats['stopped_by'], PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_CAMPAIGN_APINOTPERMITTED)
+        self.assertEqual((stats['fallback_sends'], stats['not_attempted']), (2, 28), stats)
+        self.assertFalse(dict_results[contact_ids[29]].get('attempted', True))
+
+    def test_upload_contacts(self):
+        dict_result = self.dot_mailer.add_contacts_to_address_book(ADDRESS_BOOK_ID,
+                                                                   'email,firstname\nup1@example.com,One\n'
+                                                                   'up2@example.com,Two\n',
+                                                                   wait_to_complete_seconds=10)
+        self.assertTrue(dict_result.get('ok'), dict_result)
+        self.assertEqual(self.dot_mailer.get_contact_by_email('up2@example.com').get('d_fields'),
+                         {'FIRSTNAME': 'Two'})
+        # split between records, not inside a quoted value
+        dict_result = self.dot_mailer.add_contacts_to_address_book(ADDRESS_BOOK_ID,
+                                                                   'Email,Notes\nup3@example.com,"line one\n\nline '
+                                                                   'two"\nup4@example.com,"a, ""b"""\n',
+                                                                   wait_to_complete_seconds=10, max_upload_bytes=20)
+        self.assertEqual(len(dict_result.get('progress_ids')), 2, dict_result)
+        self.assertEqual(self.dot_mailer.get_contact_by_email('up3@example.com').get('d_fields'),
+                         {'NOTES': 'line one\n\nline two'})
+        self.assertEqual(self.dot_mailer.get_contact_by_email('up4@example.com').get('d_fields'), {'NOTES': 'a, "b"'})
+        self.assertRaises(ValueError, self.dot_mailer.add_contacts_to_address_book, ADDRESS_BOOK_ID)
+
+    def test_async_upload_contacts(self):
+        async def upload():
+            async with AsyncPyDotMailer(dot_mailer=self.dot_mailer) as async_dot_mailer:
+                return await async_dot_mailer.add_contacts_to_address_book(
+                    ADDRESS_BOOK_ID, 'Email,FirstName\nasync1@example.com,One\nasync2@example.com,Two\n',
+                    wait_to_complete_seconds=10, max_upload_bytes=30)
+        dict_result = asyncio.run(upload())
+        self.assertEqual((dict_result.get('ok'), dict_result.get('result'), len(dict_result.get('progress_ids'))),
+                         (True, 'Finished', 2), dict_result)
+        self.assertEqual([upload_result.get('result') for upload_result in dict_result.get('uploads')],
+                         ['Finished', 'Finished'])
+
+    def test_async_timeouts(self):
+        contact_id = self.server.add_contact('async@example.com')
+        self.server.latency_seconds = 1.0
+
+        async def send_twice():
+            async with AsyncPyDotMailer(dot_mailer=self.dot_mailer, max_concurrency=1) as async_dot_mailer:
+                first = await async_dot_mailer.send_campaign_to_contact(CAMPAIGN_ID, contact_id, timeout=0.2)
+                # the first call still holds the only slot, so this one can't start in time
+                started = time.time()
+                second = await async_dot_mailer.send_campaign_to_contact(CAMPAIGN_ID, contact_id, timeout=0.2)
+                return first, second, time.time() - started
+        first, second, seconds = asyncio.run(send_twice())
+        self.assertEqual((first.get('error_code'), second.get('error_code')),
+                         (PyDotMailer.RESULT_FIELDS_ERROR_CODE.TIMEOUT_ERROR,
+                          PyDotMailer.RESULT_FIELDS_ERROR_CODE.TIMEOUT_ERROR))
+        self.assertLess(seconds, 0.5)
+        self.assertIn('not made', second.get('errors')[0])
+
+    def test_import_tracker(self):
+        self.server.import_seconds = 0.2
+        progress_ids = [self.dot_mailer.add_contacts_to_address_book(ADDRESS_BOOK_ID, 'Email\ntrack%d@example.com\n'
+                                                                     % number).get('progress_id')
+                        for number in range(3)]
+        get_contact_import_progress = self.dot_mailer.get_contact_import_progress
+
+        def slow_progress(progress_id):
+            if progress_id == progress_ids[0]:
+                time.sleep(3)
+            return get_contact_import_progress(progress_id)
+        self.dot_mailer.get_contact_import_progress = slow_progress
+        tracker = ImportProgressTracker(self.dot_mailer, poll_timeout=0.5)
+        try:
+            slow_future = tracker.track(progress_ids[0], timeout_seconds=1.5)
+            time.sleep(0.1)
+            # not held up by the slow check
+            self.assertEqual(tracker.track(progress_ids[1]).result(timeout=2.5).get('result'), 'Finished')
+            self.assertEqual(slow_future.result(timeout=1).get('error_code'),
+                             PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_UNFINISHED)
+            # the first check isn't put off past the timeout, however big the import
+            self.assertEqual(tracker.track(progress_ids[2], upload_bytes=10 ** 9, timeout_seconds=0.3)
+                             .result(timeout=2).get('result'), 'Finished')
+        finally:
+            tracker.close()
+
+    def test_quota_and_retries(self):
+        self.server.set_quota(2, tokens=0)
+        self.assertEqual(self.dot_mailer.get_contact_by_email('quota@example.com').get('error_code'),
+                         PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_CAMPAIGN_APINOTPERMITTED)
+        self.server.set_quota(None)
+        self.server.http_error_rate = 1.0
+        retrying_dot_mailer = PyDotMailer(api_username='test', api_password='test', api_url=self.server.api_url,
+                                          retry_policy=RetryPolicy(max_attempts=3, base_delay=0.01))
+        dict_result = retrying_dot_mailer.get_contact_by_email('retry@example.com')
+        self.assertEqual(dict_result.get('error_code'), PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_OTHER)
+        self.assertEqual(dict_result.get('attempts'), 3)
+        # only failures getting there and back are retried, not e.g. a bug
+        retry_policy = retrying_dot_mailer.retry_policy
+        self.assertTrue(retry_policy.is_retryable('GetContactById', {}, socket.error('reset'),
+                                                  PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_OTHER))
+        self.assertFalse(retry_policy.is_retryable('GetContactById', {}, TypeError('bug'),
+                                                   PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_OTHER))
+
+    def test_circuit_breaker(self):
+        circuit_breaker = CircuitBreaker(window_size=4, min_calls=4)
+        breaking_dot_mailer = PyDotMailer(api_username='test', api_password='test', api_url=self.server.api_url,
+                                          circuit_breaker=circuit_breaker)
+        self.assertEqual(breaking_dot_mailer.get_contact_by_email('nobody@example.com').get('error_code'),
+                         PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_CONTACT_NOT_FOUND)
+        # failures which say nothing about dotMailer aren't counted
+        invoke = breaking_dot_mailer._invoke
+        for error in (TypeError('bug'), ConnectionPoolTimeout('pool full')):
+            def failing_invoke(operation, kwargs, reply_parser, error=error):
+                raise error
+            breaking_dot_mailer._invoke = failing_invoke
+            breaking_dot_mailer.get_contact_by_email('nobody@example.com')
+        breaking_dot_mailer._invoke = invoke
+        self.assertEqual((circuit_breaker.stats()['recent_calls'], circuit_breaker.stats()['recent_failures']),
+                         (1, 0))
+        self.server.http_error_rate = 1.0
+        for number in range(3):
+            breaking_dot_mailer.get_contact_by_email('nobody@example.com')
+        self.assertEqual(circuit_breaker.state, CircuitBreaker.OPEN)
+
+    def test_metrics(self):
+        metrics = DotMailerMetrics()
+        finished = []
+        metrics.add_post_call_hook(lambda operation, seconds, error_code: finished.append((operation, error_code)))
+        measured_dot_mailer = PyDotMailer(api_username='test', api_password='test', api_url=self.server.api_url,
+                                          metrics=metrics)
+        contact_id = self.server.add_contact('metrics@example.com')
+        self.assertTrue(measured_dot_mailer.get_contact_by_id(contact_id).get('ok'))
+        measured_dot_mailer.get_contact_by_email('nobody@example.com')
+        self.assertEqual(finished, [('GetContactById', None),
+                                    ('GetContactByEmail',
+                                     PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_CONTACT_NOT_FOUND)])
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['GetContactById']['calls'], 1)
+        self.assertEqual(snapshot['GetContactById']['seconds_buckets'][-1], ('+Inf', 1))
+        self.assertTrue(snapshot['GetContactById']['request_bytes'] > 0)
+        self.assertTrue(snapshot['GetContactById']['response_bytes'] > 0)
+        self.assertEqual(snapshot['GetContactByEmail']['errors'],
+                         {PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_CONTACT_NOT_FOUND: 1})
+        self.assertEqual(snapshot['GetContactByEmail']['in_flight'], 0)
+        self.assertTrue('pydotmailer_call_duration_seconds_count{operation="GetContactById"} 1'
+                        in metrics.prometheus_text())
+
+    def test_profiler(self):
+        profiler = DotMailerProfiler()
+        profiled_dot_mailer = PyDotMailer(api_username='test', api_password='test', api_url=self.server.api_url,
+                                          profiler=profiler)
+        contact_id = self.server.add_contact('profiled@example.com', {'FIRSTNAME': 'Pro'})
+        for _ in range(3):
+            self.assertEqual(profiled_dot_mailer.get_contact_by_id(contact_id).get('d_fields'), {'FIRSTNAME': 'Pro'})
+        totals = profiler.snapshot()['GetContactById']
+        self.assertEqual(totals['calls'], 3)
+        self.assertEqual(sorted(totals['phases'].keys()), sorted(PHASES))
+        for phase, times in totals['phases'].items():
+            self.assertEqual(times['count'], 3, phase)
+            self.assertTrue(times['wall_seconds'] >= 0, phase)
+        self.assertTrue('GetContactById' in profiler.report())
+
+    def test_pickle_and_processes(self):
+        contact_ids = [self.server.add_contact('process%d@example.com' % number) for number in range(20)]
+        copied_dot_mailer = pickle.loads(pickle.dumps(self.dot_mailer))
+        self.assertEqual(copied_dot_mailer.api_url, self.server.api_url)
+        self.assertEqual(copied_dot_mailer.get_contact_by_id(contact_ids[0]).get('email'), 'process0@example.com')
+        results = dict(send_campaign_to_contacts_in_processes(self.dot_mailer, CAMPAIGN_ID, contact_ids, processes=2,
+                                                              chunk_size=5))
+        self.assertEqual(sorted(results.keys()), sorted(contact_ids))
+        self.assertTrue(all(dict_result.get('ok') for dict_result in results.values()))
+        self.assertEqual(self.dot_mailer.last_send_stats['sent'], 20)
+        self.assertEqual(sorted(self.server.sends), sorted((CAMPAIGN_ID, contact_id) for contact_id in contact_ids))
+
+    def test_account_pool(self):
+        contact_ids = [self.server.add_contact('account%d@example.com' % number) for number in range(10)]
+        with AccountPool(workers=4, max_in_flight_per_account=2, api_url=self.server.api_url) as account_pool:
+            account_pool.add_account('large', 'test')
+            account_pool.add_account('small', 'test')
+            large_futures = [account_pool.submit('large', 'send_campaign_to_contact', CAMPAIGN_ID,
+                                                 contact_ids[number % 10]) for number in range(100)]
+            small_future = account_pool.submit('small', 'send_campaign_to_contact', CAMPAIGN_ID + 1, contact_ids[0])
+            self.assertEqual(small_future.result().get('error_code'),
+                             PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_CAMPAIGN_NOT_FOUND)
+            # the small account's call was served in turn, not after the large account's queue
+            self.assertFalse(all(future.done() for future in large_futures))
+            self.assertTrue(all(future.result().get('ok') for future in large_futures))
+            stats = account_pool.stats()
+        self.assertEqual(stats['large']['completed'], 100)
+        self.assertEqual(stats['small']['errors'], {PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_CAMPAIGN_NOT_FOUND: 1})
+
+    def test_send_queue(self):
+        folder = tempfile.mkdtemp()
+        try:
+            path = os.path.join(folder, 'send_queue.db')
+            contact_ids = [self.server.add_contact('queued%d@example.com' % number) for number in range(10)]
+            self.server.suppressed_contact_ids.add(contact_ids[5])
+            send_queue = SendQueue(self.dot_mailer, path, workers=3, claim_size=4)
+            self.assertEqual(send_queue.enqueue_many(CAMPAIGN_ID, contact_ids), 10)
+            self.assertFalse(send_queue.enqueue(CAMPAIGN_ID, contact_ids[1]))  # already queued
+            # a drain which dies after claiming the first two items
+            SendQueue(self.dot_mailer, path)._claim(2, {})
+            stats = SendQueue(self.dot_mailer, path, lease_seconds=0).drain()
+            self.assertEqual((stats['recovered'], stats['sent'], stats['failed']), (2, 7, 1))
+            self.assertEqual(send_queue.depth(), {'pending': 0, 'in_progress': 0, 'sent': 7, 'failed': 1,
+                                                  'unknown': 2})
+            self.assertEqual(send_queue.get(CAMPAIGN_ID, contact_ids[5])['error_code'],
+                             PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_CONTACT_UNSUBSCRIBED)
+            self.assertEqual(len(self.server.sends), 7)
+            self.assertEqual(send_queue.requeue_unknown(), 2)
+            self.assertEqual(send_queue.drain()['sent'], 2)
+            self.assertEqual(len(set(self.server.sends)), 9)
+            # recording the first outcome fails while two more sends are running and one is queued: the queued one
+            # and those never claimed by fan_out must go back to pending
+            slow_dot_mailer = PyDotMailer(api_username='test', api_password='test', api_url=self.server.api_url)
+            send_campaign_to_contact = slow_dot_mailer.send_campaign_to_contact
+
+            def slow_send(campaign_id, contact_id, send_date=None):
+                if contact_id != contact_ids[0]:
+                    time.sleep(0.5)
+                return send_campaign_to_contact(campaign_id, contact_id, send_date=send_date)
+            slow_dot_mailer.send_campaign_to_contact = slow_send
+            failing_queue = SendQueue(slow_dot_mailer, os.path.join(folder, 'failing.db'), workers=2, claim_size=10)
+            failing_queue.enqueue_many(CAMPAIGN_ID, contact_ids)
+
+            def failing_record(item, dict_result):
+                raise sqlite3.OperationalError('disk I/O error')
+            failing_queue._record = failing_record
+            self.assertRaises(sqlite3.OperationalError, failing_queue.drain)
+            self.assertEqual(failing_queue.depth(), {'pending': 7, 'in_progress': 3, 'sent': 0, 'failed': 0,
+                                                     'unknown': 0})
+        finally:
+            shutil.rmtree(folder)
+
+    def test_sqlite_contact_cache(self):
+        folder = tempfile.mkdtemp()
+        try:
+            backend = SqliteContactCacheBackend(os.path.join(folder, 'cache.db'))
+            contact_cache = ContactCache(backend=backend)
+            d_fields = {'FIRSTNAME': 'Cached', 'BIRTHDAY': datetime(1990, 5, 17), 'SPEND': Decimal('12.50'),
+                        'VIP': True, 'VISITS': 3, 'POSTCODE': None}
+            contact_cache.put({'ok': True, 'contact_id': 4321, 'email': 'cached@example.com', 'd_fields': d_fields})
+            dict_result = ContactCache(backend=SqliteContactCacheBackend(backend.path)).get_by_id(4321)
+            self.assertEqual((dict_result.get('email'), dict_result.get('d_fields')), ('cached@example.com', d_fields))
+            # stored as JSON: a pickle in the file is never loaded
+            backend._connection().execute('UPDATE contact_cache SET value = ?',
+                                          (sqlite3.Binary(pickle.dumps({'ok': True}, 2)),))
+            self.assertEqual(contact_cache.get_by_email('cached@example.com'), None)
+            contact_fingerprints = ContactFingerprints(backend=backend)
+            contact_fingerprints.remember(ADDRESS_BOOK_ID, 'cached@example.com', 4321, [('FIRSTNAME', 'Cached')],
+                                          ('Html', 'Unknown', 'Unknown'))
+            self.assertEqual(contact_fingerprints.unchanged(ADDRESS_BOOK_ID, 'cached@example.com',
+                                                            [('firstname', 'Cached')], ('Html', 'Unknown', 'Unknown')),
+                             4321)
+        finally:
+            shutil.rmtree(folder)
+
+    def test_contact_fingerprints(self):
+        contact_fingerprints = ContactFingerprints()
+        upserting_dot_mailer = PyDotMailer(api_username='test', api_password='test', api_url=self.server.api_url,
+                                           contact_fingerprints=contact_fingerprints)
+        dict_result = upserting_dot_mailer.add_contact_to_address_book(ADDRESS_BOOK_ID, 'resync@example.com',
+                                                                       {'firstname': 'Re', 'postcode': 'N1'})
+        self.assertTrue(dict_result.get('ok') and not dict_result.get('skipped'), dict_result)
+        contact_id = dict_result.get('contact_id')
+        dict_result = upserting_dot_mailer.add_contact_to_address_book(ADDRESS_BOOK_ID, 'Resync@example.com',
+                                                                       {'FIRSTNAME': 'Re', 'postcode': 'N1'})
+        self.assertEqual((dict_result.get('skipped'), dict_result.get('contact_id')), (True, contact_id))
+        dict_result = upserting_dot_mailer.add_contact_to_address_book(ADDRESS_BOOK_ID, 'resync@example.com',
+                                                                       {'firstname': 'Re', 'postcode': 'N2'})
+        self.assertFalse(dict_result.get('skipped'))
+        self.assertFalse(upserting_dot_mailer.add_contact_to_address_book(ADDRESS_BOOK_ID + 1, 'resync@example.com',
+                                                                          {'postcode': 'N2'}).get('skipped'))
+        # seeded from a lookup
+        seeded_id = self.server.add_contact('seeded@example.com', {'FIRSTNAME': 'Seed', 'POSTCODE': 'E2'})
+        contact_fingerprints.remember_lookup(ADDRESS_BOOK_ID, self.dot_mailer.get_contact_by_id(seeded_id))
+        self.assertTrue(upserting_dot_mailer.add_contact_to_address_book(ADDRESS_BOOK_ID, 'seeded@example.com',
+                                                                         {'firstname': 'Seed'}).get('skipped'))
+        self.assertEqual(contact_fingerprints.stats()['skipped'], 2)
+        self.assertEqual(contact_fingerprints.stats()['written'], 3)
+
+    def test_upsert_contacts(self):
+        contacts = [{'email': 'one@example.com', 'firstname': 'One'}, {'postcode': 'N1'}]
+        dict_results = dict(self.dot_mailer.upsert_contacts(ADDRESS_BOOK_ID, contacts))
+        self.assertEqual(self.dot_mailer.last_upsert_stats['route'], 'single')
+        self.assertTrue(dict_results['one@example.com'].get('contact_id'), dict_results)
+        self.assertEqual(dict_results[None].get('error_code'),
+                         PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_CONTACT_NOT_FOUND)
+        # many contacts are imported, in one upload per set of fields
+        contacts = [{'email': 'many%d@example.com' % number, 'firstname': 'Many, "%d"' % number}
+                    for number in range(200)] + [{'email': 'postcode@example.com', 'postcode': 'N1', 'firstname': ''}]
+        dict_results = dict(self.dot_mailer.upsert_contacts(ADDRESS_BOOK_ID, iter(contacts),
+                                                            wait_to_complete_seconds=10))
+        stats = self.dot_mailer.last_upsert_stats
+        self.assertEqual((stats['route'], stats['uploads'], stats['ok']), ('bulk', 2, 201), stats)
+        self.assertEqual((dict_results['many7@example.com'].get('result'),
+                          dict_results['many7@example.com'].get('imported')), ('Finished', True))
+        self.assertEqual(self.dot_mailer.get_contact_by_email('many7@example.com').get('d_fields'),
+                         {'FIRSTNAME': 'Many, "7"'})
+        self.assertEqual(self.dot_mailer.get_contact_by_email('postcode@example.com').get('d_fields'),
+                         {'POSTCODE': 'N1'})
+
+
+if __name__ == '__main__':
+    unittest.main()
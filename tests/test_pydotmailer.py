@@ -4,6 +4,7 @@ ${workspace_loc:TriggeredMessagingV1/python/lib/tests/test_api_token_handling.py
 
 """
 import random
+import time
 
 import xmlrunner # http://www.stevetrefethen.com/blog/Publishing-Python-unit-test-results-in-Jenkins.aspx
 import unittest
@@ -63,6 +64,15 @@ class TestPyDotMailer(TMSBaseTestCase):
             logger.error("Failure return: %s" % (dict_result) )
         self.assertTrue(dict_result.get('ok'), 'add_contacts_to_address_book returned failure ')
 
+    def test_add_contacts_to_address_book_from_file(self):
+        """ upload straight from a file path, split into several uploads """
+        contacts_path = self.resolve_relative_path(__file__, "fixtures/test_contacts.csv")
+        dict_result = self.dot_mailer.add_contacts_to_address_book(address_book_id=self.address_book_id,
+                                                                   contacts_path=contacts_path,
+                                                                   max_upload_bytes=40,
+                                                                   wait_to_complete_seconds=60)
+        self.assertTrue(dict_result.get('ok'), 'add_contacts_to_address_book returned failure %s' % dict_result)
+        self.assertTrue(len(dict_result.get('progress_ids')) > 1)
 
         # =======
         
@@ -114,6 +124,60 @@ class TestPyDotMailer(TMSBaseTestCase):
         self.assertEqual(dict_result.get('d_fields').get('POSTCODE'), test_postcode)
         pass #
 
+    def test_data_field_schema(self):
+        """ d_fields checked against the account's data fields, and bad ones rejected without calling dotMailer """
+        from pydotmailer.dotmailerdatafields import DataFieldSchema
+        dict_result = self.dot_mailer.list_contact_data_labels()
+        self.assertTrue(dict_result.get('ok'))
+        self.assertTrue('POSTCODE' in [label.get('name') for label in dict_result.get('data_labels')])
+        checked_dot_mailer = PyDotMailer(api_username=Secrets.api_username, api_password=Secrets.api_password,
+                                         data_field_schema=DataFieldSchema())
+        dict_result = checked_dot_mailer.add_contact_to_address_book(address_book_id=self.address_book_id,
+                                                                     email_address=Secrets.test_address,
+                                                                     d_fields={'no_such_field_x': 'x'})
+        self.assertEqual(dict_result.get('error_code'), PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_DATA_FIELDS)
+        test_postcode = "%s" % random.randint(0,100000)
+        for i in range(2):  # the second call uses a clone of the contact template
+            dict_result = checked_dot_mailer.add_contact_to_address_book(address_book_id=self.address_book_id,
+                                                                         email_address=Secrets.test_address,
+                                                                         d_fields={'postcode': test_postcode})
+            self.assertTrue(dict_result.get('ok'), dict_result)
+        dict_result = checked_dot_mailer.get_contact_by_email(Secrets.test_address)
+        self.assertEqual(dict_result.get('d_fields').get('POSTCODE'), test_postcode)
+
+    def test_compact_results(self):
+        """ compact results without the suds payload read just like the usual dicts """
+        compact_dot_mailer = PyDotMailer(api_username=Secrets.api_username, api_password=Secrets.api_password,
+                                         compact_results=True, keep_raw_results=False)
+        dict_result = self.dot_mailer.get_contact_by_email(Secrets.test_address)
+        compact_result = compact_dot_mailer.get_contact_by_email(Secrets.test_address)
+        self.assertTrue(compact_result.get('ok'))
+        self.assertFalse('result' in compact_result)
+        self.assertFalse(hasattr(compact_result, '__dict__'))
+        for key in ('contact_id', 'email', 'd_fields'):
+            self.assertEqual(compact_result[key], dict_result.get(key), key)
+        self.assertEqual(compact_result.to_dict(), compact_result)
+        compact_result = compact_dot_mailer.get_contact_by_email('notfound%s' % Secrets.test_address)
+        self.assertEqual(compact_result.get('error_code'),
+                         PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_CONTACT_NOT_FOUND)
+        self.assertTrue(compact_dot_mailer.last_exception is None)
+
+    def test_get_contacts_by_emails(self):
+        """ bulk lookups: each address once, not found is an ordinary result, ordered keeps the order given """
+        missing_address = 'notfound%s' % Secrets.test_address
+        emails = [missing_address, Secrets.test_address, Secrets.test_address.upper()]
+        results = list(self.dot_mailer.get_contacts_by_emails(emails, max_workers=2, ordered=True))
+        self.assertEqual([email for email, dict_result in results], [missing_address, Secrets.test_address])
+        self.assertEqual(results[0][1].get('error_code'),
+                         PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_CONTACT_NOT_FOUND)
+        self.assertTrue(results[1][1].get('ok'))
+        stats = self.dot_mailer.last_lookup_stats
+        self.assertEqual((stats['found'], stats['not_found'], stats['duplicates']), (1, 1, 1))
+        contact_id = results[1][1].get('contact_id')
+        results = dict(self.dot_mailer.get_contacts_by_ids([contact_id, contact_id]))
+        self.assertEqual(list(results.keys()), [contact_id])
+        self.assertEqual(results[contact_id].get('email').lower(), Secrets.test_address.lower())
+
     def test_get_contact_functions(self):
         # first create a test contact
         s_contact = "sdf@sdlfsd.com" # todo
@@ -134,6 +198,157 @@ class TestPyDotMailer(TMSBaseTestCase):
         self.assertTrue(dict_result.get('ok'))
         self.assertEqual(dict_result.get('email'), email)
 
+    def test_wsdl_definition_shared(self):
+        """ a second instance must reuse the parsed WSDL rather than downloading it again """
+        other_dot_mailer = PyDotMailer(api_username=Secrets.api_username, api_password=Secrets.api_password)
+        self.assertTrue(other_dot_mailer.client.wsdl is self.dot_mailer.client.wsdl)
+        self.assertFalse(other_dot_mailer.client is self.dot_mailer.client)
+
+    def test_lazy_construction(self):
+        """ lazy construction must not connect, but must still reject missing credentials straight away """
+        lazy_dot_mailer = PyDotMailer(api_username=Secrets.api_username, api_password=Secrets.api_password, lazy=True)
+        self.assertFalse(hasattr(lazy_dot_mailer._thread_state, 'client'))
+        self.assertIsNotNone(lazy_dot_mailer.client)
+        self.assertRaises(Exception, PyDotMailer, api_username=Secrets.api_username, api_password='', lazy=True)
+
+    def test_read_timeout(self):
+        """ a call which exceeds the pool's read timeout must come back as TIMEOUT_ERROR """
+        from pydotmailer.dotmailertransport import DotMailerConnectionPool
+        impatient_dot_mailer = PyDotMailer(api_username=Secrets.api_username, api_password=Secrets.api_password,
+                                           connection_pool=DotMailerConnectionPool(read_timeout=0.001))
+        dict_result = impatient_dot_mailer.get_contact_by_email(Secrets.test_address)
+        self.assertFalse(dict_result.get('ok'))
+        self.assertEqual(dict_result.get('error_code'), PyDotMailer.RESULT_FIELDS_ERROR_CODE.TIMEOUT_ERROR)
+
+    def test_async_get_contact_by_email(self):
+        """ the asyncio client must return the same result dicts as the blocking one """
+        import asyncio
+        from pydotmailer.dotmailerasync import AsyncPyDotMailer
+        async_dot_mailer = AsyncPyDotMailer(dot_mailer=self.dot_mailer, max_concurrency=2)
+        dict_results = asyncio.get_event_loop().run_until_complete(asyncio.gather(
+            async_dot_mailer.get_contact_by_email(Secrets.test_address),
+            async_dot_mailer.get_contact_by_email(Secrets.test_address)))
+        async_dot_mailer.close()
+        for dict_result in dict_results:
+            self.assertTrue(dict_result.get('ok'))
+            self.assertEqual(dict_result.get('email'), Secrets.test_address)
+
+    def test_send_campaign_to_contacts(self):
+        """ bulk send yields one result per contact and records throughput """
+        dict_result = self.dot_mailer.get_contact_by_email(Secrets.test_address)
+        contact_id = dict_result.get('contact_id')
+        results = list(self.dot_mailer.send_campaign_to_contacts(Secrets.campaign_id, [contact_id], max_workers=2))
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0][0], contact_id)
+        self.assertTrue(results[0][1].get('ok'), "bulk send failed: %s" % results[0][1])
+        self.assertEqual(self.dot_mailer.last_send_stats.get('sent'), 1)
+
+    def test_contact_cache(self):
+        """ a cached lookup must match the live one, by email or id, and adding the contact must invalidate it """
+        from pydotmailer.dotmailercontactcache import ContactCache
+        contact_cache = ContactCache()
+        cached_dot_mailer = PyDotMailer(api_username=Secrets.api_username, api_password=Secrets.api_password,
+                                        contact_cache=contact_cache)
+        live_result = cached_dot_mailer.get_contact_by_email(Secrets.test_address)
+        self.assertTrue(live_result.get('ok'))
+        cached_result = cached_dot_mailer.get_contact_by_id(live_result.get('contact_id'))
+        self.assertTrue(cached_result.get('cached'))
+        self.assertEqual(cached_result.get('d_fields'), live_result.get('d_fields'))
+        self.assertEqual(contact_cache.stats().get('hits'), 1)
+        cached_dot_mailer.add_contact_to_address_book(address_book_id=self.address_book_id,
+                                                      email_address=Secrets.test_address, d_fields={})
+        self.assertIsNone(contact_cache.get_by_email(Secrets.test_address))
+
+    def test_rate_limiter(self):
+        """ calls must be paced to the configured rate """
+        from pydotmailer.dotmailerratelimit import AccountRateLimiter
+        rate_limiter = AccountRateLimiter(rate=2, burst=1)
+        limited_dot_mailer = PyDotMailer(api_username=Secrets.api_username, api_password=Secrets.api_password,
+                                         rate_limiter=rate_limiter)
+        started = time.time()
+        for i in range(3):
+            self.assertTrue(limited_dot_mailer.get_contact_by_email(Secrets.test_address).get('ok'))
+        self.assertTrue(time.time() - started >= 0.9)
+        self.assertTrue(rate_limiter.stats().get('account').get('waited_seconds') > 0)
+
+    def test_retry_policy(self):
+        """ results report attempts; timeouts are retried, but not for sends, which may have gone through """
+        import socket
+        from pydotmailer.dotmailerretry import RetryPolicy
+        retry_policy = RetryPolicy(max_attempts=2)
+        retrying_dot_mailer = PyDotMailer(api_username=Secrets.api_username, api_password=Secrets.api_password,
+                                          retry_policy=retry_policy)
+        dict_result = retrying_dot_mailer.get_contact_by_email(Secrets.test_address)
+        self.assertTrue(dict_result.get('ok'))
+        self.assertEqual(dict_result.get('attempts'), 1)
+        self.assertIsNotNone(dict_result.get('elapsed_seconds'))
+        timeout_error_code = PyDotMailer.RESULT_FIELDS_ERROR_CODE.TIMEOUT_ERROR
+        self.assertTrue(retry_policy.is_retryable('GetContactByEmail', {}, socket.timeout(), timeout_error_code))
+        self.assertFalse(retry_policy.is_retryable('SendCampaignToContact', {}, socket.timeout(), timeout_error_code))
+
+    def test_circuit_breaker(self):
+        """ an open circuit fails calls straight away with ERROR_CIRCUIT_OPEN, and reports the change of state """
+        from pydotmailer.dotmailerbreaker import CircuitBreaker
+        state_changes = []
+        circuit_breaker = CircuitBreaker(min_calls=2, open_seconds=60,
+                                         on_state_change=lambda breaker, old, new: state_changes.append(new))
+        guarded_dot_mailer = PyDotMailer(api_username=Secrets.api_username, api_password=Secrets.api_password,
+                                         circuit_breaker=circuit_breaker)
+        self.assertTrue(guarded_dot_mailer.get_contact_by_email(Secrets.test_address).get('ok'))
+        self.assertEqual(circuit_breaker.state, CircuitBreaker.CLOSED)
+        circuit_breaker.record(True, 0.1)
+        circuit_breaker.record(True, 0.1)
+        self.assertEqual(state_changes, [CircuitBreaker.OPEN])
+        started = time.time()
+        dict_result = guarded_dot_mailer.get_contact_by_email(Secrets.test_address)
+        self.assertEqual(dict_result.get('error_code'), PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_CIRCUIT_OPEN)
+        self.assertTrue(time.time() - started < 0.1)
+
+    def test_fast_path_envelopes_conform(self):
+        """ the precompiled requests must mean exactly what suds sends: same elements, namespaces and values """
+        import xml.etree.ElementTree as ElementTree
+        from pydotmailer.dotmailerenvelopes import render_envelope
+
+        def semantics(envelope):
+            """ the document as nested (namespaced tag, attributes, text, children), ignoring prefix names """
+            def element_semantics(element):
+                return (element.tag, sorted(element.attrib.items()), element.text or '',
+                        [element_semantics(child) for child in element])
+            return element_semantics(ElementTree.fromstring(envelope))
+
+        nosend_dot_mailer = PyDotMailer(api_username=Secrets.api_username, api_password=Secrets.api_password)
+        client = nosend_dot_mailer.client
+        client.set_options(nosend=True)
+        awkward_text = u'a&b<c>d"e\'f \u00e9'
+        for operation, kwargs in [
+                ('SendCampaignToContact', {'username': awkward_text, 'password': 'p', 'campaignId': 1,
+                                           'contactid': 2, 'sendDate': '2012-03-28T19:51:00'}),
+                ('GetContactByEmail', {'username': 'u', 'password': awkward_text, 'email': Secrets.test_address}),
+                ('GetContactById', {'username': 'u', 'password': 'p', 'id': 367568124})]:
+            suds_envelope = getattr(client.service, operation)(**kwargs).envelope
+            fast_envelope = render_envelope(operation, kwargs)
+            self.assertEqual(semantics(fast_envelope), semantics(suds_envelope), operation)
+            for namespace in (b'xmlns:apic="http://apiconnector.com"', b'xmlns:xsd="http://www.w3.org/2001/XMLSchema"'):
+                self.assertTrue(namespace in fast_envelope)
+                self.assertTrue(namespace in suds_envelope)
+
+    def test_fast_path_contact_parser(self):
+        """ contact lookups parsed straight from the XML must give what the suds path gives """
+        suds_dot_mailer = PyDotMailer(api_username=Secrets.api_username, api_password=Secrets.api_password)
+        fast_dot_mailer = PyDotMailer(api_username=Secrets.api_username, api_password=Secrets.api_password,
+                                      fast_path=True)
+        suds_result = suds_dot_mailer.get_contact_by_email(Secrets.test_address)
+        fast_result = fast_dot_mailer.get_contact_by_email(Secrets.test_address)
+        self.assertTrue(fast_result.get('ok'))
+        self.assertFalse('result' in fast_result)
+        for key in ('contact_id', 'email', 'd_fields'):
+            self.assertEqual(fast_result.get(key), suds_result.get(key), key)
+        fast_result = fast_dot_mailer.get_contact_by_id(suds_result.get('contact_id'))
+        self.assertEqual(fast_result.get('d_fields'), suds_result.get('d_fields'))
+        self.assertTrue('result' in fast_dot_mailer.get_contact_by_email(Secrets.test_address, raw_result=True))
+        fast_result = fast_dot_mailer.get_contact_by_email('notfound%s' % Secrets.test_address)
+        self.assertEqual(fast_result.get('error_code'),
+                         PyDotMailer.RESULT_FIELDS_ERROR_CODE.ERROR_CONTACT_NOT_FOUND)
 
 
 # use a custom TestRunner to create JUnit output files in TriggeredMessagingV1/results